@@ -0,0 +1,62 @@
+from polin.async_train import train_async
+
+import numpy as np
+import pandas as pd
+
+import json
+import os
+import argparse
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Measuring the throughput (transitions/s) of asynchronous Q-learning for several numbers of workers")
+
+    parser.add_argument("-f", "--exp_param_file", type=str, required=True) # QLearning experiment
+    parser.add_argument("-w", "--n_workers", type=int, nargs='+',
+                        default=[1, 2, 4, 8], required=False)
+    parser.add_argument("-ne", "--episodes_per_worker", type=int,
+                        default=10, required=False) # the same work per worker, so the time stays the same under linear scaling
+    parser.add_argument("-o", "--output_dir", type=str,
+                        default="async_benchmark", required=False)
+    parser.add_argument("-s", "--seed", type=int,
+                        default=0, required=False)
+
+    args = parser.parse_args()
+
+    with open(args.exp_param_file) as f:
+        param_dict = json.load(f)
+
+    controller_dict = param_dict['controller']
+    if controller_dict['type_name'] != 'QLearning':
+        raise ValueError("Asynchronous training is only applicable to QLearning controllers")
+
+    agent_param_dict = controller_dict['agent']
+    training = controller_dict['training']
+
+    print(f"{os.cpu_count()} CPUs available\n")
+
+    rows = []
+    for n_workers in args.n_workers:
+        exp_dir = os.path.join(os.getcwd(), args.output_dir, str(n_workers)) + '/'
+        os.makedirs(exp_dir, exist_ok=True)
+
+        n_episodes = args.episodes_per_worker * n_workers
+        _, stats = train_async(np.zeros((agent_param_dict['n_states'], agent_param_dict['n_actions'])),
+                               param_dict['env'], param_dict['simulation'], agent_param_dict,
+                               n_episodes, training['decay'], training['episode_time_max'], exp_dir, n_workers,
+                               seed = args.seed)
+        rows.append(stats)
+
+        print(f"{n_workers} workers: {stats['n_transitions']} transitions in {round(stats['seconds'], 1)} s "
+              f"({round(stats['transitions_per_s'], 2)} transitions/s)")
+
+    df = pd.DataFrame(rows)
+    df['speedup'] = df['transitions_per_s'] / df['transitions_per_s'].iloc[0] * df['n_workers'].iloc[0]
+    df['efficiency'] = df['speedup'] / df['n_workers']
+
+    output_file = os.path.join(os.getcwd(), args.output_dir, "async_benchmark.tsv")
+    df.to_csv(output_file, sep='\t', index=False)
+
+    print(f"\n{df.to_string(index=False)}")
+    print(f"\nResults written to {output_file}")
+    print("Done")
@@ -0,0 +1,50 @@
+from polin.surrogate import build_surrogate, SurrogateModel, surrogate_errors, default_n_grid
+
+import json
+import argparse
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Tabulating the one-step map of the env of an experiment, to train on it instead of the ODE model")
+
+    parser.add_argument("-f", "--exp_param_file", type=str, required=True) # env, simulation & action (Din options, drug time) parameters
+    parser.add_argument("-o", "--output_file", type=str, required=True) # surrogate files, without extension
+
+    parser.add_argument("-ng", "--n_grid", type=int, nargs=3,
+                        default=list(default_n_grid), required=False) # number of nodes of the E, Z & D axes
+    parser.add_argument("-bs", "--batch_size", type=int,
+                        default=256, required=False)
+    parser.add_argument("-n", "--n_workers", type=int,
+                        default=1, required=False)
+    parser.add_argument("--max_step", type=float,
+                        default=0.01, required=False)
+
+    parser.add_argument("-ne", "--n_error_samples", type=int,
+                        default=1000, required=False) # random states to measure the errors against the ODE model, 0 to skip
+
+    args = parser.parse_args()
+
+    with open(args.exp_param_file) as f:
+        param_dict = json.load(f)
+
+    controller_dict = param_dict['controller']
+    if controller_dict['type_name'] in ['QLearning', 'LinearQ']:
+        Din_options = tuple(controller_dict['agent']['Din_options'])
+        drug_time = controller_dict['agent']['drug_time']
+    else:
+        Din_options = (0.0, controller_dict['Din'])
+        drug_time = controller_dict['drug_time']
+
+    print(f"Tabulating the env on a grid of {args.n_grid} states x {len(Din_options)} actions ...\n")
+    build_surrogate(args.output_file, param_dict['env'], param_dict['simulation'], Din_options, drug_time,
+                    n_grid = tuple(args.n_grid), batch_size = args.batch_size, n_workers = args.n_workers,
+                    max_step = args.max_step)
+
+    if args.n_error_samples > 0:
+        print(f"Measuring the errors against the ODE model on {args.n_error_samples} random states per action ...\n")
+        df = surrogate_errors(SurrogateModel(args.output_file), n_samples = args.n_error_samples, max_step = args.max_step)
+        df.to_csv(args.output_file + ".errors.tsv", sep="\t", index=False)
+
+        print(df.groupby('Din')[['err_E', 'err_Z', 'err_D', 'miss_t5p', 'miss_tTiny']].agg(['mean', 'max']).to_string())
+
+    print("Done")
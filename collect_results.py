@@ -0,0 +1,36 @@
+from polin.result_store import ResultStore
+
+import json
+import os
+import argparse
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Collecting the stored results of a collection of experiments into a single result store file")
+
+    parser.add_argument("-f", "--collection_param_file", type=str, required=True)
+
+    parser.add_argument("-tqe", "--test_qtable_episode",
+                        default='last', required=False)
+    parser.add_argument("-np", "--n_points", type=int,
+                        default=2000, required=False) # number of rows of the downsampled trajectories
+
+    args = parser.parse_args()
+
+    with open(args.collection_param_file) as f:
+        collection_ID = json.load(f)['collection_ID']
+
+    # same collection directory & store file as set by `parallel_experiments.py`
+    collection_dir = os.getcwd() + '/' + collection_ID + '/'
+    store_file = collection_dir + 'results.sqlite'
+
+    print(f"Collecting results of collection {collection_ID} into {store_file} ...\n")
+
+    store = ResultStore(store_file)
+    count = store.ingest_collection(collection_dir,
+                                    qtable_episode = args.test_qtable_episode,
+                                    n_points = args.n_points)
+    store.close()
+
+    print(f"Results of {count} experiments collected")
+    print("Done")
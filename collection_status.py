@@ -0,0 +1,74 @@
+from parallel_experiments import ExperimentsCollection
+from polin.job_status import JobStatusStore, job_states
+
+import numpy as np
+
+import os
+import time
+import argparse
+
+def format_duration(seconds: float) -> str:
+    if seconds is None or not np.isfinite(seconds):
+        return "N/A"
+    h, rem = divmod(int(seconds), 3600)
+    m, s = divmod(rem, 60)
+    return f"{h}h{m:02d}m{s:02d}s"
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Summarizing the job status of a collection run with `parallel_experiments.py --job_status`, & re-queueing failed jobs")
+
+    parser.add_argument("-f", "--collection_param_file", type=str, required=True)
+
+    parser.add_argument("-ns", "--n_slowest", type=int,
+                        default=5, required=False) # number of slowest experiments to list
+    parser.add_argument("--stale_hours", type=float,
+                        default=0.5, required=False) # running jobs without heartbeat (every minute) for longer are considered failed (e.g. killed by SLURM)
+
+    parser.add_argument("--requeue", action='store_true') # default is False, if given failed & stale jobs are run again
+    parser.add_argument("--local", action='store_true') # default is False, as in `parallel_experiments.py`
+
+    args = parser.parse_args()
+
+    collection = ExperimentsCollection(args.collection_param_file)
+
+    if not os.path.exists(collection.job_status_file):
+        raise RuntimeError("Job status store does not exist. Please run the collection with `--job_status`.")
+
+    status = JobStatusStore(collection.job_status_file)
+    df = status.jobs()
+    summary = status.summary()
+
+    stale = df[(df['state'] == 'running') & (time.time() - df['updated'] > args.stale_hours * 3600.0)]
+
+    print(f"Collection {collection.param_dict['collection_ID']}: {len(df)} jobs")
+    print("\t".join(f"{s}: {summary['counts'][s]}" for s in job_states) + f"\tstale: {len(stale)}")
+    print(f"Throughput: {summary['episodes_per_s']:.2f} episodes/s (running jobs) \t| {summary['jobs_per_hour']:.2f} jobs/h (finished jobs)")
+    print(f"Remaining episodes: {summary['remaining_episodes']} \t| ETA: {format_duration(summary['eta'])}\n")
+
+    started = df[df['started'].notna()].sort_values('elapsed', ascending=False)
+    if len(started) > 0:
+        print(f"Slowest experiments:")
+        for _, r in started.head(args.n_slowest).iterrows():
+            print(f"{r['exp_ID']} \t| {r['state']} \t| {format_duration(r['elapsed'])} \t| episodes: {r['episodes_done']}/{r['n_episodes']} \t| job: {r['job_ID']}")
+        print()
+
+    failed = df[df['state'] == 'failed']
+    if len(failed) > 0:
+        print(f"Failed experiments:")
+        for _, r in failed.iterrows():
+            print(f"{r['exp_ID']} \t| job: {r['job_ID']} \t| {r['error']}")
+        print()
+
+    if args.requeue:
+        to_requeue = list(failed['exp_ID']) + list(stale['exp_ID'])
+        if len(to_requeue) == 0:
+            print("Nothing to re-queue")
+        else:
+            print(f"Re-queueing {len(to_requeue)} experiments ...\n")
+            exp_indices = [int(exp_ID.split('.')[-1]) for exp_ID in to_requeue]
+            # with the options of the original run of the collection
+            collection.run(local = args.local, job_status = True, exp_indices = exp_indices, **status.run_options())
+
+    status.close()
+    print("Done")
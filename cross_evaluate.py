@@ -0,0 +1,79 @@
+from polin.evaluation import cross_evaluate, eval_metrics
+
+import numpy as np
+import pandas as pd
+
+import json
+import os
+import argparse
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Evaluating the learned Q-learning policy of every experiment in a collection on the envs of all the other experiments")
+
+    parser.add_argument("-f", "--collection_param_file", type=str, required=True)
+
+    parser.add_argument("-tdb", "--test_done_break", action='store_true') # default is False
+    parser.add_argument("-tqe", "--test_qtable_episode",
+                        default='last', required=False)
+
+    parser.add_argument("-bs", "--batch_size", type=int,
+                        default=64, required=False) # number of envs simulated together
+    parser.add_argument("-n", "--n_workers", type=int,
+                        default=1, required=False)
+
+    args = parser.parse_args()
+
+    with open(args.collection_param_file) as f:
+        collection_ID = json.load(f)['collection_ID']
+
+    # same collection directory as set by `parallel_experiments.py`
+    collection_dir = os.getcwd() + '/' + collection_ID + '/'
+    metadata = pd.read_csv(collection_dir + "metadata.tsv", sep='\t')
+
+    print(f"Loading learned Q-tables of collection {collection_ID} ...\n")
+
+    env_param_dicts = []
+    qtables = []
+    for exp_ID in metadata['exp_ID']:
+        exp_dir = collection_dir + exp_ID + '/'
+        with open(exp_dir + "params." + exp_ID + ".json") as f:
+            param_dict = json.load(f)
+
+        if param_dict['controller']['type_name'] != 'QLearning':
+            raise ValueError("Cross evaluation is only applicable to collections of QLearning controllers")
+
+        n_episodes = param_dict['controller']['training']['n_episodes']
+        ep = n_episodes - 1 if args.test_qtable_episode == 'last' else int(args.test_qtable_episode)
+
+        qtables.append(np.load(exp_dir + 'learned_qtables/QLearningAgent_values.ep' + str(ep) + '.npy'))
+        env_param_dicts.append(param_dict['env'])
+
+    # simulation & agent parameters are shared by all experiments in a collection
+    sim_param_dict = param_dict['simulation']
+    agent_param_dict = param_dict['controller']['agent']
+
+    N = len(qtables)
+    print(f"Evaluating {N} x {N} pairs of (trained, tested) experiments ...\n")
+
+    result = cross_evaluate(np.stack(qtables), env_param_dicts, sim_param_dict, agent_param_dict,
+                            done_break = args.test_done_break,
+                            batch_size = args.batch_size, n_workers = args.n_workers)
+
+    # long table, one row per pair
+    trained = metadata.add_prefix('trained_').loc[np.repeat(np.arange(N), N)].reset_index(drop=True)
+    tested = metadata.add_prefix('tested_').loc[np.tile(np.arange(N), N)].reset_index(drop=True)
+    df = pd.concat([trained, tested], axis=1)
+    for m in eval_metrics:
+        df[m] = result[m].ravel()
+
+    output_file = collection_dir + "cross_evaluation.tsv"
+    df.to_csv(output_file, sep='\t', index=False, na_rep='N/A')
+
+    # one matrix per measurement, rows: trained experiment, columns: tested experiment
+    for m in eval_metrics:
+        mat = pd.DataFrame(result[m], index=metadata['exp_ID'], columns=metadata['exp_ID'])
+        mat.to_csv(collection_dir + "cross_evaluation." + m + ".tsv", sep='\t', na_rep='N/A')
+
+    print(f"Results written to {output_file}")
+    print("Done")
@@ -0,0 +1,79 @@
+from polin.evaluation import sample_env_params, ensemble_evaluate, ensemble_summary
+from polin.controller import seed_sequence, seed_dict
+
+import numpy as np
+import pandas as pd
+
+import json
+import os
+import argparse
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Evaluating the policy of an experiment on an ensemble of env parameter sets drawn from the uncertainty of the ODE parameters, in batched simulations")
+
+    parser.add_argument("-f", "--exp_param_file", type=str, required=True) # Rational or QLearning experiment
+    parser.add_argument("-u", "--uncertainty_file", type=str, required=True) # distributions of the uncertain ODE parameters (see `polin.evaluation.sample_env_params`)
+
+    parser.add_argument("-m", "--n_samples", type=int,
+                        default=1000, required=False)
+    parser.add_argument("-s", "--seed", type=int,
+                        default=None, required=False) # fresh entropy if not given, recorded in the summary file
+
+    parser.add_argument("-q", "--qtable_file", type=str,
+                        default=None, required=False) # Q-table of a QLearning policy, the last checkpoint of the experiment if not given
+    parser.add_argument("-tdb", "--test_done_break", action='store_true') # default is False
+
+    parser.add_argument("-bs", "--batch_size", type=int,
+                        default=256, required=False) # number of envs simulated together
+    parser.add_argument("-n", "--n_workers", type=int,
+                        default=1, required=False)
+
+    args = parser.parse_args()
+
+    with open(args.exp_param_file) as f:
+        param_dict = json.load(f)
+
+    with open(args.uncertainty_file) as f:
+        distributions = json.load(f)
+
+    exp_ID = param_dict['exp_ID']
+    controller_dict = param_dict['controller']
+
+    # same experiment directory as set by `run_experiment.py`
+    exp_dir = os.getcwd() + '/' + exp_ID + '/'
+    if not os.path.exists(exp_dir):
+        os.mkdir(exp_dir)
+
+    qtable = None
+    if controller_dict['type_name'] == 'QLearning':
+        qtable_file = args.qtable_file
+        if qtable_file is None:
+            qtable_file = exp_dir + 'learned_qtables/QLearningAgent_values.ep' + str(controller_dict['training']['n_episodes'] - 1) + '.npy'
+        qtable = np.load(qtable_file)
+
+    seed = seed_sequence(args.seed)
+    env_param_dicts, samples = sample_env_params(param_dict['env'], distributions, args.n_samples, seed = seed)
+
+    print(f"Evaluating the {controller_dict['type_name']} policy of {exp_ID} on {args.n_samples} samples of {list(distributions)} ...\n")
+
+    df = ensemble_evaluate(env_param_dicts, param_dict['simulation'], controller_dict, qtable = qtable,
+                           done_break = args.test_done_break, batch_size = args.batch_size, n_workers = args.n_workers)
+
+    df = pd.concat([df[['sample', 'valid']], samples, df.drop(columns=['sample', 'valid'])], axis=1)
+
+    output_file = exp_dir + "ensemble." + exp_ID + ".tsv"
+    df.to_csv(output_file, sep='\t', index=False, na_rep='N/A')
+
+    summary = ensemble_summary(df)
+    summary_file = exp_dir + "ensemble_summary." + exp_ID + ".tsv"
+    summary.to_csv(summary_file, sep='\t', index=False, na_rep='N/A')
+
+    # the samples can be drawn again with this seed (`-s` takes the entropy)
+    with open(exp_dir + "ensemble_seed.json", 'w') as f:
+        json.dump(seed_dict(seed), f, indent=4)
+
+    print(f"{int(df['valid'].sum())} of {len(df)} samples simulated (the others have no co-existence equilibrium)\n")
+    print(summary.to_string(index=False))
+    print(f"\nResults written to {output_file}, summary to {summary_file}")
+    print("Done")
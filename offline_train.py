@@ -0,0 +1,46 @@
+from polin.offline import load_transitions, fitted_q_iteration
+
+import numpy as np
+
+import json
+import argparse
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Computing a Q-table from recorded transitions by fitted Q-iteration, without simulations")
+
+    parser.add_argument("-i", "--transition_files", type=str, nargs='+', required=True) # dataset names, without extension
+    parser.add_argument("-f", "--exp_param_file", type=str, required=True) # gamma & reward weights are taken from here, unless given below
+    parser.add_argument("-o", "--output_file", type=str, required=True)
+
+    parser.add_argument("--gamma", type=float, default=None, required=False)
+    parser.add_argument("--w_E", type=float, default=None, required=False)
+    parser.add_argument("--w_D", type=float, default=None, required=False)
+    parser.add_argument("--Din_max", type=float, default=None, required=False)
+
+    parser.add_argument("--n_iter", type=int, default=1000, required=False)
+    parser.add_argument("--tol", type=float, default=1e-8, required=False)
+
+    args = parser.parse_args()
+
+    with open(args.exp_param_file) as f:
+        param_dict = json.load(f)
+
+    gamma = param_dict['controller']['agent']['gamma'] if args.gamma is None else args.gamma
+
+    reward_kwargs = dict(param_dict['simulation']['reward_kwargs'])
+    for k in ["w_E", "w_D", "Din_max"]:
+        if getattr(args, k) is not None:
+            reward_kwargs[k] = getattr(args, k)
+
+    data, header = load_transitions(args.transition_files)
+    print(f"Loaded {len(data)} transitions. Running fitted Q-iteration with gamma={gamma}, reward {reward_kwargs} ...\n")
+
+    qtable, n_sweeps = fitted_q_iteration(data, header['n_states'], header['n_actions'],
+                                          gamma, reward_kwargs, n_iter = args.n_iter, tol = args.tol)
+
+    with open(args.output_file, 'wb') as f:
+        np.save(f, qtable)
+
+    print(f"Q-table computed in {n_sweeps} sweeps & written to {args.output_file}")
+    print("Done")
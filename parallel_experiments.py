@@ -1,11 +1,19 @@
 from typing import List, Dict, Tuple
 import numpy as np
+import pandas as pd
 
 import json
 import os
 import argparse
 import subprocess
 
+from polin.job_status import JobStatusStore
+from polin.controller import seed_sequence, seed_dict
+from polin.evaluation import episodes_to_convergence
+from polin.sim_cache import SimulationCache
+import polin.sim_data as sim_data
+from run_experiment import simulation_key, exported_simulation
+
 from copy import deepcopy
 
 class ExperimentsCollection():
@@ -31,6 +39,20 @@ class ExperimentsCollection():
         self.slurm_log_dir = self.collection_dir + 'slurm_log/'
         self.log_dir = self.collection_dir + 'log/'
 
+        # consolidated store of the results of all experiments
+        self.result_store_file = self.collection_dir + 'results.sqlite'
+
+        # status of the jobs of all experiments
+        self.job_status_file = self.collection_dir + 'jobs.sqlite'
+
+        # warm-start training (see `warm_start_plan`), every experiment is trained from scratch if None
+        self.warm_start = self.param_dict['controller'].get('warm_start')
+        if self.warm_start is not None:
+            missing = [k for k in ['n_episodes', 'decay'] if k not in self.warm_start]
+            if missing:
+                raise ValueError(f"The warm_start entry of the controller misses {', '.join(missing)} "
+                                 "(training of the warm-started experiments)")
+
         print("Sucessful\n")
     
     def alpha_array(self, lower: float, upper: float, N: int) -> np.ndarray:
@@ -55,17 +77,58 @@ class ExperimentsCollection():
         
         return arr
 
-    def set_directory(self) -> None:
+    def warm_start_plan(self) -> Tuple:
+        '''
+        Splits the experiments for warm-start training. The seed experiments, on every `seed_stride`-th point 
+        of both alpha axes, are trained from scratch. Every other experiment starts from the average of the learned values
+        of its nearest seed experiments (on the grid of alpha indices), with the shorter training of the "warm_start" params
+        Returns:
+            seeds (list of int): indices of the seed experiments
+            neighbors (dict): indices of the nearest seed experiments of every other experiment
+        '''
+        stride = self.warm_start.get('seed_stride', 2)
+        grid = np.array([(i, j) for i in range(len(self.alpha_EZ_arr)) for j in range(len(self.alpha_ZE_arr))])
+
+        is_seed = (grid[:, 0] % stride == 0) & (grid[:, 1] % stride == 0)
+        seeds = np.flatnonzero(is_seed)
+
+        neighbors = {}
+        for k in np.flatnonzero(~is_seed):
+            dist = np.linalg.norm(grid[seeds] - grid[k], axis=1)
+            neighbors[int(k)] = [int(n) for n in seeds[np.isclose(dist, dist.min())]]
+
+        return [int(k) for k in seeds], neighbors
+    
+    def final_values_file(self, i: int) -> str:
         '''
-        Sets up the directories, metadata file, and param files for every experiment
+        Returns the file of the values learned in the last training episode of experiment `i`
+        '''
+        exp_ID = self.param_dict['collection_ID'] + "." + str(i)
+        controller_dict = self.param_dict['controller']
+        n_episodes = controller_dict['training']['n_episodes']
+
+        return sim_data.values_filename(self.collection_dir + exp_ID + '/', controller_dict['type_name'], n_episodes - 1)
+
+    def set_directory(self, seed=None) -> None:
+        '''
+        Sets up the directories, metadata file, and param files for every experiment.
+        Every experiment gets its own independent seed, spawned from the seed of the collection
+        (the "seed" of the controller in the collection param file, else `seed`, else fresh entropy)
         '''    
         print("Setting up the directories for collection of experiments ... ")
         
         params = deepcopy(self.param_dict)
 
+        N_exp = len(self.alpha_EZ_arr) * len(self.alpha_ZE_arr)
+        exp_seeds = seed_sequence(params['controller'].get('seed', seed)).spawn(N_exp)
+
         collection_ID = params.pop("collection_ID")
         collection_name = params.pop("collection_name")
 
+        warm_start = params['controller'].pop('warm_start', None)
+        training = params['controller'].get('training')
+        neighbors = self.warm_start_plan()[1] if warm_start is not None else {}
+
         if not os.path.exists(self.collection_dir):
             os.mkdir(self.collection_dir)
         
@@ -84,6 +147,16 @@ class ExperimentsCollection():
                 params['exp_name'] = exp_name
                 params['env']['ode_params']['alpha_EZ'] = a1
                 params['env']['ode_params']['alpha_ZE'] = a2
+                params['controller']['seed'] = seed_dict(exp_seeds[count])
+
+                if count in neighbors:
+                    params['controller']['training'] = dict(training, n_episodes = warm_start['n_episodes'], 
+                                                            decay = warm_start['decay'])
+                    params['controller']['warm_start'] = {'qtable_files': [self.final_values_file(n) for n in neighbors[count]],
+                                                          'max_explore_rate': warm_start.get('max_explore_rate', 1.0)}
+                elif warm_start is not None:
+                    params['controller']['training'] = training
+                    params['controller'].pop('warm_start', None)
 
                 exp_dir = self.collection_dir + exp_ID + "/"
                 if not os.path.exists(exp_dir):
@@ -109,13 +182,56 @@ class ExperimentsCollection():
     def run(self, local=False,
             re_test=False, test_done_break=False,
             test_qtable_episode='last', test_explore_rate=0.0, 
-            test_savefig_format = 'png') -> None:
+            test_savefig_format = 'png', 
+            export_format = 'npy', export_dtype = 'float64',
+            store_results = False, record_transitions = False, exact = False,
+            job_status = False, exp_indices = None, use_cache = True) -> None:
         '''
-        Loops over the experiments and submit jobs to run them
+        Loops over the experiments and submit jobs to run them.
+        With warm-start training, the seed experiments are run first, & (with SLURM) the job of every other experiment
+        waits for the jobs of its nearest seed experiments to complete
+        Parameters (the ones not passed on to the command line options, see below):
+            job_status (bool): whether to track the state & progress of the jobs in the collection job status store
+            exp_indices (list of int or None): indices of the experiments to run, all if None
+            use_cache (bool): whether the experiments use the simulation cache. With SLURM, the experiments 
+                              whose simulation is cached are written out locally instead of submitting jobs
         '''
         options = ["--test_qtable_episode", str(test_qtable_episode), 
                    "--test_explore_rate", str(test_explore_rate), 
-                   "--test_savefig_format", test_savefig_format]
+                   "--test_savefig_format", test_savefig_format,
+                   "--export_format", export_format,
+                   "--export_dtype", export_dtype]
+        
+        if store_results:
+            options = options + ["--result_store", self.result_store_file]
+        
+        if record_transitions:
+            options = options + ["--record_transitions"]
+        
+        if exact:
+            options = options + ["--exact"]
+        
+        if not use_cache:
+            options = options + ["--no_cache"]
+        
+        if job_status:
+            options = options + ["--job_status", self.job_status_file]
+            status = JobStatusStore(self.job_status_file)
+
+            # re-queued jobs (see `collection_status.py`) are run with the same options
+            status.set_run_options({'re_test': re_test, 'test_done_break': test_done_break,
+                                    'test_qtable_episode': test_qtable_episode, 'test_explore_rate': test_explore_rate,
+                                    'test_savefig_format': test_savefig_format,
+                                    'export_format': export_format, 'export_dtype': export_dtype,
+                                    'store_results': store_results, 'record_transitions': record_transitions,
+                                    'exact': exact, 'use_cache': use_cache})
+
+            controller_dict = self.param_dict['controller']
+            if controller_dict['type_name'] in ['QLearning', 'LinearQ'] and not re_test:
+                n_train = controller_dict['training']['n_episodes']
+            else:
+                n_train = 0
+        
         if re_test:
             options = options + ["--test_only"]
         
@@ -136,27 +252,94 @@ class ExperimentsCollection():
                 confirmation = input("Please only answer either \"y\" (for Yes) or \"n\" (for No) and type your answer again: ")
             
             if confirmation == "y":
-                script_dir = os.path.abspath(os.path.dirname(__file__))
-                JOB_SCRIPT = script_dir + "/run_experiment.py"
+                JOB_SCRIPT = os.path.abspath(os.path.dirname(__file__)) + "/run_experiment.py"
             else:
                 return
         
-        for i in range(N_exp):
+        cache = SimulationCache() if use_cache and not local else None
+        
+        if exp_indices is None:
+            exp_indices = range(N_exp)
+        
+        neighbors = {}
+        if self.warm_start is not None and not re_test:
+            seeds, neighbors = self.warm_start_plan()
+            exp_indices = sorted(exp_indices, key = lambda i: i not in seeds)
+        
+        job_IDs = {}
+        for i in exp_indices:
             
             exp_ID = self.param_dict['collection_ID'] + "." + str(i)
             param_file = self.collection_dir + exp_ID + "/" + "params." + exp_ID + ".json"
             log_file = self.log_dir + exp_ID + ".log"
 
+            if job_status:
+                status.queue(exp_ID, n_train)
+
             # args = ["echo", JOB_SCRIPT, param_file, log_file] + options # this is just for testing the script
-            if not local:
-                args = ["sbatch", JOB_SCRIPT, param_file, log_file] + options
-            else:
-                args = ["python", JOB_SCRIPT, "-f", param_file] + options
+            cached = False
+            if cache is not None:
+                with open(param_file) as f:
+                    exp_param_dict = json.load(f)
+                key = simulation_key(exp_param_dict, test_done_break, exact)
+                found = cache.get_simulation(key, exp_param_dict['env']) if key is not None else None
+                # only if the full trajectory is exported by a previous run (the cache holds a downsampled one)
+                cached = found is not None and exported_simulation(self.collection_dir + exp_ID + "/testing." + exp_ID,
+                                                                   found[0], found[1], exp_param_dict['env'],
+                                                                   export_format, export_dtype) is not None
 
             print(f"Submitting job (if local==False) / Running (if local==True) for experiment {i} ... ")
-            proc = subprocess.Popen(args, cwd=self.collection_dir)
-            proc.wait()
+            if cached:
+                print("Simulation found in the cache, running locally")
+                args = ["python", os.path.abspath(os.path.dirname(__file__)) + "/run_experiment.py", "-f", param_file] + options
+                subprocess.Popen(args, cwd=self.collection_dir).wait()
+            elif not local:
+                dependency = [job_IDs[n] for n in neighbors.get(i, []) if n in job_IDs]
+                sbatch = ["sbatch", "--parsable"] + (["--dependency=afterok:" + ":".join(dependency)] if dependency else [])
+                args = sbatch + [JOB_SCRIPT, param_file, log_file] + options
+                
+                proc = subprocess.run(args, cwd=self.collection_dir, stdout=subprocess.PIPE, universal_newlines=True)
+                job_IDs[i] = proc.stdout.strip().split(";")[0]
+                print(f"Submitted batch job {job_IDs[i]}")
+            else:
+                args = ["python", JOB_SCRIPT, "-f", param_file] + options
+                proc = subprocess.Popen(args, cwd=self.collection_dir)
+                proc.wait()
             print("Done\n")
+    
+    def warm_start_report(self) -> pd.DataFrame:
+        '''
+        Compares the training of the experiments warm-started from their neighbors with the ones trained from scratch (cold),
+        by the number of episodes until the greedy policy stops changing (see `evaluation.episodes_to_convergence`),
+        & writes it to file `warm_start.tsv` in the collection directory
+        Returns:
+            df: data frame with columns exp_ID, alpha_EZ, alpha_ZE, start ("cold" or "warm"), n_episodes, episodes_to_convergence
+        '''
+        df = pd.read_csv(self.collection_dir + "metadata.tsv", sep="\t")
+
+        start, n_episodes, converged = [], [], []
+        for exp_ID in df['exp_ID']:
+            exp_dir = self.collection_dir + exp_ID + "/"
+            with open(exp_dir + "params." + exp_ID + ".json") as f:
+                controller_dict = json.load(f)['controller']
+            
+            start.append("warm" if 'warm_start' in controller_dict else "cold")
+            n_episodes.append(controller_dict['training']['n_episodes'])
+            converged.append(episodes_to_convergence(exp_dir))
+        
+        df['start'] = start
+        df['n_episodes'] = n_episodes
+        df['episodes_to_convergence'] = converged
+
+        df.to_csv(self.collection_dir + "warm_start.tsv", sep="\t", index=False)
+
+        print(df.groupby('start')[['n_episodes', 'episodes_to_convergence']].agg(['count', 'mean', 'sum']).to_string())
+
+        all_cold = len(df) * self.param_dict['controller']['training']['n_episodes']
+        print(f"\nTotal training episodes: {df['n_episodes'].sum()}, from scratch: {all_cold} "
+              f"({all_cold / df['n_episodes'].sum():.2f}x)")
+
+        return df
 
 if __name__ == '__main__':
 
@@ -165,6 +348,9 @@ if __name__ == '__main__':
     parser.add_argument("-f", "--collection_param_file", type=str, required=True)
     
     parser.add_argument("--local", action='store_true') # default is False
+
+    parser.add_argument("-s", "--seed", type=int, 
+                        default=None, required=False) # seed of the collection, if not in the collection param file
     
     parser.add_argument("-re", "--re_test", action='store_true') # default is False
     parser.add_argument("-tdb", "--test_done_break", action='store_true') # default is False
@@ -176,17 +362,41 @@ if __name__ == '__main__':
     
     parser.add_argument("-tsf", "--test_savefig_format", type=str, 
                         default='png', required=False)
+    
+    parser.add_argument("-xf", "--export_format", type=str, choices=['npy', 'tsv'],
+                        default='npy', required=False)
+    parser.add_argument("-xd", "--export_dtype", type=str, choices=['float64', 'float32'],
+                        default='float64', required=False)
+    
+    parser.add_argument("--store_results", action='store_true') # default is False
+    parser.add_argument("-rt", "--record_transitions", action='store_true') # default is False
+    parser.add_argument("--exact", action='store_true') # default is False
+    parser.add_argument("--no_cache", action='store_true') # default is False, if given the simulation cache is not used
+    parser.add_argument("-js", "--job_status", action='store_true') # default is False, if given the jobs are tracked in `jobs.sqlite`
+
+    parser.add_argument("-wr", "--warm_start_report", action='store_true') # default is False, if given only the report is made
 
     args = parser.parse_args()
 
     collection = ExperimentsCollection(args.collection_param_file)
 
+    if args.warm_start_report:
+        collection.warm_start_report()
+        exit()
+
     if not args.re_test:
-        collection.set_directory()
+        collection.set_directory(seed = args.seed)
     
     collection.run(local = args.local,
                    re_test = args.re_test, 
                    test_done_break = args.test_done_break,
                    test_qtable_episode = args.test_qtable_episode,
                    test_explore_rate = args.test_explore_rate,
-                   test_savefig_format = args.test_savefig_format)
\ No newline at end of file
+                   test_savefig_format = args.test_savefig_format,
+                   export_format = args.export_format,
+                   export_dtype = args.export_dtype,
+                   store_results = args.store_results,
+                   record_transitions = args.record_transitions,
+                   exact = args.exact,
+                   job_status = args.job_status,
+                   use_cache = not args.no_cache)
\ No newline at end of file
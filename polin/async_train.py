@@ -0,0 +1,141 @@
+from polin.controller import seed_sequence
+
+from typing import List, Dict, Tuple
+import numpy as np
+
+import os
+import time
+import multiprocessing as mp
+import multiprocessing.connection
+from multiprocessing import shared_memory
+
+def explore_rates_of(n_workers: int, max_explore_rates=None) -> List[float]:
+    '''
+    Returns the highest explore rate of the schedule of every worker: `max_explore_rates` if given (one per worker),
+    else 1.0 for all workers
+    '''
+    if max_explore_rates is None:
+        return [1.0] * n_workers
+    if len(max_explore_rates) != n_workers:
+        raise ValueError("There should be one max explore rate per worker")
+
+    return list(max_explore_rates)
+
+def _worker(worker: int, n_workers: int, shm_name: str, shape: Tuple,
+            env_param_dict: Dict, sim_param_dict: Dict, agent_param_dict: Dict, exact: bool,
+            seed, n_episodes: int, decay: float, episode_time_max: float, max_explore_rate: float,
+            exp_dir: str, episode_counter, transition_counter, lock) -> None:
+    '''
+    Trains on its own env, with the TD updates written into the shared Q-table (without locking, Hogwild-style).
+    After every episode, takes the next global episode number & writes its checkpoint & performance
+    '''
+    from polin.train_test import TrainTest # imported here, as `polin.train_test` imports the training modules
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        values = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+
+        tt = TrainTest(env_param_dict, sim_param_dict, test_done_break = False, exact = exact)
+        tt.set_QLearning_agent(agent_param_dict, seed = seed)
+        tt.agent.values = values
+        tt.env.reset_state_method(state_method = tt.agent.state_method, n_states = tt.agent.n_states)
+
+        qtable_filename = exp_dir + 'learned_qtables/QLearningAgent_values.ep'
+        perf_filename = exp_dir + 'training_performance.tsv'
+
+        # the episodes of the worker are spread over the exploration schedule of the whole training
+        for k in range(worker, n_episodes, n_workers):
+
+            explore_rate = tt.agent.get_rate(k, decay, max_r = max_explore_rate)
+
+            tt.simulate(sim_time = episode_time_max, done_break = True,
+                        explore_rate = explore_rate, training = True)
+
+            t5p_first = tt.env.t5p[0] if len(tt.env.t5p) > 0 else "N/A"
+            tTiny_first = tt.env.tTiny[0] if len(tt.env.tTiny) > 0 else "N/A"
+
+            with lock:
+                episode = episode_counter.value
+                episode_counter.value += 1
+                transition_counter.value += tt.n_steps
+
+                with open(qtable_filename + str(episode) + '.npy', 'wb') as f:
+                    np.save(f, values)
+
+                with open(perf_filename, 'a') as pf:
+                    pf.write(f'\n{episode}\t{explore_rate}\t{tt.e_return}\t{t5p_first}\t{tTiny_first}\t{tt.env.total_drug_in}\t{worker}')
+    finally:
+        shm.close()
+
+def train_async(initial_values: np.ndarray, env_param_dict: Dict, sim_param_dict: Dict, agent_param_dict: Dict,
+                n_episodes: int, decay: float, episode_time_max: float, exp_dir: str, n_workers: int,
+                max_explore_rates=None, exact=False, seed=None, progress=None, poll_interval=1.0) -> Tuple:
+    '''
+    Trains a Q-learning agent asynchronously: `n_workers` processes simulate their own env & update one Q-table
+    in shared memory, without locks (Hogwild). The episodes are numbered in the order they complete, & a checkpoint
+    of the shared Q-table & the performance are written after every episode, as by `TrainTest.train_Qlearing`
+    Parameters:
+        initial_values (numpy array): initial Q-table
+        env_param_dict, sim_param_dict, agent_param_dict (dictionaries): as in the experiment param file
+        n_episodes (int): total number of episodes, shared among the workers
+        decay, episode_time_max (float): as in the training params
+        exp_dir (str): experiment directory
+        n_workers (int): number of worker processes
+        max_explore_rates (list of float or None): highest explore rate of the schedule of every worker (see `explore_rates_of`)
+        exact (bool): as in `TrainTest`
+        seed (None, int, dict or SeedSequence): seed of the exploration, one independent stream is spawned per worker
+        progress (callable or None): called with the number of episodes completed, at least every `poll_interval` seconds
+    Returns:
+        values (numpy array): the learned Q-table
+        stats (dict): number of workers, episodes & transitions, training time (in s) & transitions per second
+    '''
+    max_explore_rates = explore_rates_of(n_workers, max_explore_rates)
+    worker_seeds = seed_sequence(seed).spawn(n_workers)
+
+    os.makedirs(exp_dir + 'learned_qtables/', exist_ok=True)
+    with open(exp_dir + 'training_performance.tsv', 'w') as pf:
+        pf.write(f'episode\texplore_rate\te_return\tt5p_first\ttTiny_first\ttotal_drug_in\tworker')
+
+    initial_values = np.asarray(initial_values, dtype=np.float64)
+    shm = shared_memory.SharedMemory(create=True, size=initial_values.nbytes)
+    try:
+        values = np.ndarray(initial_values.shape, dtype=np.float64, buffer=shm.buf)
+        values[:] = initial_values
+
+        episode_counter = mp.Value('q', 0, lock=False)
+        transition_counter = mp.Value('q', 0, lock=False)
+        lock = mp.Lock()
+
+        workers = [mp.Process(target=_worker,
+                              args=(w, n_workers, shm.name, initial_values.shape,
+                                    env_param_dict, sim_param_dict, agent_param_dict, exact,
+                                    worker_seeds[w], n_episodes, decay, episode_time_max, max_explore_rates[w],
+                                    exp_dir, episode_counter, transition_counter, lock))
+                   for w in range(n_workers)]
+
+        t_start = time.time()
+        for p in workers:
+            p.start()
+
+        while any(p.is_alive() for p in workers):
+            mp.connection.wait([p.sentinel for p in workers if p.is_alive()], timeout=poll_interval)
+            if progress is not None:
+                progress(episode_counter.value)
+
+        elapsed = time.time() - t_start
+
+        for p in workers:
+            p.join()
+
+        failed = [w for w, p in enumerate(workers) if p.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"Training workers {failed} failed")
+
+        result = values.copy()
+        stats = {'n_workers': n_workers, 'n_episodes': episode_counter.value, 'n_transitions': transition_counter.value,
+                 'seconds': elapsed, 'transitions_per_s': transition_counter.value / elapsed}
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return result, stats
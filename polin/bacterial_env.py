@@ -6,6 +6,37 @@ import numpy as np
 from scipy.integrate import solve_ivp
 import math
 
+class EnvSnapshot():
+    '''
+    State of a `BacterialEnv` at a point of its simulation, to go back to it later with `BacterialEnv.restore`.
+    Holds references to the trajectory arrays & step records of the env, not copies: the env never modifies
+    these in place (its arrays are replaced at every step & its step records are copied on the first write
+    after a snapshot), so taking & restoring a snapshot costs the same whatever the length of the history.
+    Initialized with:
+        env (BacterialEnv): the env to capture
+    '''
+    def __init__(self, env):
+
+        self.t = env.tSol[-1] # time of the snapshot
+        self.S = env.sSol[-1, :] # state S = [E, Z, D] at that time
+        self.n_points = len(env.tSol) # length of the trajectory
+        self.total_drug_in = env.total_drug_in
+
+        self.tSol, self.sSol, self.actions = env.tSol, env.sSol, env.actions
+        self.t5p, self.tTiny = env.t5p, env.tTiny
+        self.step_ends, self.step_history = env.step_ends, env.step_history
+
+        # reset by `reset_2_equilibria`
+        self.init_E, self.init_Z, self.initial_S = env.init_E, env.init_Z, env.initial_S
+        self.five_percent, self.mono = env.five_percent, env.mono
+
+        # simulation settings & duration of the last step
+        self.keep_history = env.keep_history
+        self.max_interval, self.D_threshold = env.max_interval, env.D_threshold
+        self.step_duration = env.step_duration
+
+        self.state = env.state
+
 class BacterialEnv():
     '''
     Microbial growth environment that are under drug treatment control policy
@@ -17,7 +48,7 @@ class BacterialEnv():
         state_method (str): name of the method to return state
         n_states (int or None): number of discrete states, should be 
                                 int when `state_method` is "disc_EZ",
-                                None when `state_method` is "cont_E"
+                                None when `state_method` is "cont_E" or "cont_EZD"
     '''
     def __init__(self, param_dict: Dict, step_time: 60.0*6.0, 
                  reward_func: "minED", reward_kwargs: {}, 
@@ -32,6 +63,10 @@ class BacterialEnv():
         self.actions = np.empty((0, 2), float) # matrix of actions with corresponding timepoints
         self.total_drug_in = 0.0 # cumulative drug "absorbed" / "flowed" in
 
+        self.step_ends = [0] # indices of the rows of `tSol` & `sSol` at the decision boundaries (ends of the steps)
+        self.step_history = [] # (action, reward, done) of every step, for fast-forwarding periodic steady states
+        self._shared_records = False # whether `step_ends` & `step_history` are shared with a snapshot (see `snapshot`)
+
         if self.init_Z == 0.0:
             self.mono = True # if it's a mono-culture env, this is just for visualization
         else:
@@ -47,7 +82,7 @@ class BacterialEnv():
         self.reward_kwargs = reward_kwargs # kwargs for the reward function
 
         # method to derive observable state for the controller
-        self.defined_state_methods = ["cont_E", "disc_EZ", "disc_E"]
+        self.defined_state_methods = ["cont_E", "disc_EZ", "disc_E", "cont_EZD"]
         
         if state_method not in self.defined_state_methods:
             raise ValueError(f"Method to derive observable state is not in the list of defined methods: {self.defined_state_methods}")
@@ -60,6 +95,28 @@ class BacterialEnv():
         self.OD2state = None # distance (in density unit) between 2 consecutive states, 
                              # also the "exchange rate" to convert from density to discrete state
 
+        # ODE solver settings
+        self.method = "LSODA"
+        self.max_step = 0.01
+        self.rtol = 1e-3 # tolerances of the solver of the full model (& of the reduced model when species Z is extinct)
+        self.atol = 1e-6
+        self.reduce_extinct = True # whether to use reduced models once a species is extinct (see `integrate`)
+        self.reduced_rtol = 1e-8 # tolerances of the solver of the reduced model when species E is extinct
+        self.reduced_atol = 1e-10
+        self.nfev = 0 # number of evaluations of the right-hand side of the ODEs by the solver, for benchmarking the settings
+
+        # whether to record the full trajectory (solver points, actions & steps), for testing, export & fast-forwarding.
+        # If False, e.g. for training, only the initial & the current state are kept in `tSol` & `sSol` (with the events),
+        # so memory does not grow with the simulation time
+        self.keep_history = True
+
+        # event-triggered decisions (see `step`): decisions are taken every `step_time` if `max_interval` is None.
+        # Otherwise, a step goes on after `step_time` until the observable state changes, 
+        # the drug concentration D drops below `D_threshold` (if not None) or the step lasts `max_interval`
+        self.max_interval = None
+        self.D_threshold = None
+        self.step_duration = step_time # duration of the last step
+
         self.state = self.get_state() # observable state to the controller
 
     def set_params(self, param_dict: Dict) -> None:
@@ -143,21 +200,167 @@ class BacterialEnv():
 
         return rhs
     
-    def event5p(self, t, S, Din: float) -> float:
+    def event5p(self, t, S, *args) -> float:
         '''
         Event for ODE solver: time at which E density == 5% of its initial condition
         '''
         return S[0] - self.five_percent
     
-    def eventTiny(self, t, S, Din: float) -> float:
+    def eventTiny(self, t, S, *args) -> float:
         '''
         Event for ODE solver: time at which E density == tiny 10**(-4)
         '''
         return S[0] - 10**(-4)
 
+    def level_event(self, i: int, level: float, direction=0):
+        '''
+        Returns a terminal event for ODE solver: time at which S[i] crosses `level` 
+        (downwards if `direction` is -1, upwards if 1, either if 0)
+        '''
+        def event(t, S, *args):
+            return S[i] - level
+        event.terminal = True
+        event.direction = direction
+
+        return event
+    
+    def decision_triggers(self) -> List:
+        '''
+        Returns the events that trigger the next decision, from the current state: the densities of the discrete state
+        (E, & Z if "disc_EZ") crossing the boundaries of their current state (or rounding to 0, extinct),
+        & D dropping below `D_threshold`
+        '''
+        S = self.sSol[-1, :]
+        triggers = []
+
+        if self.state_method in ["disc_E", "disc_EZ"]:
+            for i in ([0] if self.state_method == "disc_E" else [0, 1]):
+                if S[i] > 0.0:
+                    # levels just past the boundaries, so that the state has changed once triggered
+                    k = S[i] // self.OD2state
+                    eps = 1e-6 * self.OD2state
+                    triggers.append(self.level_event(i, k * self.OD2state - eps if k > 0 else 5e-6))
+                    triggers.append(self.level_event(i, (k + 1) * self.OD2state + eps))
+        
+        if self.D_threshold is not None and S[2] > self.D_threshold:
+            triggers.append(self.level_event(2, self.D_threshold, direction=-1))
+        
+        return triggers
+
+    def drug_solution(self, t: np.ndarray, t0: float, D0: float, Din: float) -> np.ndarray:
+        '''
+        Returns the closed-form solution of the drug concentration D at time points `t`, 
+        from D0 at time t0 under a constant "flow in" drug concentration Din
+        '''
+        D_inf = self.ka * Din / self.kd
+        return D_inf + (D0 - D_inf) * np.exp(-self.kd * (t - t0))
+    
+    def ODEsys_single(self, t, S, Din: float, species: int, t0: float, D0: float) -> List:
+        '''
+        Returns the derivative of the density of one species when the other one is extinct (reduced model),
+        with the drug concentration given by its closed-form solution
+        Parameters:
+            S: current density of the species, [E] if `species` is 0, [Z] if 1
+            species (int): 0 for species E, 1 for species Z
+            t0, D0 (float): time & drug concentration at the start of the integration
+        '''
+        D = self.drug_solution(t, t0, D0, Din)
+        if species == 0:
+            r, c, mic, dmax = self.rE, self.cE, self.micE, self.dmaxE
+        else:
+            r, c, mic, dmax = self.rZ, self.cZ, self.micZ, self.dmaxZ
+
+        delta = dmax * (D**self.gamma) / (mic**self.gamma + D**self.gamma)
+        
+        return [S[0] * (r - r/c * S[0] - delta)]
+    
+    def integrate(self, duration: float, Din: float, triggers=()) -> None:
+        '''
+        Integrates the system from the current state for a time period under a constant "flow in" drug concentration,
+        & appends the solution & events (only the end state replaces the current one if not `keep_history`). Once a species is extinct (density rounded to 0.0), it stays extinct,
+        so reduced models are used (if `reduce_extinct`):
+        - both species extinct: closed-form solution of D
+        - E extinct: the density Z only, with D in closed form; as there is no event of E, 
+          the solver takes its own step sizes & the solution is sampled at intervals of `max_step`
+        - Z extinct: the density E only, with D in closed form
+        Parameters:
+            duration (float): integration time
+            Din (float): "flow in" drug concentration
+            triggers (list): terminal events (see `decision_triggers`) that stop the integration before the end of `duration`.
+                             If any, the full model is integrated (extinct species stay extinct in the full model)
+        '''
+        t_start = self.tSol[-1]
+        t_end = t_start + duration
+        init = self.sSol[-1, :]
+        
+        E_extinct = init[0] == 0.0
+        Z_extinct = init[1] == 0.0
+
+        # without history, the solver only outputs the end state (its steps & events are the same)
+        t_eval = None if self.keep_history else [t_end]
+        if self.keep_history:
+            t_grid = np.linspace(t_start, t_end, max(int(math.ceil(round(duration / self.max_step, 9))), 1) + 1)
+        else:
+            t_grid = np.array([t_end])
+
+        if not self.reduce_extinct or not (E_extinct or Z_extinct) or len(triggers) > 0:
+            sol = solve_ivp(self.ODEsys, [t_start, t_end], init, args=(Din,), 
+                            events = [self.event5p, self.eventTiny] + list(triggers), max_step=self.max_step,
+                            t_eval = t_eval, rtol = self.rtol, atol = self.atol, method = self.method)
+            t, y = sol.t, sol.y
+            t_events = sol.t_events[:2]
+            self.nfev += sol.nfev
+
+            if sol.status == 1 and not self.keep_history:
+                # stopped by a trigger before `t_eval`: the end state is the state at the trigger
+                k = max(range(2, len(sol.t_events)), key = lambda k: len(sol.t_events[k]))
+                t, y = sol.t_events[k][-1:], sol.y_events[k][-1].reshape(-1, 1)
+        
+        elif E_extinct and not Z_extinct:
+            t = t_grid
+            sol = solve_ivp(self.ODEsys_single, [t_start, t_end], init[[1]], args=(Din, 1, t_start, init[2]), 
+                            t_eval = t, rtol = self.reduced_rtol, atol = self.reduced_atol,
+                            method = self.method)
+            y = np.vstack([np.zeros(len(t)), sol.y[0], self.drug_solution(t, t_start, init[2], Din)])
+            t_events = [np.array([]), np.array([])]
+            self.nfev += sol.nfev
+
+        elif Z_extinct and not E_extinct:
+            sol = solve_ivp(self.ODEsys_single, [t_start, t_end], init[[0]], args=(Din, 0, t_start, init[2]), 
+                            events = [self.event5p, self.eventTiny], max_step=self.max_step,
+                            t_eval = t_eval, rtol = self.rtol, atol = self.atol, method = self.method)
+            t = sol.t
+            y = np.vstack([sol.y[0], np.zeros(len(t)), self.drug_solution(t, t_start, init[2], Din)])
+            t_events = sol.t_events
+            self.nfev += sol.nfev
+        
+        else:
+            t = t_grid
+            y = np.vstack([np.zeros(len(t)), np.zeros(len(t)), self.drug_solution(t, t_start, init[2], Din)])
+            t_events = [np.array([]), np.array([])]
+
+        if not self.keep_history:
+            y = y[:, [-1]]
+
+        solEZ = y[:2, :]
+        roundedZero_solEZ = np.where(np.round(solEZ, 5) == 0, 0.0, solEZ)
+        soly = np.append(roundedZero_solEZ, y[[-1], :], axis=0)
+
+        if self.keep_history:
+            self.sSol = np.append(self.sSol, soly.T[1:, :], axis=0)
+            self.tSol = np.append(self.tSol, t[1:])
+        else:
+            self.sSol = np.vstack([self.sSol[0, :], soly[:, -1]])
+            self.tSol = np.array([self.tSol[0], t[-1]])
+        self.t5p = np.append(self.t5p, t_events[0])
+        self.tTiny = np.append(self.tTiny, t_events[1])
+
     def step(self, action: Tuple) -> None:
         '''
-        Solves the ODEs system for a time period defined by `step_time` param, under the action taken by a controller
+        Solves the ODEs system for a time period defined by `step_time` param, under the action taken by a controller.
+        With event-triggered decisions (`max_interval` not None), if the observable state is still the same after `step_time`
+        (or is continuous), the system is solved further without drug until a decision is triggered (see `decision_triggers`)
+        or the step lasts `max_interval`. The duration of the step is then in `step_duration`
         Parameters:
             action (tuple): action chosen by the controller, 
                             in the form of (Din (float): "flow in" drug concentration, drug_time (float): time for "flow in" of drug)
@@ -171,58 +374,167 @@ class BacterialEnv():
         if drug_time > self.step_time:
             raise ValueError("Time duration for drug in cannot be longer than step time")
         
-        self.actions = np.append(self.actions, np.array([[self.tSol[-1], Din]]), axis=0)
-        self.total_drug_in += Din * drug_time * self.ka
-
         t_start = self.tSol[-1]
-        t_end = t_start + drug_time
-        init = self.sSol[-1, :]
+        state_start = self.state
 
-        sol = solve_ivp(self.ODEsys, [t_start, t_end], init, args=(Din,), 
-                        events = [self.event5p, self.eventTiny], max_step=0.01,
-                        method = "LSODA")
-
-        solEZ = sol.y[:2, :]
-        roundedZero_solEZ = np.where(np.round(solEZ, 5) == 0, 0.0, solEZ)
-        soly = np.append(roundedZero_solEZ, sol.y[[-1], :], axis=0)
+        if self.keep_history:
+            self.actions = np.append(self.actions, np.array([[self.tSol[-1], Din]]), axis=0)
+        self.total_drug_in += Din * drug_time * self.ka
 
-        self.sSol = np.append(self.sSol, soly.T[1:, :], axis=0)
-        self.tSol = np.append(self.tSol, sol.t[1:])
-        self.t5p = np.append(self.t5p, sol.t_events[0])
-        self.tTiny = np.append(self.tTiny, sol.t_events[1])
+        self.integrate(drug_time, Din)
 
         if (self.step_time - drug_time) > 0.0:
-            t_start = self.tSol[-1]
-            t_end = t_start + (self.step_time - drug_time)
-            init = self.sSol[-1, :]
-
-            sol = solve_ivp(self.ODEsys, [t_start, t_end], init, args=(0.0,), 
-                            events = [self.event5p, self.eventTiny], max_step=0.01,
-                            method = "LSODA")
-
-            solEZ = sol.y[:2, :]
-            roundedZero_solEZ = np.where(np.round(solEZ, 5) == 0, 0.0, solEZ)
-            soly = np.append(roundedZero_solEZ, sol.y[[-1], :], axis=0)
-
-            self.sSol = np.append(self.sSol, soly.T[1:, :], axis=0)
-            self.tSol = np.append(self.tSol, sol.t[1:])
-            self.t5p = np.append(self.t5p, sol.t_events[0])
-            self.tTiny = np.append(self.tTiny, sol.t_events[1])
+            self.integrate(self.step_time - drug_time, 0.0)
                 
         self.state = self.get_state()
 
+        if self.max_interval is not None and self.tSol[-1] - t_start < self.max_interval:
+            if self.state_method in ["cont_E", "cont_EZD"] or self.state == state_start:
+                self.integrate(t_start + self.max_interval - self.tSol[-1], 0.0, triggers = self.decision_triggers())
+                self.state = self.get_state()
+        
+        self.step_duration = self.tSol[-1] - t_start
+
         reward, done = self.get_reward(action, self.sSol, self.tSol, **self.reward_kwargs)
 
+        if self.keep_history:
+            self._own_records()
+            self.step_ends.append(len(self.tSol) - 1)
+            self.step_history.append((action, reward, done))
+
         return self.state, reward, done
     
+    def find_period(self, max_period=4, rtol=1e-6, atol=1e-9):
+        '''
+        Detects a periodic steady state: the state at the last decision boundary is the same (within tolerance) as
+        the state `period` steps before, & the actions of the last `period` steps repeat those of the `period` steps before.
+        A fixed point is a period of 1 step.
+        Parameters:
+            max_period (int): longest period to look for, in number of steps
+            rtol, atol (float): relative & absolute tolerances of the comparison of states
+        Returns:
+            period (int or None): the shortest period found, None if the state is not (yet) periodic
+                                  or the history is not kept
+        '''
+        if not self.keep_history:
+            return None
+
+        n_steps = len(self.step_history)
+        S = self.sSol[self.step_ends[-1], :]
+
+        for period in range(1, max_period + 1):
+            if n_steps < 2 * period:
+                break
+
+            actions = [a for a, _, _ in self.step_history[-2 * period:]]
+            if actions[:period] != actions[period:]:
+                continue
+
+            if np.allclose(S, self.sSol[self.step_ends[-1 - period], :], rtol=rtol, atol=atol):
+                return period
+        
+        return None
+    
+    def fast_forward(self, period: int, n_steps: int) -> List:
+        '''
+        Extrapolates the simulation of a periodic steady state (see `find_period`) without integrating:
+        the last `period` steps are repeated `n_steps` times in a cycle, with their trajectory, events, drug & rewards
+        Parameters:
+            period (int): period of the steady state, in number of steps
+            n_steps (int): number of steps to extrapolate
+        Returns:
+            returns (list): (reward, done) of every extrapolated step
+        '''
+        self._own_records()
+
+        n0 = len(self.step_history)
+        t_cycle = self.tSol[-1] - self.tSol[self.step_ends[n0 - period]]
+
+        tSol, sSol = [self.tSol], [self.sSol]
+        t5p, tTiny = [self.t5p], [self.tTiny]
+        actions = []
+        returns = []
+        for k in range(n_steps):
+            src = n0 - period + k % period # the step of the cycle to repeat
+            shift = (k // period + 1) * t_cycle
+
+            i0, i1 = self.step_ends[src], self.step_ends[src + 1]
+            t0, t1 = self.tSol[i0], self.tSol[i1]
+
+            tSol.append(self.tSol[i0 + 1:i1 + 1] + shift)
+            sSol.append(self.sSol[i0 + 1:i1 + 1, :])
+            t5p.append(self.t5p[(self.t5p > t0) & (self.t5p <= t1)] + shift)
+            tTiny.append(self.tTiny[(self.tTiny > t0) & (self.tTiny <= t1)] + shift)
+            
+            action, reward, done = self.step_history[src]
+            actions.append([t0 + shift, action[0]])
+            self.total_drug_in += action[0] * action[1] * self.ka
+
+            self.step_ends.append(self.step_ends[-1] + i1 - i0)
+            self.step_history.append((action, reward, done))
+            returns.append((reward, done))
+        
+        self.tSol = np.concatenate(tSol)
+        self.sSol = np.concatenate(sSol)
+        self.t5p = np.concatenate(t5p)
+        self.tTiny = np.concatenate(tTiny)
+        self.actions = np.append(self.actions, np.array(actions).reshape(-1, 2), axis=0)
+
+        self.state = self.get_state()
+
+        return returns
+    
+    def snapshot(self) -> EnvSnapshot:
+        '''
+        Captures the current state of the simulation (state, time, drug, events, actions & trajectory),
+        e.g. to try alternative actions from it (lookahead, counterfactuals) or to reuse a common prefix across episodes
+        Returns:
+            snapshot (EnvSnapshot): to go back to with `restore`, as many times as needed
+        '''
+        self._shared_records = True
+        return EnvSnapshot(self)
+
+    def restore(self, snapshot: EnvSnapshot) -> None:
+        '''
+        Goes back to a snapshot of this env (see `snapshot`), discarding everything simulated since then.
+        Nothing is integrated again nor copied.
+        '''
+        self.tSol, self.sSol, self.actions = snapshot.tSol, snapshot.sSol, snapshot.actions
+        self.t5p, self.tTiny = snapshot.t5p, snapshot.tTiny
+        self.total_drug_in = snapshot.total_drug_in
+
+        self.step_ends, self.step_history = snapshot.step_ends, snapshot.step_history
+        self._shared_records = True
+
+        self.init_E, self.init_Z, self.initial_S = snapshot.init_E, snapshot.init_Z, snapshot.initial_S
+        self.five_percent, self.mono = snapshot.five_percent, snapshot.mono
+
+        self.keep_history = snapshot.keep_history
+        self.max_interval, self.D_threshold = snapshot.max_interval, snapshot.D_threshold
+        self.step_duration = snapshot.step_duration
+
+        self.state = snapshot.state
+
+    def _own_records(self) -> None:
+        '''
+        Copies the step records before they are appended to, if they are shared with a snapshot
+        '''
+        if self._shared_records:
+            self.step_ends = list(self.step_ends)
+            self.step_history = list(self.step_history)
+            self._shared_records = False
+
     def get_state(self):
         '''
         Returns the "current" state of the system/env for the controller to make decisions:
-            state: float if `state_method` is "cont_E", int if "disc_EZ"
+            state: float if `state_method` is "cont_E", int if "disc_EZ", numpy array [E, Z, D] if "cont_EZD"
         '''
         if self.state_method == "cont_E": # returns the most recent density of species E (continuous value)
             state = self.sSol[-1, 0]
         
+        if self.state_method == "cont_EZD": # returns the most recent densities & drug concentration (continuous values)
+            state = self.sSol[-1, :].copy()
+        
         if self.state_method == "disc_EZ" or self.state_method == "disc_E":
             if self.n_states is None:
                 raise RuntimeError(f'n_states should be defined for \"{method}\" method')
@@ -299,6 +611,10 @@ class BacterialEnv():
         self.actions = np.empty((0, 2), float)
         self.total_drug_in = 0.0 
 
+        self.step_ends = [0]
+        self.step_history = []
+        self._shared_records = False
+
         self.mono = False # system starts at coexistence equilibrium / carrying capacities, so it's co-culture env
         
         self.five_percent = 0.05 * eqE
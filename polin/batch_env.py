@@ -0,0 +1,260 @@
+import polin.reward_func as rf
+
+from typing import List, Dict, Tuple
+import numpy as np
+from scipy.integrate import solve_ivp
+import math
+
+class BatchBacterialEnv():
+    '''
+    A batch of microbial growth environments (as `BacterialEnv`) that are simulated together, in lock-step.
+    The ODE systems of all environments are stacked into one vectorized system that is integrated by a single solver call,
+    so many parameter sets and/or controllers can be evaluated at the cost of Python overhead of one simulation.
+    Only the quantities needed for evaluation are kept: current state, cumulative drug, first event times (no trajectory).
+    Initialized with:
+        param_dicts (list of dictionaries): parameters for the ODE model & initial conditions, one per environment
+        step_time (float): time for integration whenever the `step` method is called
+        reward_kwargs (dict): parameters for reward caculations (reward function "minED")
+        state_method (str): name of the method to return state, as in `BacterialEnv`
+        n_states (int or None): number of discrete states, as in `BacterialEnv`
+        max_step (float): maximum step size of the solver, as in `BacterialEnv`
+    '''
+    def __init__(self, param_dicts: List[Dict], step_time: 60.0*6.0,
+                 reward_kwargs: {}, state_method="cont_E", n_states=None,
+                 max_step=0.01):
+
+        self.n_envs = len(param_dicts)
+        self.set_params(param_dicts)
+
+        self.S = np.column_stack([self.init_E, self.init_Z, self.init_D]) # current state S = [E, Z, D] of every env
+        self.t = 0.0 # current time, the same for all envs
+
+        self.step_time = step_time
+        self.reward_kwargs = reward_kwargs
+        self.max_step = max_step
+
+        self.defined_state_methods = ["cont_E", "disc_EZ", "disc_E"]
+        if state_method not in self.defined_state_methods:
+            raise ValueError(f"Method to derive observable state is not in the list of defined methods: {self.defined_state_methods}")
+        self.state_method = state_method
+        self.n_states = n_states
+        self.growth_bounds = [0.0, 0.5]
+        self.OD2state = None
+
+        self.reset_records()
+
+    def set_params(self, param_dicts: List[Dict]) -> None:
+        '''
+        Sets environment parameters to arrays, with one element per environment
+        '''
+        def ode_param(name):
+            return np.array([p['ode_params'][name] for p in param_dicts], dtype=float)
+
+        def init_cond(name):
+            return np.array([p['initial_conditions'][name] for p in param_dicts], dtype=float)
+
+        self.rE = ode_param('rE'); self.rZ = ode_param('rZ')
+        self.cE = ode_param('cE'); self.cZ = ode_param('cZ')
+        self.alpha_EZ = ode_param('alpha_EZ')
+        self.alpha_ZE = ode_param('alpha_ZE')
+
+        self.kd = ode_param('kd')
+        self.ka = ode_param('ka')
+
+        self.micE = ode_param('micE')
+        self.micZ = ode_param('micZ')
+        self.dmaxE = ode_param('dmaxE')
+        self.dmaxZ = ode_param('dmaxZ')
+        self.gamma = ode_param('gamma')
+
+        self.init_E = init_cond('E')
+        self.init_Z = init_cond('Z')
+        self.init_D = init_cond('D')
+
+    def reset_records(self) -> None:
+        self.total_drug_in = np.zeros(self.n_envs) # cumulative drug "absorbed" / "flowed" in
+        self.five_percent = 0.05 * self.init_E
+        self.t5p_first = np.full(self.n_envs, np.nan) # first time point at which density E = 5% of its initial condition
+        self.tTiny_first = np.full(self.n_envs, np.nan) # first time point at which density E = tiny number
+        self.running = np.ones(self.n_envs, dtype=bool) # envs that are not stopped (see `stop`)
+
+    def coexist_equilibrium(self) -> Tuple:
+        '''
+        Computes the equilibria of coexistence of all environments, as in `BacterialEnv.coexist_equilibrium`
+        '''
+        denom = self.rE * self.rZ - self.cE * self.cZ * self.alpha_EZ * self.alpha_ZE
+        E = (self.cE * self.rE * self.rZ + self.cE * self.cZ * self.rZ * self.alpha_EZ) / denom
+        Z = (self.cZ * self.rE * self.rZ + self.cE * self.cZ * self.rE * self.alpha_ZE) / denom
+
+        if np.any(E <= 0.0) or np.any(Z <= 0.0):
+            raise RuntimeError("Coexist equilibrium does not exist.")
+
+        return (E, Z)
+
+    def reset_2_equilibria(self, eq_type="coexist") -> None:
+        '''
+        Resets all environments, as in `BacterialEnv.reset_2_equilibria`
+        '''
+        if eq_type == "coexist":
+            eqE, eqZ = self.coexist_equilibrium()
+        elif eq_type == "mono":
+            eqE, eqZ = self.cE.copy(), self.cZ.copy()
+        else:
+            raise ValueError("Parameter `eq_type` can only be either \"coexist\" or \"mono\".")
+
+        self.init_E = eqE
+        self.init_Z = eqZ
+        self.S = np.column_stack([eqE, eqZ, self.init_D])
+        self.t = 0.0
+
+        self.reset_records()
+
+    def set_state(self, S: np.ndarray, t: float, init_E=None) -> None:
+        '''
+        Sets the current state of all environments, e.g. to branch rollouts from the state of a `BacterialEnv`
+        Parameters:
+            S (numpy array): states [E, Z, D], of shape (n_envs, 3) or (3,) for the same state in all envs
+            t (float): current time
+            init_E (float, array or None): initial density of E used for rewards & the 5% event, unchanged if None
+        '''
+        self.S = np.array(np.broadcast_to(S, (self.n_envs, 3)), dtype=float)
+        self.t = t
+
+        if init_E is not None:
+            self.init_E = np.array(np.broadcast_to(init_E, (self.n_envs,)), dtype=float)
+
+        self.reset_records()
+
+    def ODEsys(self, t, y, Din: np.ndarray) -> np.ndarray:
+        '''
+        Returns derivatives of the stacked ODE systems, y = [E of all envs, Z of all envs, D of all envs]
+        '''
+        E, Z, D = y.reshape(3, self.n_envs)
+
+        Dg = D**self.gamma
+        deltaE = self.dmaxE * Dg / (self.micE**self.gamma + Dg)
+        deltaZ = self.dmaxZ * Dg / (self.micZ**self.gamma + Dg)
+
+        dE_dt = E * (self.rE - self.rE/self.cE * E + self.alpha_EZ * Z - deltaE)
+        dZ_dt = Z * (self.rZ - self.rZ/self.cZ * Z + self.alpha_ZE * E - deltaZ)
+        dD_dt = self.ka * Din - self.kd * D
+
+        return np.concatenate([dE_dt, dZ_dt, dD_dt])
+
+    def record_events(self, t: np.ndarray, E: np.ndarray) -> None:
+        '''
+        Records the first time points at which E crosses 5% of its initial condition & the tiny density,
+        by linear interpolation between consecutive solver points
+        Parameters:
+            t (numpy array): solver time points, shape (n,)
+            E (numpy array): densities E of all envs at the time points, shape (n_envs, n)
+        '''
+        for first, threshold in [(self.t5p_first, self.five_percent), (self.tTiny_first, 10**(-4))]:
+            pending = np.isnan(first) & self.running
+            if not np.any(pending):
+                continue
+
+            g = E[pending] - np.broadcast_to(threshold, (self.n_envs,))[pending, np.newaxis]
+            crossed = (g[:, :-1] * g[:, 1:] < 0.0) | ((g[:, 1:] == 0.0) & (g[:, :-1] != 0.0))
+            has_crossed = crossed.any(axis=1)
+            if not np.any(has_crossed):
+                continue
+
+            k = np.argmax(crossed, axis=1)[has_crossed]
+            g_cross = g[has_crossed]
+            rows = np.arange(len(k))
+            g0 = g_cross[rows, k]
+            g1 = g_cross[rows, k + 1]
+            t_cross = t[k] + (t[k + 1] - t[k]) * g0 / (g0 - g1)
+
+            idx = np.flatnonzero(pending)[has_crossed]
+            first[idx] = t_cross
+
+    def integrate(self, duration: float, Din: np.ndarray) -> None:
+        '''
+        Integrates all environments for a time period under constant "flow in" drug concentrations
+        '''
+        if duration <= 0.0:
+            return
+
+        y0 = self.S.T.ravel()
+        sol = solve_ivp(self.ODEsys, [self.t, self.t + duration], y0, args=(Din,),
+                        max_step=self.max_step, method="LSODA")
+
+        y = sol.y.reshape(3, self.n_envs, -1)
+        self.record_events(sol.t, y[0])
+
+        S = y[:, :, -1].T.copy()
+        S[:, :2] = np.where(np.round(S[:, :2], 5) == 0, 0.0, S[:, :2]) # densities below tiny are set to 0, as in `BacterialEnv`
+        self.S = S
+        self.t = sol.t[-1]
+
+    def step(self, Din: np.ndarray, drug_time) -> Tuple:
+        '''
+        Solves the ODE systems of all environments for a time period defined by `step_time` param
+        Parameters:
+            Din (numpy array): "flow in" drug concentration chosen for each env
+            drug_time (float or numpy array): time for "flow in" of drug, the same for all envs or one per env
+        Returns:
+            state (numpy array): observable states of the envs
+            reward (numpy array): rewards, as calculated by reward function "minED"
+            done (numpy array): whether a terminal state has been observed in each env
+        '''
+        Din = np.where(self.running, np.asarray(Din, dtype=float), 0.0)
+        drug_time = np.broadcast_to(np.asarray(drug_time, dtype=float), (self.n_envs,))
+
+        if np.any(drug_time > self.step_time):
+            raise ValueError("Time duration for drug in cannot be longer than step time")
+
+        self.total_drug_in += Din * drug_time * self.ka
+
+        # integrate between the time points at which the drug of any env stops flowing in
+        t_start = self.t
+        breaks = np.unique(np.append(drug_time[drug_time > 0.0], self.step_time))
+        prev = 0.0
+        for b in breaks:
+            self.integrate(b - prev, np.where(drug_time >= b, Din, 0.0))
+            prev = b
+        self.t = t_start + self.step_time
+
+        reward, done = rf.minED_batch(Din, self.S[:, 0], self.init_E, **self.reward_kwargs)
+
+        return self.get_state(), reward, done
+
+    def stop(self, mask: np.ndarray) -> None:
+        '''
+        Stops the envs in `mask`: they get no more drug and no more events are recorded for them,
+        equivalent to breaking out of the simulation of a single env
+        '''
+        self.running &= ~mask
+
+    def get_state(self) -> np.ndarray:
+        '''
+        Returns the "current" observable states of all environments, as in `BacterialEnv.get_state`
+        '''
+        return discretize_state(self.S[:, 0], self.S[:, 1], self.state_method, self.n_states, self.growth_bounds)
+
+def discretize_state(E: np.ndarray, Z: np.ndarray, state_method: str, n_states=None, growth_bounds=(0.0, 0.5)) -> np.ndarray:
+    '''
+    Vectorized derivation of observable states from densities, as in `BacterialEnv.get_state`
+    '''
+    if state_method == "cont_E":
+        return E.copy()
+
+    if n_states is None:
+        raise RuntimeError(f'n_states should be defined for \"{state_method}\" method')
+
+    if state_method == "disc_EZ":
+        N_disc = int(math.sqrt(n_states) - 2)
+    else:
+        N_disc = int(n_states - 2)
+    OD2state = (growth_bounds[1] - growth_bounds[0]) / N_disc
+
+    E_disc = np.where(E > 0.0, E // OD2state + 1, 0).astype(int)
+
+    if state_method == "disc_E":
+        return E_disc
+
+    Z_disc = np.where(Z > 0.0, Z // OD2state + 1, 0).astype(int)
+
+    return (E_disc * math.sqrt(n_states) + Z_disc).astype(int)
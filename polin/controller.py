@@ -1,6 +1,10 @@
+from polin.batch_env import BatchBacterialEnv
+
 from typing import List, Dict, Tuple
 import numpy as np
 import math
+import itertools
+import time
 
 import os
 import tempfile
@@ -15,6 +19,81 @@ os.environ['MPLCONFIGDIR'] = mpldir
 import matplotlib.pyplot as plt
 import seaborn as sns
 import polin.colors as colchart
+import polin.viz as viz
+
+def seed_sequence(seed=None) -> np.random.SeedSequence:
+    '''
+    Returns the seed sequence of a seed, as written in param files:
+    None (fresh entropy), an int, or a dictionary {"entropy": int, "spawn_key": list of int}
+    '''
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    if isinstance(seed, dict):
+        return np.random.SeedSequence(seed['entropy'], spawn_key=tuple(seed.get('spawn_key', ())))
+    
+    return np.random.SeedSequence(seed)
+
+def seed_dict(ss: np.random.SeedSequence) -> Dict:
+    '''
+    Returns the dictionary to write a seed sequence to a param file, inverse of `seed_sequence`
+    '''
+    return {'entropy': ss.entropy, 'spawn_key': list(ss.spawn_key)}
+
+def decaying_rate(episode: int, decay: float, min_r = 0.0, max_r = 1.0) -> float:
+    '''
+    Calculates the logarithmically decreasing exploring or learning rate of the QLearning & LinearQ agents
+    Parameters:
+        episode (int): the current episode
+        min_r (float): minimum rate
+        max_r (float): maximum rate
+        decay (float): controls the rate of decay
+    Returns:
+        rate (float): exploring or learning rate
+    '''
+
+    # input validation
+    if not 0 <= min_r <= 1:
+        raise ValueError("MIN_LEARNING_RATE needs to be bewteen 0 and 1")
+
+    if not 0 <= max_r <= 1:
+        raise ValueError("MAX_LEARNING_RATE needs to be bewteen 0 and 1")
+
+    if not 0 < decay:
+        raise ValueError("decay needs to be above 0")
+    
+    rate = max(min_r, min(max_r, 1.0 - math.log10((episode + 1) / decay)))
+
+    return rate
+
+class ExplorationStream():
+    '''
+    Exploration decisions drawn in blocks from a random generator: for every decision, a uniform number (explore or not)
+    & a random action index are drawn, whether the agent explores or not, so the stream only depends on the seed.
+    Initialized with:
+        rng (numpy Generator): random generator of the agent
+        n_actions (int): number of actions
+        block_size (int): number of decisions drawn at once
+    '''
+    def __init__(self, rng: np.random.Generator, n_actions: int, block_size=4096):
+
+        self.rng = rng
+        self.n_actions = n_actions
+        self.block_size = block_size
+        self.i = block_size
+
+    def draw(self, explore_rate: float) -> int:
+        '''
+        Returns the index of a random action if the agent explores (with chance `explore_rate`), -1 otherwise
+        '''
+        if self.i == self.block_size:
+            self.uniform = self.rng.random(self.block_size)
+            self.random_actions = self.rng.integers(self.n_actions, size=self.block_size)
+            self.i = 0
+        
+        i = self.i
+        self.i += 1
+
+        return int(self.random_actions[i]) if self.uniform[i] < explore_rate else -1
 
 class QLearningAgent():
     '''
@@ -28,10 +107,11 @@ class QLearningAgent():
         drug_time (float): time for "flow in" of drug
         gamma (float): discount rate
         alpha (float): learning rate
+        seed (None, int, dict, SeedSequence or numpy Generator): seed of the random generator of exploration
     '''
     def __init__(self, n_states: int, n_actions: int, n_states_dimensions: int,
                  Din_options: Tuple, drug_time = 60.0*3, 
-                 gamma=0.9, alpha=0.01):
+                 gamma=0.9, alpha=0.01, seed=None):
         
         self.type_name = 'QLearning'
 
@@ -43,6 +123,8 @@ class QLearningAgent():
             raise ValueError("The number of states dimensions can only be either 1 or 2")
         else:
             self.n_states_dimensions = n_states_dimensions
+        
+        self.state_method = 'disc_E' if n_states_dimensions == 1 else 'disc_EZ' # method of the env to derive observable state
 
         if len(Din_options) != n_actions:
             raise ValueError("The number of Din options should be equal to the number of actions")
@@ -54,15 +136,21 @@ class QLearningAgent():
 
         self.drug_time = drug_time
 
-    def update_values(self, transition: Tuple) -> None:
+        self.rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed_sequence(seed))
+        self.exploration = ExplorationStream(self.rng, n_actions)
+
+    def update_values(self, transition: Tuple, discount=None) -> None:
         '''
         Updates the agents value function based on the experience in transition
         Parameters:
             transition (tuple): tuple of (state, action_index, reward, next_state, done)
+            discount (float or None): discount of the next state, `gamma` if None 
+                                      (e.g. gamma to the power of the elapsed steps, for steps of varying duration)
         '''
         state, action, reward, next_state, done = transition
+        gamma = self.gamma if discount is None else discount
 
-        self.values[state, action] += self.alpha * (reward + self.gamma * np.max(self.values[next_state] * (1-done)) - self.values[state, action])
+        self.values[state, action] += self.alpha * (reward + gamma * np.max(self.values[next_state] * (1-done)) - self.values[state, action])
 
     def get_action(self, state: int, explore_rate: float) -> [int, Tuple]:
         '''
@@ -76,10 +164,9 @@ class QLearningAgent():
                             in the form of (Din (float): "flow in" drug concentration, 
                                             drug_time (float): time for "flow in" of drug)
         '''
-        if np.random.random() < explore_rate:
-            action_index = np.random.choice(range(self.n_actions))
+        action_index = self.exploration.draw(explore_rate)
         
-        else:
+        if action_index < 0:
             action_index = np.argmax(self.values[state])
         
         action = (self.Din_options[action_index], self.drug_time)
@@ -88,29 +175,9 @@ class QLearningAgent():
 
     def get_rate(self, episode: int, decay: float, min_r = 0.0, max_r = 1.0) -> float:
         '''
-        Calculates the logarithmically decreasing exploring or learning rate
-        Parameters:
-            episode (int): the current episode
-            min_r (float): minimum rate
-            max_r (float): maximum rate
-            decay (float): controls the rate of decay
-        Returns:
-            rate (float): exploring or learning rate
+        Calculates the logarithmically decreasing exploring or learning rate (see `decaying_rate`)
         '''
-
-        # input validation
-        if not 0 <= min_r <= 1:
-            raise ValueError("MIN_LEARNING_RATE needs to be bewteen 0 and 1")
-
-        if not 0 <= max_r <= 1:
-            raise ValueError("MAX_LEARNING_RATE needs to be bewteen 0 and 1")
-
-        if not 0 < decay:
-            raise ValueError("decay needs to be above 0")
-        
-        rate = max(min_r, min(max_r, 1.0 - math.log10((episode + 1) / decay)))
-
-        return rate
+        return decaying_rate(episode, decay, min_r, max_r)
     
     def set_values(self, qtable: np.ndarray) -> None:
         '''
@@ -121,10 +188,13 @@ class QLearningAgent():
         self.values = qtable
         self.n_states, self.n_actions = np.shape(qtable)
     
-    def visualize_policy(self, initE: float, OD2state: float) -> plt.figure:
+    def visualize_policy(self, initE: float, OD2state: float, fig=None) -> plt.figure:
         '''
         Visualizes the policy of the agent
         Parameters:
+            initE (float): initial density of E, marked on the plot
+            OD2state (float): distance (in density unit) between 2 consecutive states
+            fig: (optional) figure made earlier by this method, to be reused as template
         Returns:
             fig: matplotlib figure object
         '''
@@ -138,17 +208,20 @@ class QLearningAgent():
         plt.rcParams.update(mathtext)
 
         if self.n_states_dimensions == 2:
-            return self.visualize_policy_2D(initE = initE, OD2state = OD2state)
+            return self.visualize_policy_2D(initE = initE, OD2state = OD2state, fig = fig)
         else:
-            return self.visualize_policy_1D(initE = initE, OD2state = OD2state)
+            return self.visualize_policy_1D(initE = initE, OD2state = OD2state, fig = fig)
 
-    def visualize_policy_1D(self, initE: float, OD2state: float) -> plt.figure:
+    def visualize_policy_1D(self, initE: float, OD2state: float, fig=None) -> plt.figure:
         palE = colchart.get_colorBook("Egypt")
         palT = colchart.get_colorBook("myTheme")
 
-        fig, ax = plt.subplots(1, 3, figsize=(7.5*2 + 0.2, 4), 
-                               gridspec_kw={'wspace': 0.1,
-                               'width_ratios': [0.49, 0.49, 0.02]})
+        if fig is None:
+            fig, ax = plt.subplots(1, 3, figsize=(7.5*2 + 0.2, 4), 
+                                   gridspec_kw={'wspace': 0.1,
+                                   'width_ratios': [0.49, 0.49, 0.02]})
+        else:
+            ax = viz.reuse_figure(fig, n_axes=3)
         
         xlims = (0, self.n_states)
         xts = np.linspace(0.5, self.n_states-0.5, 5)
@@ -192,7 +265,7 @@ class QLearningAgent():
         ax[1].set_yticklabels([""]*len(self.Din_options))
         ax[1].set(xlabel="$E$ (OD)")
         
-        c = plt.colorbar(v, cax=ax[2], label="Value")
+        c = fig.colorbar(v, cax=ax[2], label="Value")
         ax[2].locator_params(tight=True, nbins=4)
         ax[2].tick_params(labelsize=14)
 
@@ -206,11 +279,184 @@ class QLearningAgent():
         
         return fig
 
-    def visualize_policy_2D(self, initE: float, OD2state: float) -> plt.figure:
+    def visualize_policy_2D(self, initE: float, OD2state: float, fig=None) -> plt.figure:
+
+        if fig is None:
+            fig, ax = plt.subplots(1, 3, figsize=(7.5*2 + 0.2, 7.5), 
+                                   gridspec_kw={'wspace': 0.1,
+                                   'width_ratios': [0.49, 0.49, 0.02]})
+        else:
+            ax = viz.reuse_figure(fig, n_axes=3)
+        return fig
+
+class LinearQAgent():
+    '''
+    Q-learning agent with linear function approximation of the action values, over radial basis features of the 
+    continuous state (E, Z, D). Like `QLearningAgent`, it controls drug in concentration, with drug in time & frequency fixed.
+    The features of a state are computed for all basis functions at once, and each TD update changes the weights of
+    all the states nearby, so fewer episodes are needed than to fill in a table of discrete states.
+    Initialized with:
+        n_actions (int): the number of actions that the agent can choose from
+        Din_options (tuple): tuple of available "flow in" drug concentrations that the agent can choose from.
+                                The number of options should be equal to the number of actions.
+        n_centers (tuple): number of basis function centers along E, Z & D
+        growth_bounds (tuple): bounds of bacterial densities E & Z covered by the centers
+        D_bounds (tuple): bounds of drug concentration D covered by the centers
+        drug_time (float): time for "flow in" of drug
+        gamma (float): discount rate
+        alpha (float): learning rate
+        seed (None, int, dict, SeedSequence or numpy Generator): seed of the random generator of exploration
+    '''
+    def __init__(self, n_actions: int, Din_options: Tuple, 
+                 n_centers=(6, 6, 6), growth_bounds=(0.0, 0.5), D_bounds=(0.0, 200.0),
+                 drug_time = 60.0*3, gamma=0.9, alpha=0.01, seed=None):
+
+        self.type_name = 'LinearQ'
+        self.state_method = 'cont_EZD' # method of the env to derive observable state
+        self.n_states = None # continuous states
+
+        self.n_actions = n_actions
+        if len(Din_options) != n_actions:
+            raise ValueError("The number of Din options should be equal to the number of actions")
+        else:
+            self.Din_options = Din_options
+
+        # centers on a regular grid over the (E, Z, D) box, widths equal to the grid spacings
+        bounds = [growth_bounds, growth_bounds, D_bounds]
+        axes = [np.linspace(lo, hi, n) for (lo, hi), n in zip(bounds, n_centers)]
+        self.centers = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+        self.widths = np.array([(hi - lo) / max(n - 1, 1) for (lo, hi), n in zip(bounds, n_centers)])
+
+        self.n_features = len(self.centers) + 1 # + bias feature
+        self.values = np.zeros((self.n_features, n_actions)) # weights of the features, for each action
+
+        self.gamma = gamma
+        self.alpha = alpha
+
+        self.drug_time = drug_time
+
+        self.rng = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed_sequence(seed))
+        self.exploration = ExplorationStream(self.rng, n_actions)
+    
+    def features(self, state: np.ndarray) -> np.ndarray:
+        '''
+        Returns the normalized radial basis features (& a bias feature) of one state [E, Z, D], or of a matrix of states
+        '''
+        state = np.atleast_2d(state)
+        d2 = (((state[:, np.newaxis, :] - self.centers) / self.widths)**2).sum(axis=2)
+        rbf = np.exp(-0.5 * d2)
+        rbf /= rbf.sum(axis=1, keepdims=True) + 1e-12
+
+        phi = np.concatenate([rbf, np.ones((len(state), 1))], axis=1)
+
+        return phi[0] if phi.shape[0] == 1 else phi
+
+    def q_values(self, state: np.ndarray) -> np.ndarray:
+        '''
+        Returns the approximated action values of one state, or of a matrix of states
+        '''
+        return self.features(state) @ self.values
+
+    def update_values(self, transition: Tuple, discount=None) -> None:
+        '''
+        Updates the weights with a semi-gradient TD step, based on the experience in transition
+        Parameters:
+            transition (tuple): tuple of (state, action_index, reward, next_state, done)
+            discount (float or None): discount of the next state, `gamma` if None (see `QLearningAgent.update_values`)
+        '''
+        state, action, reward, next_state, done = transition
+        gamma = self.gamma if discount is None else discount
+
+        phi = self.features(state)
+        target = reward + gamma * np.max(self.features(next_state) @ self.values) * (1-done)
+        td_error = target - phi @ self.values[:, action]
+
+        self.values[:, action] += self.alpha * td_error * phi
+
+    def get_action(self, state: np.ndarray, explore_rate: float) -> [int, Tuple]:
+        '''
+        Chooses an action based on the approximated action values and the current explore rate, as in `QLearningAgent`
+        Parameters:
+            state (numpy array): the current state [E, Z, D] given by the environment
+            explore_rate (float): the chance of taking a random action
+        Returns: 
+            action_index (int): index of the chosen action
+            action (tuple): the action to be applied to the environment
+        '''
+        action_index = self.exploration.draw(explore_rate)
+        
+        if action_index < 0:
+            action_index = np.argmax(self.q_values(state))
+        
+        action = (self.Din_options[action_index], self.drug_time)
+
+        return action_index, action
+
+    def get_rate(self, episode: int, decay: float, min_r = 0.0, max_r = 1.0) -> float:
+        '''
+        Calculates the logarithmically decreasing exploring or learning rate (see `decaying_rate`)
+        '''
+        return decaying_rate(episode, decay, min_r, max_r)
+
+    def set_values(self, weights: np.ndarray) -> None:
+        '''
+        Sets the feature weights to (learned) weights
+        '''
+        if np.shape(weights) != (self.n_features, self.n_actions):
+            raise ValueError(f"Weights should be of shape {(self.n_features, self.n_actions)}")
+        
+        self.values = weights
+
+    def visualize_policy(self, initE: float, initZ: float, fig=None) -> plt.figure:
+        '''
+        Visualizes the greedy policy & values of the agent over E & D, with Z at its initial density
+        Parameters:
+            initE (float): initial density of E, marked on the plot
+            initZ (float): density of Z at which the policy is shown
+            fig: (optional) figure made earlier by this method, to be reused as template
+        Returns:
+            fig: matplotlib figure object
+        '''
+        sns.set_style("ticks")
+        font = {'family': 'sans-serif', 'serif': 'Helvetica',
+                'size': 25}
+        plt.rc('font', **font)
+        mathtext = {'mathtext.default': 'it'} 
+        plt.rcParams.update(mathtext)
+
+        palT = colchart.get_colorBook("myTheme")
+
+        if fig is None:
+            fig, ax = plt.subplots(1, 4, figsize=(7.5*2 + 0.4, 5), 
+                                   gridspec_kw={'wspace': 0.15,
+                                   'width_ratios': [0.48, 0.02, 0.48, 0.02]})
+        else:
+            ax = viz.reuse_figure(fig, n_axes=4)
+
+        E = np.linspace(self.centers[:, 0].min(), self.centers[:, 0].max(), 101)
+        D = np.linspace(self.centers[:, 2].min(), self.centers[:, 2].max(), 101)
+        EE, DD = np.meshgrid(E, D)
+        states = np.column_stack([EE.ravel(), np.full(EE.size, initZ), DD.ravel()])
+
+        Q = self.q_values(states)
+        best = np.array(self.Din_options)[np.argmax(Q, axis=1)].reshape(EE.shape)
+        value = np.max(Q, axis=1).reshape(EE.shape)
+
+        a = ax[0].pcolormesh(E, D, best, cmap="Blues", shading='auto',
+                             vmin=min(self.Din_options), vmax=max(self.Din_options))
+        fig.colorbar(a, cax=ax[1], ticks=self.Din_options)
+        v = ax[2].pcolormesh(E, D, value, cmap="Oranges", shading='auto')
+        fig.colorbar(v, cax=ax[3], label="Value")
+
+        for i in [0, 2]:
+            ax[i].axvline(x=initE, color=palT['pur'], lw=2, ls='--')
+            ax[i].set(xlabel="$E$ (OD)")
+        ax[0].set(ylabel="$D$ ($\mu$g/mL)", title="Choice for $D_{in}$")
+        ax[2].set_yticklabels([])
+        ax[2].set(title="Value")
+        for i in [1, 3]:
+            ax[i].tick_params(labelsize=14)
 
-        fig, ax = plt.subplots(1, 3, figsize=(7.5*2 + 0.2, 7.5), 
-                               gridspec_kw={'wspace': 0.1,
-                               'width_ratios': [0.49, 0.49, 0.02]})
         return fig
 
 class RationalAgent():
@@ -240,4 +486,125 @@ class RationalAgent():
         else:
             action = (0.0, self.drug_time)
 
-        return action
\ No newline at end of file
+        return action
+
+class ScheduleAgent():
+    '''
+    Open-loop drug policy: replays a schedule of "flow in" drug concentrations, one per step, regardless of the state
+    Initialized with:
+        schedule (list or numpy array): "flow in" drug concentration of every step (the last one is kept after the schedule ends)
+        drug_time (float): time for "flow in" of drug
+    '''
+    def __init__(self, schedule, drug_time = 60.0*3):
+
+        self.type_name = "Schedule"
+        self.schedule = np.asarray(schedule, dtype=float)
+        self.drug_time = drug_time
+        self.i_step = 0
+
+    def reset(self) -> None:
+        '''
+        Restarts the schedule from its first step
+        '''
+        self.i_step = 0
+    
+    def get_action(self, state) -> Tuple:
+        '''
+        Returns the action of the current step of the schedule, in the form of (Din, drug_time)
+        '''
+        Din = self.schedule[min(self.i_step, len(self.schedule) - 1)]
+        self.i_step += 1
+
+        return (float(Din), self.drug_time)
+
+class MPCAgent():
+    '''
+    Receding-horizon (model-predictive) drug policy: at every decision, sequences of "flow in" drug concentrations
+    (from `Din_options`) over the next `horizon` steps are simulated from the current state of the env, all together
+    in one batch of environments (`BatchBacterialEnv`), & the first action of the sequence with the highest return
+    (reward function "minED") is taken
+    Initialized with:
+        env_param_dict (dictionary): parameters for the ODE model, as in the experiment param file
+        step_time (float): time between decisions, as `env_step_time` of the simulation
+        reward_kwargs (dict): parameters for reward caculations
+        Din_options (tuple): options of "flow in" drug concentration
+        drug_time (float): time for "flow in" of drug
+        horizon (int): number of steps of the simulated sequences
+        n_sequences (int or None): number of sequences sampled at random at every decision (each option is the first action
+                                   of some of them), all len(Din_options)**horizon sequences if None or if there are fewer
+        time_budget (float or None): time (in s) per decision, unlimited if None. Once it is spent, the rollouts stop
+                                     at the end of the current step & the sequences are scored on the steps simulated so far
+        gamma (float): discount of the rewards along the horizon
+        max_step (float): maximum step size of the solver of the rollouts
+        seed (None, int or dict): seed of the sampling of sequences (see `seed_sequence`)
+    '''
+    def __init__(self, env_param_dict: Dict, step_time: float, reward_kwargs: Dict,
+                 Din_options: Tuple, drug_time = 60.0*3, horizon = 3, n_sequences = None,
+                 time_budget = None, gamma = 1.0, max_step = 0.01, seed = None):
+
+        self.type_name = "MPC"
+        self.Din_options = np.array(Din_options, dtype=float)
+        self.n_actions = len(Din_options)
+        self.drug_time = drug_time
+        self.horizon = horizon
+        self.time_budget = time_budget
+        self.gamma = gamma
+
+        self.rng = np.random.default_rng(seed_sequence(seed))
+
+        if n_sequences is None or n_sequences >= self.n_actions ** horizon:
+            self.sequences = np.array(list(itertools.product(range(self.n_actions), repeat=horizon)), dtype=int)
+            self.n_sequences = len(self.sequences)
+        else:
+            self.sequences = None # sampled at every decision
+            self.n_sequences = max(n_sequences, self.n_actions)
+
+        self.env = BatchBacterialEnv([env_param_dict] * self.n_sequences, step_time = step_time,
+                                     reward_kwargs = reward_kwargs, max_step = max_step)
+
+        self.decisions = [] # (time, Din, number of steps simulated, time spent in s) of every decision
+
+    def candidate_sequences(self) -> np.ndarray:
+        '''
+        Returns the indices of the actions of the sequences to simulate, of shape (n_sequences, horizon)
+        '''
+        if self.sequences is not None:
+            return self.sequences
+
+        sequences = self.rng.integers(self.n_actions, size=(self.n_sequences, self.horizon))
+        sequences[:, 0] = np.arange(self.n_sequences) % self.n_actions
+
+        return sequences
+
+    def get_action(self, env, sim_time=None) -> Tuple:
+        '''
+        Returns action based on the current state of an env
+        Parameters:
+            env (BacterialEnv): the controlled env, rollouts start from its current state S = [E, Z, D] & time
+            sim_time (float or None): end of the simulation, the horizon does not go past it if given
+        Returns:
+            action (tuple): action chosen by the controller, 
+                            in the form of (Din (float): "flow in" drug concentration, drug_time (float): time for "flow in" of drug)
+        '''
+        t_start = time.perf_counter()
+
+        t = env.tSol[-1]
+        horizon = self.horizon
+        if sim_time is not None:
+            horizon = max(1, min(horizon, int(np.ceil(round((sim_time - t) / self.env.step_time, 9)))))
+
+        sequences = self.candidate_sequences()
+        self.env.set_state(env.sSol[-1, :], t, init_E = env.sSol[0, 0])
+
+        returns = np.zeros(self.n_sequences)
+        for k in range(horizon):
+            _, reward, _ = self.env.step(self.Din_options[sequences[:, k]], self.drug_time)
+            returns += self.gamma**k * reward
+
+            if self.time_budget is not None and time.perf_counter() - t_start > self.time_budget:
+                break
+        
+        Din = float(self.Din_options[sequences[np.argmax(returns), 0]])
+        self.decisions.append((t, Din, k + 1, time.perf_counter() - t_start))
+
+        return (Din, self.drug_time)
@@ -0,0 +1,523 @@
+from polin.batch_env import BatchBacterialEnv
+from polin.sim_cache import cache_key
+from polin.controller import seed_sequence
+import polin.sim_data as sim_data
+
+from typing import List, Dict, Tuple
+import numpy as np
+import pandas as pd
+
+import json
+import os
+from copy import deepcopy
+from multiprocessing import Pool
+
+# measurements returned by the evaluations
+eval_metrics = ["e_return", "t5p_first", "tTiny_first", "total_drug_in"]
+
+def state_method_of(agent_param_dict: Dict) -> str:
+    return 'disc_E' if agent_param_dict['n_states_dimensions'] == 1 else 'disc_EZ'
+
+def greedy_rollout(qtables: np.ndarray, q_index: np.ndarray, env_param_dicts: List[Dict],
+                   sim_param_dict: Dict, agent_param_dict: Dict,
+                   done_break=False, max_step=0.01) -> Dict:
+    '''
+    Simulates greedy Q-learning policies in a batch of environments, as in `TrainTest.test_QLearning` with explore rate 0
+    Parameters:
+        qtables (numpy array): stack of Q-tables, shape (n_qtables, n_states, n_actions)
+        q_index (numpy array): index of the Q-table that controls each environment
+        env_param_dicts (list of dictionaries): env parameters, one per environment (same length as `q_index`)
+        sim_param_dict (dictionary): simulation parameters, as in the experiment param file
+        agent_param_dict (dictionary): Q-learning agent parameters, as in the experiment param file
+        done_break (bool): whether to stop an environment when a terminal state is observed
+        max_step (float): maximum step size of the solver
+    Returns:
+        result (dict): arrays of the measurements in `eval_metrics`, one element per environment
+    '''
+    env = BatchBacterialEnv(env_param_dicts, step_time = sim_param_dict['env_step_time'],
+                            reward_kwargs = sim_param_dict['reward_kwargs'],
+                            state_method = state_method_of(agent_param_dict),
+                            n_states = agent_param_dict['n_states'], max_step = max_step)
+    env.reset_2_equilibria(eq_type = sim_param_dict['reset_type'])
+
+    Din_options = np.array(agent_param_dict['Din_options'], dtype=float)
+    drug_time = agent_param_dict['drug_time']
+
+    q_index = np.asarray(q_index)
+    e_return = np.zeros(env.n_envs)
+    state = env.get_state()
+
+    while env.t < sim_param_dict['simulation_time']:
+
+        action_index = np.argmax(qtables[q_index, state], axis=1)
+        running = env.running.copy()
+
+        state, reward, done = env.step(Din_options[action_index], drug_time)
+        e_return += np.where(running, reward, 0.0)
+
+        if done_break:
+            env.stop(done)
+            if not np.any(env.running):
+                break
+
+    return {'e_return': e_return, 't5p_first': env.t5p_first,
+            'tTiny_first': env.tTiny_first, 'total_drug_in': env.total_drug_in}
+
+def _greedy_rollout_task(args: Tuple) -> Dict:
+    return greedy_rollout(*args)
+
+def evaluate_pairs(qtables: np.ndarray, env_param_dicts: List[Dict], pairs: List[Tuple],
+                   sim_param_dict: Dict, agent_param_dict: Dict,
+                   done_break=False, batch_size=64, n_workers=1, max_step=0.01) -> Dict:
+    '''
+    Evaluates greedy policies of Q-tables on env parameter sets, for given pairs (Q-table index, env parameter set index).
+    The pairs are simulated in batches of `batch_size` environments, & the batches are shared among `n_workers` processes.
+    Returns:
+        result (dict): arrays of the measurements in `eval_metrics`, one element per pair
+    '''
+    pairs = np.asarray(pairs, dtype=int).reshape(-1, 2)
+
+    tasks = []
+    for i in range(0, len(pairs), batch_size):
+        batch = pairs[i:i + batch_size]
+        tasks.append((qtables, batch[:, 0], [env_param_dicts[j] for j in batch[:, 1]],
+                      sim_param_dict, agent_param_dict, done_break, max_step))
+
+    if n_workers == 1:
+        results = [_greedy_rollout_task(t) for t in tasks]
+    else:
+        with Pool(processes=n_workers) as pool:
+            results = pool.map(_greedy_rollout_task, tasks)
+
+    return {m: np.concatenate([r[m] for r in results]) if len(results) > 0 else np.array([]) for m in eval_metrics}
+
+def cross_evaluate(qtables: np.ndarray, env_param_dicts: List[Dict],
+                   sim_param_dict: Dict, agent_param_dict: Dict,
+                   done_break=False, batch_size=64, n_workers=1, max_step=0.01) -> Dict:
+    '''
+    Evaluates the greedy policy of every Q-table on every env parameter set
+    Parameters:
+        qtables (numpy array): stack of Q-tables, shape (n_qtables, n_states, n_actions)
+        env_param_dicts (list of dictionaries): env parameter sets
+        (the others as in `evaluate_pairs`)
+    Returns:
+        result (dict): matrices of the measurements in `eval_metrics`, shape (n_qtables, n_env_param_sets)
+    '''
+    n_q = len(qtables)
+    n_e = len(env_param_dicts)
+
+    pairs = [(i, j) for i in range(n_q) for j in range(n_e)]
+
+    result = evaluate_pairs(qtables, env_param_dicts, pairs, sim_param_dict, agent_param_dict,
+                            done_break = done_break, batch_size = batch_size,
+                            n_workers = n_workers, max_step = max_step)
+
+    return {m: result[m].reshape(n_q, n_e) for m in eval_metrics}
+
+def checkpoint_episodes(n_episodes: int, stride=1) -> List[int]:
+    '''
+    Returns the episodes of the Q-table checkpoints to evaluate: every `stride`-th episode, and always the last one
+    '''
+    episodes = list(range(0, n_episodes, stride))
+    if episodes[-1] != n_episodes - 1:
+        episodes.append(n_episodes - 1)
+
+    return episodes
+
+def sweep_checkpoints(qtables: np.ndarray, episodes: List[int], env_param_dict: Dict,
+                      sim_param_dict: Dict, agent_param_dict: Dict,
+                      done_break=False, batch_size=64, n_workers=1, max_step=0.01) -> pd.DataFrame:
+    '''
+    Evaluates the greedy policies of the Q-table checkpoints of an experiment.
+    Checkpoints with identical greedy policies (same best action in every state) are simulated only once.
+    Parameters:
+        qtables (numpy array): stack of checkpoint Q-tables, shape (n_checkpoints, n_states, n_actions)
+        episodes (list of int): training episode of each checkpoint
+        env_param_dict (dictionary): env parameters of the experiment
+        (the others as in `evaluate_pairs`)
+    Returns:
+        df: data frame with columns episode, policy_ID (checkpoints with the same ID share their greedy policy),
+            followed by the measurements in `eval_metrics`
+    '''
+    policies = np.argmax(qtables, axis=2)
+    _, first_index, policy_ID = np.unique(policies, axis=0, return_index=True, return_inverse=True)
+    policy_ID = policy_ID.ravel()
+
+    pairs = [(i, 0) for i in first_index]
+    result = evaluate_pairs(qtables, [env_param_dict], pairs, sim_param_dict, agent_param_dict,
+                            done_break = done_break, batch_size = batch_size,
+                            n_workers = n_workers, max_step = max_step)
+
+    df = pd.DataFrame({'episode': episodes, 'policy_ID': policy_ID})
+    for m in eval_metrics:
+        df[m] = result[m][policy_ID]
+
+    return df
+
+def sweep_experiment(exp_dir: str, stride=1, done_break=False,
+                     batch_size=64, n_workers=1, max_step=0.01) -> pd.DataFrame:
+    '''
+    Evaluates the saved Q-table checkpoints of an experiment (see `sweep_checkpoints`)
+    & writes the measurements to file `checkpoint_sweep.tsv` in the experiment directory
+    Parameters:
+        exp_dir (str): experiment directory, containing the param file `params.<exp_ID>.json`
+        stride (int): evaluate every `stride`-th checkpoint (& the last one)
+    Returns:
+        df: data frame of the measurements, one row per checkpoint
+    '''
+    exp_ID = os.path.basename(os.path.normpath(exp_dir))
+    exp_dir = os.path.normpath(exp_dir) + '/'
+
+    with open(exp_dir + "params." + exp_ID + ".json") as f:
+        param_dict = json.load(f)
+
+    controller_dict = param_dict['controller']
+    if controller_dict['type_name'] != 'QLearning':
+        raise ValueError("Checkpoint sweep is only applicable to QLearning controllers")
+
+    episodes = checkpoint_episodes(controller_dict['training']['n_episodes'], stride)
+    qtables = np.stack([np.load(exp_dir + 'learned_qtables/QLearningAgent_values.ep' + str(ep) + '.npy') for ep in episodes])
+
+    df = sweep_checkpoints(qtables, episodes, param_dict['env'], param_dict['simulation'], controller_dict['agent'],
+                           done_break = done_break, batch_size = batch_size,
+                           n_workers = n_workers, max_step = max_step)
+
+    df.to_csv(exp_dir + "checkpoint_sweep.tsv", sep='\t', index=False, na_rep='N/A')
+
+    return df
+
+def episodes_to_convergence(exp_dir: str) -> int:
+    '''
+    Returns the number of training episodes until the greedy policy of the saved checkpoints of an experiment
+    stops changing (see `policy_convergence`), or None if the training has not completed
+    Parameters:
+        exp_dir (str): experiment directory, containing the param file `params.<exp_ID>.json`
+    '''
+    exp_ID = os.path.basename(os.path.normpath(exp_dir))
+    exp_dir = os.path.normpath(exp_dir) + '/'
+
+    with open(exp_dir + "params." + exp_ID + ".json") as f:
+        controller_dict = json.load(f)['controller']
+
+    return policy_convergence(sim_data.values_filename(exp_dir, controller_dict['type_name']), 
+                              controller_dict['training']['n_episodes'])
+
+def policy_convergence(qtable_filename: str, n_episodes: int) -> int:
+    '''
+    Returns 1 + the first episode from which the greedy actions of all states are those of the last checkpoint,
+    or None if the last checkpoint does not exist
+    Parameters:
+        qtable_filename (str): path of the checkpoints, without the episode & extension
+        n_episodes (int): number of training episodes
+    '''
+    if not os.path.exists(qtable_filename + str(n_episodes - 1) + '.npy'):
+        return None
+
+    final_policy = np.argmax(np.load(qtable_filename + str(n_episodes - 1) + '.npy'), axis=1)
+    
+    for ep in range(n_episodes - 2, -1, -1):
+        if not np.array_equal(np.argmax(np.load(qtable_filename + str(ep) + '.npy'), axis=1), final_policy):
+            return ep + 2
+    
+    return 1
+
+def resolution_name(agent_param_dict: Dict) -> str:
+    '''
+    Returns the name of the state discretization of a Q-learning agent, e.g. "disc_EZ_484"
+    '''
+    return state_method_of(agent_param_dict) + '_' + str(agent_param_dict['n_states'])
+
+def resolution_dir(exp_dir: str, name: str) -> str:
+    '''
+    Returns the directory of the checkpoints & measurements of a state discretization trained alongside an experiment
+    '''
+    return os.path.normpath(exp_dir) + '/resolutions/' + name + '/'
+
+def resolution_report(exp_dir: str, param_dict: Dict, stride=10, done_break=False,
+                      batch_size=64, n_workers=1, max_step=0.01) -> pd.DataFrame:
+    '''
+    Compares the state discretizations trained together in an experiment (the agent's & the "resolutions" of its controller):
+    the greedy policies of the checkpoints of every discretization are evaluated (see `sweep_checkpoints`)
+    & written to `checkpoint_sweep.tsv` in its directory, & the summary to `resolutions.tsv` in the experiment directory
+    Parameters:
+        exp_dir (str): experiment directory
+        param_dict (dictionary): parameters of the experiment
+        stride (int): evaluate every `stride`-th checkpoint (& the last one)
+    Returns:
+        df: data frame with one row per discretization: its name & number of states, the measurements of the last checkpoint,
+            the best checkpoint & its return, & the number of episodes until the greedy policy stops changing
+    '''
+    exp_dir = os.path.normpath(exp_dir) + '/'
+    controller_dict = param_dict['controller']
+    n_episodes = controller_dict['training']['n_episodes']
+    episodes = checkpoint_episodes(n_episodes, stride)
+
+    tables = [(controller_dict['agent'], exp_dir)]
+    for res in controller_dict['resolutions']['agents']:
+        agent_param_dict = dict(controller_dict['agent'], **res)
+        tables.append((agent_param_dict, resolution_dir(exp_dir, resolution_name(agent_param_dict))))
+
+    rows = []
+    for agent_param_dict, table_dir in tables:
+        qtable_filename = table_dir + 'learned_qtables/QLearningAgent_values.ep'
+        qtables = np.stack([np.load(qtable_filename + str(ep) + '.npy') for ep in episodes])
+
+        df = sweep_checkpoints(qtables, episodes, param_dict['env'], param_dict['simulation'], agent_param_dict,
+                               done_break = done_break, batch_size = batch_size,
+                               n_workers = n_workers, max_step = max_step)
+        df.to_csv(table_dir + "checkpoint_sweep.tsv", sep='\t', index=False, na_rep='N/A')
+
+        best = best_checkpoint(df)
+        row = {'resolution': resolution_name(agent_param_dict), 'n_states': agent_param_dict['n_states'],
+               'behavior': table_dir == exp_dir}
+        row.update({m: df[m].iloc[-1] for m in eval_metrics})
+        row.update({'best_episode': int(best['episode']), 'best_e_return': best['e_return'],
+                    'episodes_to_convergence': policy_convergence(qtable_filename, n_episodes)})
+        rows.append(row)
+
+    df = pd.DataFrame(rows)
+    df.to_csv(exp_dir + "resolutions.tsv", sep='\t', index=False, na_rep='N/A')
+
+    return df
+
+def best_checkpoint(df: pd.DataFrame) -> pd.Series:
+    '''
+    Returns the row of the checkpoint with the highest return (the earliest one in case of ties)
+    '''
+    return df.loc[df['e_return'].idxmax()]
+
+def rational_rollout(env_param_dicts: List[Dict], Din: np.ndarray, drug_time: np.ndarray,
+                     sim_param_dict: Dict, done_break=False, max_step=0.01) -> Dict:
+    '''
+    Simulates rational policies in a batch of environments, as in `TrainTest.test_rational`
+    Parameters:
+        env_param_dicts (list of dictionaries): env parameters, one per environment
+        Din (numpy array): "flow in" drug concentration of the rational policy of each environment
+        drug_time (numpy array): time for "flow in" of drug of the rational policy of each environment
+        (the others as in `greedy_rollout`)
+    Returns:
+        result (dict): arrays of the measurements in `eval_metrics`, one element per environment
+    '''
+    env = BatchBacterialEnv(env_param_dicts, step_time = sim_param_dict['env_step_time'],
+                            reward_kwargs = sim_param_dict['reward_kwargs'],
+                            state_method = 'cont_E', max_step = max_step)
+    env.reset_2_equilibria(eq_type = sim_param_dict['reset_type'])
+
+    Din = np.asarray(Din, dtype=float)
+    drug_time = np.asarray(drug_time, dtype=float)
+
+    e_return = np.zeros(env.n_envs)
+    state = env.get_state()
+
+    while env.t < sim_param_dict['simulation_time']:
+
+        running = env.running.copy()
+
+        # drug in whenever the targeted density > 0.0, as `RationalAgent`
+        state, reward, done = env.step(np.where(state > 0.0, Din, 0.0), drug_time)
+        e_return += np.where(running, reward, 0.0)
+
+        if done_break:
+            env.stop(done)
+            if not np.any(env.running):
+                break
+
+    return {'e_return': e_return, 't5p_first': env.t5p_first,
+            'tTiny_first': env.tTiny_first, 'total_drug_in': env.total_drug_in}
+
+def _rational_rollout_task(args: Tuple) -> Dict:
+    return rational_rollout(*args)
+
+def rational_grid(env_param_dicts: List[Dict], Din_options: List[float], drug_time_options: List[float],
+                  sim_param_dict: Dict, done_break=False, batch_size=256, n_workers=1, max_step=0.01,
+                  cache=None) -> pd.DataFrame:
+    '''
+    Evaluates rational policies of every (Din, drug_time) setting of a grid on every env parameter set.
+    The combinations are simulated in batches of `batch_size` environments, & the batches are shared among `n_workers` processes.
+    Parameters:
+        env_param_dicts (list of dictionaries): env parameter sets
+        Din_options (list of float): "flow in" drug concentrations of the grid
+        drug_time_options (list of float): times for "flow in" of drug of the grid
+        cache (SimulationCache or None): simulation cache to take the measurements of already simulated combinations from,
+                                         & to add the others to
+        (the others as in `evaluate_pairs`)
+    Returns:
+        df: data frame with columns env_index, Din, drug_time, followed by the measurements in `eval_metrics`
+    '''
+    env_index, Din, drug_time = [a.ravel() for a in np.meshgrid(np.arange(len(env_param_dicts)),
+                                                               np.asarray(Din_options, dtype=float),
+                                                               np.asarray(drug_time_options, dtype=float),
+                                                               indexing='ij')]
+
+    metrics = {m: np.full(len(env_index), np.nan) for m in eval_metrics}
+    todo = np.arange(len(env_index)) # combinations to simulate
+
+    if cache is not None:
+        keys = [cache_key(env_param_dicts[e], sim_param_dict, {'type_name': 'Rational', 'Din': d, 'drug_time': t},
+                          {'done_break': done_break, 'max_step': max_step, 'engine': 'batch'})
+                for e, d, t in zip(env_index, Din, drug_time)]
+        
+        cached = cache.get_many(keys)
+        for i, c in enumerate(cached):
+            if c is not None:
+                for m in eval_metrics:
+                    metrics[m][i] = c[0][m]
+        todo = np.array([i for i, c in enumerate(cached) if c is None], dtype=int)
+
+    tasks = []
+    for i in range(0, len(todo), batch_size):
+        s = todo[i:i + batch_size]
+        tasks.append(([env_param_dicts[j] for j in env_index[s]], Din[s], drug_time[s],
+                      sim_param_dict, done_break, max_step))
+
+    if n_workers == 1:
+        results = [_rational_rollout_task(t) for t in tasks]
+    else:
+        with Pool(processes=n_workers) as pool:
+            results = pool.map(_rational_rollout_task, tasks)
+
+    if len(todo) > 0:
+        for m in eval_metrics:
+            metrics[m][todo] = np.concatenate([r[m] for r in results])
+
+    if cache is not None:
+        cache.put_many([(keys[i], {m: float(metrics[m][i]) for m in eval_metrics}, None) for i in todo])
+
+    df = pd.DataFrame({'env_index': env_index, 'Din': Din, 'drug_time': drug_time})
+    for m in eval_metrics:
+        df[m] = metrics[m]
+
+    return df
+
+def pareto_front(df: pd.DataFrame, x="total_drug_in", y="tTiny_first") -> pd.DataFrame:
+    '''
+    Returns the rows of `df` that are not dominated in (x, y), both to be minimized, sorted by x.
+    Rows with a missing y (e.g. E never cleared) are never on the front.
+    '''
+    df = df[df[y].notna()].sort_values([x, y])
+
+    # sorted by x, a row is on the front if its y is below the y of all rows before it
+    best_y = np.minimum.accumulate(df[y].to_numpy())
+    on_front = np.append(True, df[y].to_numpy()[1:] < best_y[:-1])
+
+    return df[on_front]
+
+def sample_env_params(env_param_dict: Dict, distributions: Dict, n_samples: int, seed=None) -> Tuple:
+    '''
+    Draws env parameter sets with uncertain ODE parameters, the other parameters as in `env_param_dict`
+    Parameters:
+        env_param_dict (dictionary): env parameters, with the point estimates of the ODE parameters
+        distributions (dictionary): distribution of every uncertain entry of "ode_params", e.g. {"micE": {"dist": "lognormal", "sigma": 0.2}}:
+                                    - "normal": "mean" (default: the point estimate), "sd", optionally clipped to "low" &/or "high"
+                                    - "lognormal": "median" (default: the point estimate), "sigma" (standard deviation of the log)
+                                    - "uniform": "low", "high"
+        n_samples (int): number of parameter sets
+        seed (None, int or dict): seed of the draws (see `seed_sequence`)
+    Returns:
+        env_param_dicts (list of dictionaries): the parameter sets
+        samples (data frame): the drawn values, one column per uncertain parameter
+    '''
+    rng = np.random.default_rng(seed_sequence(seed))
+    point = env_param_dict['ode_params']
+
+    samples = {}
+    for name, d in distributions.items():
+        if name not in point:
+            raise ValueError(f"Uncertain parameter {name} is not in the ODE parameters: {list(point)}")
+        
+        if d['dist'] == 'normal':
+            x = rng.normal(d.get('mean', point[name]), d['sd'], n_samples)
+            x = np.clip(x, d.get('low'), d.get('high')) if 'low' in d or 'high' in d else x
+        elif d['dist'] == 'lognormal':
+            x = d.get('median', point[name]) * np.exp(rng.normal(0.0, d['sigma'], n_samples))
+        elif d['dist'] == 'uniform':
+            x = rng.uniform(d['low'], d['high'], n_samples)
+        else:
+            raise ValueError(f"Distribution of {name} should be either \"normal\", \"lognormal\" or \"uniform\"")
+        
+        samples[name] = x
+
+    samples = pd.DataFrame(samples)
+
+    env_param_dicts = []
+    for i in range(n_samples):
+        p = deepcopy(env_param_dict)
+        p['ode_params'].update({name: float(samples[name].iloc[i]) for name in samples})
+        env_param_dicts.append(p)
+
+    return env_param_dicts, samples
+
+def coexist_exists(env_param_dicts: List[Dict]) -> np.ndarray:
+    '''
+    Returns whether the equilibrium of co-existence exists (see `BacterialEnv.coexist_equilibrium`), for every env parameter set
+    '''
+    p = {k: np.array([d['ode_params'][k] for d in env_param_dicts], dtype=float) 
+         for k in ['rE', 'rZ', 'cE', 'cZ', 'alpha_EZ', 'alpha_ZE']}
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denom = p['rE'] * p['rZ'] - p['cE'] * p['cZ'] * p['alpha_EZ'] * p['alpha_ZE']
+        E = (p['cE'] * p['rE'] * p['rZ'] + p['cE'] * p['cZ'] * p['rZ'] * p['alpha_EZ']) / denom
+        Z = (p['cZ'] * p['rE'] * p['rZ'] + p['cE'] * p['cZ'] * p['rE'] * p['alpha_ZE']) / denom
+
+    return (E > 0.0) & (Z > 0.0) & np.isfinite(E) & np.isfinite(Z)
+
+def ensemble_evaluate(env_param_dicts: List[Dict], sim_param_dict: Dict, controller_dict: Dict, qtable=None,
+                      done_break=False, batch_size=256, n_workers=1, max_step=0.01) -> pd.DataFrame:
+    '''
+    Evaluates one policy on an ensemble of env parameter sets (see `sample_env_params`).
+    The parameter sets are simulated in batches of `batch_size` environments, & the batches are shared among `n_workers` processes.
+    Parameter sets without co-existence equilibrium cannot be reset to it (reset type "coexist"): they are not simulated
+    Parameters:
+        controller_dict (dictionary): controller of the experiment param file, "Rational" or "QLearning" (greedy policy)
+        qtable (numpy array or None): Q-table of the QLearning policy
+        (the others as in `evaluate_pairs`)
+    Returns:
+        df: data frame with columns sample, valid (whether it is simulated), followed by the measurements in `eval_metrics`
+    '''
+    n = len(env_param_dicts)
+    valid = coexist_exists(env_param_dicts) if sim_param_dict['reset_type'] == 'coexist' else np.ones(n, dtype=bool)
+    todo = np.flatnonzero(valid)
+
+    if controller_dict['type_name'] == 'Rational':
+        # a grid of the one setting of the policy, one row per parameter set
+        grid = rational_grid([env_param_dicts[j] for j in todo], [controller_dict['Din']], [controller_dict['drug_time']],
+                             sim_param_dict, done_break = done_break, batch_size = batch_size,
+                             n_workers = n_workers, max_step = max_step)
+        result = {m: grid[m].to_numpy() for m in eval_metrics}
+    
+    elif controller_dict['type_name'] == 'QLearning':
+        if qtable is None:
+            raise ValueError("The Q-table of the QLearning policy should be given")
+        
+        result = evaluate_pairs(qtable[np.newaxis], [env_param_dicts[j] for j in todo], [(0, k) for k in range(len(todo))],
+                                sim_param_dict, controller_dict['agent'], done_break = done_break,
+                                batch_size = batch_size, n_workers = n_workers, max_step = max_step)
+    
+    else:
+        raise ValueError("Ensemble evaluation is only applicable to Rational & QLearning controllers")
+
+    df = pd.DataFrame({'sample': np.arange(n), 'valid': valid})
+    for m in eval_metrics:
+        df[m] = np.nan
+        df.loc[todo, m] = result[m]
+
+    return df
+
+def ensemble_summary(df: pd.DataFrame, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)) -> pd.DataFrame:
+    '''
+    Summarizes the distributions of the measurements of an ensemble evaluation (see `ensemble_evaluate`) over the simulated samples
+    Returns:
+        summary: data frame with one row per measurement: the number of samples in which it is reached (event times may be missing),
+                 its mean, standard deviation & quantiles over these samples
+    '''
+    df = df[df['valid']]
+
+    rows = []
+    for m in eval_metrics:
+        x = df[m].dropna()
+        row = {'metric': m, 'n': len(x), 'fraction': len(x) / len(df) if len(df) > 0 else np.nan, 
+               'mean': x.mean(), 'sd': x.std()}
+        row.update({f'q{round(q * 100)}': x.quantile(q) for q in quantiles})
+        rows.append(row)
+
+    return pd.DataFrame(rows)
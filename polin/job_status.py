@@ -0,0 +1,211 @@
+from typing import List, Dict, Tuple
+import numpy as np
+import pandas as pd
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+# states of a job, in order
+job_states = ["queued", "running", "done", "failed"]
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    exp_ID TEXT PRIMARY KEY,
+    state TEXT,
+    job_ID TEXT,
+    host TEXT,
+    n_episodes INTEGER,
+    episodes_done INTEGER,
+    episodes_per_s REAL,
+    queued REAL,
+    started REAL,
+    finished REAL,
+    updated REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_state ON jobs (state);
+CREATE TABLE IF NOT EXISTS run_options (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+def current_job_ID() -> str:
+    '''
+    Returns the SLURM job ID of the running process, or its process ID if it is not run by SLURM
+    '''
+    return os.environ.get('SLURM_JOB_ID', 'local:' + str(os.getpid()))
+
+class JobStatusStore():
+    '''
+    Status of the jobs (experiments) of a collection, in a single SQLite file in the collection directory.
+    The collection runner queues the jobs, & every worker updates the state, timings & training progress of its job.
+    Works the same for jobs run locally & under SLURM, with the file on a shared file system: it uses the rollback journal
+    (not WAL, which needs memory shared by all the processes, so a single host), & workers wait for each other's locks.
+    Initialized with:
+        db_file (str): path to the store file, created if it does not exist
+        timeout (float): time (in s) to wait for the lock held by another worker
+    '''
+    def __init__(self, db_file: str, timeout=600.0):
+
+        self.db_file = db_file
+        self.timeout = timeout
+
+        self.conn = sqlite3.connect(db_file, timeout=timeout)
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.conn.executescript(_schema)
+        self.conn.commit()
+
+        self._heartbeat = None
+
+    def close(self) -> None:
+        self.stop_heartbeat()
+        self.conn.close()
+
+    def set_run_options(self, options: Dict) -> None:
+        '''
+        Records the options the collection is run with (JSON serializable), so that re-queued jobs are run the same
+        '''
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO run_options VALUES (?, ?)",
+                                  [(name, json.dumps(value)) for name, value in options.items()])
+
+    def run_options(self) -> Dict:
+        '''
+        Returns the options the collection was run with (see `set_run_options`)
+        '''
+        return {name: json.loads(value) for name, value in self.conn.execute("SELECT name, value FROM run_options")}
+
+    def queue(self, exp_ID: str, n_episodes=0) -> None:
+        '''
+        Marks a job as queued (submitted), resetting its progress
+        '''
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO jobs VALUES (?, 'queued', NULL, NULL, ?, 0, NULL, ?, NULL, NULL, ?, NULL)",
+                              (exp_ID, int(n_episodes), time.time(), time.time()))
+
+    def start(self, exp_ID: str, n_episodes=0) -> None:
+        '''
+        Marks a job as running, by the current process
+        '''
+        now = time.time()
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO jobs (exp_ID, queued) VALUES (?, ?)", (exp_ID, now))
+            self.conn.execute("UPDATE jobs SET state = 'running', job_ID = ?, host = ?, n_episodes = ?, episodes_done = 0, "
+                              "episodes_per_s = NULL, started = ?, finished = NULL, updated = ?, error = NULL WHERE exp_ID = ?",
+                              (current_job_ID(), socket.gethostname(), int(n_episodes), now, now, exp_ID))
+
+        self._last_update = (now, 0)
+
+    def heartbeat(self, exp_ID: str) -> None:
+        '''
+        Marks a running job as alive, whether it is training or not
+        '''
+        with self.conn:
+            self.conn.execute("UPDATE jobs SET updated = ? WHERE exp_ID = ? AND state = 'running'", (time.time(), exp_ID))
+
+    def start_heartbeat(self, exp_ID: str, interval=60.0) -> None:
+        '''
+        Updates the heartbeat of a running job every `interval` seconds from a background thread (with its own connection),
+        until the job finishes or fails, so that jobs that are still running are not taken as stale
+        '''
+        self.stop_heartbeat()
+        stop = threading.Event()
+
+        def beat():
+            store = JobStatusStore(self.db_file, timeout = self.timeout)
+            try:
+                while not stop.wait(interval):
+                    store.heartbeat(exp_ID)
+            finally:
+                store.conn.close()
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        self._heartbeat = (thread, stop)
+
+    def stop_heartbeat(self) -> None:
+        if self._heartbeat is not None:
+            thread, stop = self._heartbeat
+            stop.set()
+            thread.join()
+            self._heartbeat = None
+
+    def progress(self, exp_ID: str, episodes_done: int, min_interval=5.0) -> None:
+        '''
+        Updates the number of training episodes completed by a running job & its current speed (episodes/s),
+        at most once every `min_interval` seconds
+        '''
+        now = time.time()
+        t_last, ep_last = getattr(self, '_last_update', (now, 0))
+        if now - t_last < min_interval:
+            return
+
+        with self.conn:
+            self.conn.execute("UPDATE jobs SET episodes_done = ?, episodes_per_s = ?, updated = ? WHERE exp_ID = ?",
+                              (int(episodes_done), (episodes_done - ep_last) / (now - t_last), now, exp_ID))
+
+        self._last_update = (now, episodes_done)
+
+    def finish(self, exp_ID: str) -> None:
+        self.stop_heartbeat()
+        now = time.time()
+        with self.conn:
+            self.conn.execute("UPDATE jobs SET state = 'done', episodes_done = n_episodes, finished = ?, updated = ? WHERE exp_ID = ?",
+                              (now, now, exp_ID))
+
+    def fail(self, exp_ID: str, error: str) -> None:
+        self.stop_heartbeat()
+        now = time.time()
+        with self.conn:
+            self.conn.execute("UPDATE jobs SET state = 'failed', finished = ?, updated = ?, error = ? WHERE exp_ID = ?",
+                              (now, now, error, exp_ID))
+
+    def jobs(self, state=None) -> pd.DataFrame:
+        '''
+        Returns the status of all jobs, or of the jobs in `state`, with their elapsed time (in s)
+        '''
+        if state is None:
+            df = pd.read_sql_query("SELECT * FROM jobs ORDER BY exp_ID", self.conn)
+        else:
+            df = pd.read_sql_query("SELECT * FROM jobs WHERE state = ? ORDER BY exp_ID", self.conn, params=[state])
+
+        now = time.time()
+        df['elapsed'] = np.where(df['finished'].notna(), df['finished'], now) - df['started']
+
+        return df
+
+    def summary(self) -> Dict:
+        '''
+        Summarizes the progress of the collection
+        Returns:
+            summary (dict): number of jobs per state, throughput (episodes/s of the running jobs,
+                            or finished jobs per hour if there is no training), estimated time to completion (in s)
+        '''
+        df = self.jobs()
+        counts = {s: int((df['state'] == s).sum()) for s in job_states}
+
+        running = df[df['state'] == 'running']
+        remaining = df[df['state'].isin(['queued', 'running'])]
+        done = df[df['state'] == 'done']
+
+        remaining_episodes = (remaining['n_episodes'].fillna(0) - remaining['episodes_done'].fillna(0)).sum()
+        episodes_per_s = running['episodes_per_s'].fillna(0.0).sum()
+
+        if remaining_episodes > 0 and episodes_per_s > 0.0:
+            eta = remaining_episodes / episodes_per_s
+        elif len(done) > 0 and len(running) > 0:
+            # no training progress: from the mean duration of the finished jobs
+            eta = len(remaining) * done['elapsed'].mean() / len(running)
+        else:
+            eta = np.nan
+
+        span = done['finished'].max() - done['started'].min() if len(done) > 0 else 0.0
+        jobs_per_hour = len(done) / span * 3600.0 if span > 0.0 else np.nan
+
+        return {'counts': counts, 'episodes_per_s': episodes_per_s, 'jobs_per_hour': jobs_per_hour,
+                'remaining_episodes': int(remaining_episodes), 'eta': eta}
@@ -0,0 +1,307 @@
+import polin.reward_func as rf
+
+from typing import List, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.integrate import solve_ivp
+
+import os
+
+# data files of (de Vos et al., 2017), in the repository
+default_data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "params_deVos2017")
+
+def strain_table(data_dir=default_data_dir) -> pd.DataFrame:
+    '''
+    Returns the table of the strains in the interaction matrices of (de Vos et al., 2017), `UTI_bacteria.selected.tsv`,
+    whose column `strain_index` is the index of each strain in the matrices
+    '''
+    return pd.read_csv(os.path.join(data_dir, "UTI_bacteria.selected.tsv"), sep='\t')
+
+def load_deVos2017(data_dir: str, strain_index: List[int], interaction_matrix="MaxOD_3", interaction_scale=1.0) -> Tuple:
+    '''
+    Loads the growth parameters of a subset of strains from the matrices of (de Vos et al., 2017).
+    The matrices are memory-mapped, so only the rows & columns of the selected strains are read.
+    Growth rates & carrying capacities are the ones in isolation (`mean_GR_spentHRs.selected.npy`, `mean_maxOD_spentHRs.selected.npy`).
+    An interaction matrix gives the ratio m of growth (rate or max OD) of an acceptor strain i in the spent medium of
+    a donor strain j over its growth in fresh medium. It is converted to the generalized Lotka-Volterra coefficient
+        A[i, j] = interaction_scale * r[i] * (m - 1) / c[j],
+    such that the donor at its carrying capacity changes the growth of the acceptor by the ratio m.
+    Missing measurements (m == 0) and self-interactions are set to no interaction.
+    With many species, the full-strength interactions can make the community unbounded, hence `interaction_scale`.
+    Parameters:
+        data_dir (str): directory of the data files, `params_deVos2017`
+        strain_index (list of int): indices of the strains in the matrices, see `strain_table`
+        interaction_matrix (str): "MaxOD_3" or "GR_3"
+        interaction_scale (float): scaling factor of the interaction coefficients
+    Returns: (wrapped in a tuple)
+        r (numpy array): growth rates
+        c (numpy array): carrying capacities
+        A (numpy array): interaction coefficients, A[i, j] is the effect of strain j on strain i
+    '''
+    if interaction_matrix not in ["MaxOD_3", "GR_3"]:
+        raise ValueError("Parameter `interaction_matrix` can only be either \"MaxOD_3\" or \"GR_3\".")
+
+    idx = np.asarray(strain_index, dtype=int)
+
+    r = np.array(np.load(os.path.join(data_dir, "mean_GR_spentHRs.selected.npy"), mmap_mode='r')[0, idx])
+    c = np.array(np.load(os.path.join(data_dir, "mean_maxOD_spentHRs.selected.npy"), mmap_mode='r')[0, idx])
+
+    # rows: donor, columns: acceptor
+    m = np.array(np.load(os.path.join(data_dir, interaction_matrix + ".npy"), mmap_mode='r')[np.ix_(idx, idx)]).T
+
+    A = np.where(m == 0.0, 0.0, interaction_scale * r[:, np.newaxis] * (m - 1.0) / c[np.newaxis, :])
+    np.fill_diagonal(A, 0.0)
+
+    return r, c, A
+
+class MultiSpeciesEnv():
+    '''
+    Microbial growth environment of N species under drug treatment control policy,
+    with generalized Lotka-Volterra dynamics:
+        dN_i/dt = N_i * (r_i - r_i/c_i * N_i + sum_j A_ij N_j - delta_i(D))
+    The focal species (the one to be cleared, as species E of `BacterialEnv`) is the first one,
+    so the rewards & events are the same as in `BacterialEnv`.
+    Initialized with:
+        param_dict (dictionary): parameters for the ODE model & initial conditions, with either
+                                 "strain_index" (and optionally "data_dir", "interaction_matrix", "interaction_scale")
+                                 to load the growth parameters from the matrices of (de Vos et al., 2017), see `load_deVos2017`,
+                                 or the arrays "r", "c" & "A".
+                                 "mic" & "dmax" are either one value for all species or one per species
+        step_time (float): time for integration whenever the `step` method is called
+        reward_func (str): name of the reward function
+        reward_kwargs (dict): parameters for reward caculations
+        state_method (str): name of the method to return state, "cont_E" (density of the focal species),
+                            "disc_E" (discretized density of the focal species) or "cont_ND" (all densities & drug)
+        n_states (int or None): number of discrete states, should be int when `state_method` is "disc_E"
+    '''
+    def __init__(self, param_dict: Dict, step_time: 60.0*6.0,
+                 reward_func: "minED", reward_kwargs: {},
+                 state_method="cont_E", n_states=None):
+
+        self.set_params(param_dict)
+
+        self.initial_S = np.append(self.init_N, self.init_D) # init conditions of S = [N_1, ..., N_n, D]
+        self.sSol = np.array(self.initial_S).reshape(1, len(self.initial_S)) # solution of S
+        self.tSol = np.array([0.0]) # solution of time t
+
+        self.actions = np.empty((0, 2), float) # matrix of actions with corresponding timepoints
+        self.total_drug_in = 0.0 # cumulative drug "absorbed" / "flowed" in
+
+        self.five_percent = 0.05 * self.init_N[0] # 5% of init density of the focal species
+        self.t5p = np.array([]) # timepoints t at which the focal density = 5% of its initial condition
+        self.tTiny = np.array([]) # timepoints t at which the focal density = tiny number
+
+        self.step_time = step_time
+
+        if reward_func == 'minED':
+            self.get_reward = rf.minED
+        else:
+            raise ValueError('Supplied reward function name is not (yet) defined')
+        self.reward_kwargs = reward_kwargs
+
+        self.defined_state_methods = ["cont_E", "disc_E", "cont_ND"]
+        self.reset_state_method(state_method, n_states)
+
+        # ODE solver settings
+        self.method = "LSODA"
+        self.max_step = 0.01
+
+    def set_params(self, param_dict: Dict) -> None:
+        '''
+        Sets environment parameters to those stored in a python dictionary
+        '''
+        ode_params = param_dict['ode_params']
+
+        if 'strain_index' in ode_params:
+            self.strain_index = list(ode_params['strain_index'])
+            self.r, self.c, self.A = load_deVos2017(ode_params.get('data_dir', default_data_dir), self.strain_index,
+                                                    interaction_matrix = ode_params.get('interaction_matrix', 'MaxOD_3'),
+                                                    interaction_scale = ode_params.get('interaction_scale', 1.0))
+        else:
+            self.strain_index = None
+            self.r = np.array(ode_params['r'], dtype=float)
+            self.c = np.array(ode_params['c'], dtype=float)
+            self.A = np.array(ode_params['A'], dtype=float)
+
+        self.n_species = len(self.r)
+        if self.A.shape != (self.n_species, self.n_species) or len(self.c) != self.n_species:
+            raise ValueError("Growth rates, carrying capacities & interaction matrix should be of the same number of species")
+
+        self.kd = ode_params['kd']
+        self.ka = ode_params['ka']
+
+        self.mic = np.broadcast_to(np.array(ode_params['mic'], dtype=float), (self.n_species,)).copy()
+        self.dmax = np.broadcast_to(np.array(ode_params['dmax'], dtype=float), (self.n_species,)).copy()
+        self.gamma = ode_params['gamma']
+
+        self.mic_g = self.mic**self.gamma
+        self.r_c = self.r / self.c
+
+        self.init_N = np.broadcast_to(np.array(param_dict['initial_conditions']['N'], dtype=float), (self.n_species,)).copy()
+        self.init_D = param_dict['initial_conditions']['D']
+
+    def reset_state_method(self, state_method: str, n_states: int) -> None:
+        if state_method not in self.defined_state_methods:
+            raise ValueError(f"Method to derive observable state is not in the list of defined methods: {self.defined_state_methods}")
+
+        self.state_method = state_method
+        self.n_states = n_states
+        self.growth_bounds = [0.0, 0.5] # bounds of bacterial growth density
+        self.OD2state = None
+
+        self.state = self.get_state()
+
+    def ODEsys(self, t, S, Din: float) -> np.ndarray:
+        '''
+        Returns derivatives for the numerical solver
+        Parameters:
+            S: current environment state [N_1, ..., N_n, D]
+            t: current time
+            Din: drug concentration that goes in at some constant rate `ka`
+        '''
+        N = S[:-1]
+        D = S[-1]
+
+        Dg = D**self.gamma
+        delta = self.dmax * Dg / (self.mic_g + Dg)
+
+        rhs = np.empty(self.n_species + 1)
+        rhs[:-1] = N * (self.r - self.r_c * N + self.A @ N - delta)
+        rhs[-1] = self.ka * Din - self.kd * D
+
+        return rhs
+
+    def jacobian(self, t, S, Din: float) -> np.ndarray:
+        '''
+        Returns the analytic Jacobian of `ODEsys` for the (stiff) solver
+        '''
+        N = S[:-1]
+        D = S[-1]
+
+        Dg = D**self.gamma
+        delta = self.dmax * Dg / (self.mic_g + Dg)
+        ddelta_dD = self.dmax * self.gamma * D**(self.gamma - 1.0) * self.mic_g / (self.mic_g + Dg)**2 if D > 0.0 else np.zeros(self.n_species)
+
+        J = np.zeros((self.n_species + 1, self.n_species + 1))
+        J[:-1, :-1] = N[:, np.newaxis] * self.A
+        J[:-1, :-1][np.diag_indices(self.n_species)] += self.r - 2.0 * self.r_c * N + self.A @ N - delta
+        J[:-1, -1] = -N * ddelta_dD
+        J[-1, -1] = -self.kd
+
+        return J
+
+    def event5p(self, t, S, *args) -> float:
+        '''
+        Event for ODE solver: time at which the focal density == 5% of its initial condition
+        '''
+        return S[0] - self.five_percent
+
+    def eventTiny(self, t, S, *args) -> float:
+        '''
+        Event for ODE solver: time at which the focal density == tiny 10**(-4)
+        '''
+        return S[0] - 10**(-4)
+
+    def integrate(self, duration: float, Din: float) -> None:
+        '''
+        Integrates the system from the current state for a time period under a constant "flow in" drug concentration,
+        & appends the solution & events
+        '''
+        t_start = self.tSol[-1]
+
+        sol = solve_ivp(self.ODEsys, [t_start, t_start + duration], self.sSol[-1, :], args=(Din,),
+                        events = [self.event5p, self.eventTiny], max_step=self.max_step,
+                        jac = self.jacobian, method = self.method)
+
+        solN = sol.y[:-1, :]
+        soly = np.append(np.where(np.round(solN, 5) == 0, 0.0, solN), sol.y[[-1], :], axis=0)
+
+        self.sSol = np.append(self.sSol, soly.T[1:, :], axis=0)
+        self.tSol = np.append(self.tSol, sol.t[1:])
+        self.t5p = np.append(self.t5p, sol.t_events[0])
+        self.tTiny = np.append(self.tTiny, sol.t_events[1])
+
+    def step(self, action: Tuple) -> Tuple:
+        '''
+        Solves the ODEs system for a time period defined by `step_time` param, under the action taken by a controller,
+        as `BacterialEnv.step`
+        '''
+        Din, drug_time = action
+        if drug_time > self.step_time:
+            raise ValueError("Time duration for drug in cannot be longer than step time")
+
+        self.actions = np.append(self.actions, np.array([[self.tSol[-1], Din]]), axis=0)
+        self.total_drug_in += Din * drug_time * self.ka
+
+        self.integrate(drug_time, Din)
+
+        if (self.step_time - drug_time) > 0.0:
+            self.integrate(self.step_time - drug_time, 0.0)
+
+        self.state = self.get_state()
+
+        reward, done = self.get_reward(action, self.sSol, self.tSol, **self.reward_kwargs)
+
+        return self.state, reward, done
+
+    def get_state(self):
+        '''
+        Returns the "current" state of the system/env for the controller to make decisions:
+            state: float if `state_method` is "cont_E", int if "disc_E", numpy array [N_1, ..., N_n, D] if "cont_ND"
+        '''
+        if self.state_method == "cont_E":
+            return self.sSol[-1, 0]
+
+        if self.state_method == "cont_ND":
+            return self.sSol[-1, :].copy()
+
+        if not isinstance(self.n_states, int):
+            raise ValueError("n_states should be an integer for \"disc_E\" method")
+
+        E = self.sSol[-1, 0]
+        self.OD2state = (self.growth_bounds[1] - self.growth_bounds[0]) / int(self.n_states - 2)
+
+        return int(E // self.OD2state + 1) if E > 0.0 else 0
+
+    def coexist_equilibrium(self) -> np.ndarray:
+        '''
+        Computes the equilibrium of coexistence of all species, solution of (A - diag(r/c)) N = -r
+        Returns:
+            N: densities of the species at the equilibrium (should all be > 0.0)
+        '''
+        N = np.linalg.solve(self.A - np.diag(self.r_c), -self.r)
+
+        if np.any(N <= 0.0):
+            raise RuntimeError("Coexist equilibrium does not exist.")
+
+        return N
+
+    def reset_2_equilibria(self, eq_type="coexist") -> None:
+        '''
+        Resets the system. The initial densities are set to either:
+        - the equilibrium of co-existence of all species, if parameter `eq_type` is "coexist"; or
+        - the equilibria in their mono-culture (carrying capacities), if parameter `eq_type` is "mono"
+        '''
+        if eq_type == "coexist":
+            eqN = self.coexist_equilibrium()
+        elif eq_type == "mono":
+            eqN = self.c.copy()
+        else:
+            raise ValueError("Parameter `eq_type` can only be either \"coexist\" or \"mono\".")
+
+        self.init_N = eqN
+        self.initial_S = np.append(eqN, self.init_D)
+
+        self.sSol = np.array(self.initial_S).reshape(1, len(self.initial_S))
+        self.tSol = np.array([0.0])
+
+        self.actions = np.empty((0, 2), float)
+        self.total_drug_in = 0.0
+
+        self.five_percent = 0.05 * eqN[0]
+
+        self.t5p = np.array([])
+        self.tTiny = np.array([])
+
+        self.state = self.get_state()
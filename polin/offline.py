@@ -0,0 +1,163 @@
+from typing import List, Dict, Tuple
+import numpy as np
+
+import json
+import os
+
+# record of one transition. The reward is not stored, but the quantities it is computed from (see `rewards`),
+# so that datasets can be re-used with other reward weights.
+transition_dtype = np.dtype([('episode', np.int32),
+                             ('state', np.int32),
+                             ('action', np.int16),
+                             ('next_state', np.int32),
+                             ('E_ratio', np.float64), # density E after the step / initial density E
+                             ('Din', np.float32),     # chosen "flow in" drug concentration
+                             ('duration', np.float32)]) # duration of the step in `env_step_time` units, the exponent of the
+                                                        # discount (semi-MDP): 1.0 unless decisions are event-triggered
+
+def dataset_dtype(header: Dict) -> np.dtype:
+    '''
+    Returns the record type of a dataset, from its header (datasets recorded before `duration` was added lack it)
+    '''
+    return np.dtype([tuple(field) for field in header['dtype']])
+
+class TransitionRecorder():
+    '''
+    Records transitions (state, action, next state & the quantities to compute reward/done from) to a binary file.
+    Transitions are buffered and appended to the file chunk by chunk, with a small JSON header describing the dataset.
+    Initialized with:
+        filename (str): name of the dataset files (without extension), `<filename>.bin` & `<filename>.json`
+        n_states (int): number of discrete states
+        n_actions (int): number of actions
+        Din_options (tuple): "flow in" drug concentrations of the actions
+        chunk_size (int): number of transitions buffered before writing to file
+        append (bool): whether to append to an existing dataset, or else start a new one
+    '''
+    def __init__(self, filename: str, n_states: int, n_actions: int, Din_options: Tuple,
+                 chunk_size=2**14, append=False):
+
+        self.filename = filename
+        self.data_file = filename + ".bin"
+
+        header = {'dtype': transition_dtype.descr, 'n_states': n_states, 'n_actions': n_actions,
+                  'Din_options': list(Din_options)}
+
+        if append and os.path.exists(self.data_file):
+            if load_header(filename)['n_states'] != n_states:
+                raise ValueError("Cannot append transitions with a different number of states to the dataset")
+            if dataset_dtype(load_header(filename)) != transition_dtype:
+                raise ValueError("Cannot append transitions to a dataset recorded in an older format")
+        else:
+            open(self.data_file, 'wb').close()
+
+        with open(filename + ".json", 'w') as f:
+            json.dump(header, f, indent=4)
+
+        self.buffer = np.empty(chunk_size, dtype=transition_dtype)
+        self.n_buffered = 0
+        self.episode = 0
+
+    def record(self, state: int, action: int, next_state: int, E_ratio: float, Din: float, duration=1.0) -> None:
+        self.buffer[self.n_buffered] = (self.episode, state, action, next_state, E_ratio, Din, duration)
+        self.n_buffered += 1
+
+        if self.n_buffered == len(self.buffer):
+            self.flush()
+
+    def flush(self) -> None:
+        with open(self.data_file, 'ab') as f:
+            self.buffer[:self.n_buffered].tofile(f)
+        self.n_buffered = 0
+
+def load_header(filename: str) -> Dict:
+    with open(filename + ".json") as f:
+        return json.load(f)
+
+def load_transitions(filenames: List[str]) -> Tuple:
+    '''
+    Reads (memory-maps) one or more transition datasets with the same discretization, e.g. from several experiments & seeds.
+    Datasets recorded without the duration of the steps are read into memory, with a duration of 1.0
+    Parameters:
+        filenames (list of str): names of the dataset files (without extension)
+    Returns:
+        data (numpy structured array): all transitions
+        header (dict): the dataset header (number of states & actions, Din options)
+    '''
+    header = load_header(filenames[0])
+    datasets = []
+    for fn in filenames:
+        h = load_header(fn)
+        if h['n_states'] != header['n_states'] or h['n_actions'] != header['n_actions']:
+            raise ValueError(f"Dataset {fn} has a different discretization from {filenames[0]}")
+        if os.path.getsize(fn + ".bin") > 0:
+            dtype = dataset_dtype(h)
+            data = np.memmap(fn + ".bin", dtype=dtype, mode='r')
+            if dtype != transition_dtype:
+                converted = np.ones(len(data), dtype=transition_dtype)
+                for name in dtype.names:
+                    converted[name] = data[name]
+                data = converted
+            datasets.append(data)
+
+    data = np.concatenate(datasets) if len(datasets) > 1 else (datasets[0] if datasets else np.empty(0, transition_dtype))
+
+    return data, header
+
+def rewards(data: np.ndarray, **kwargs) -> Tuple:
+    '''
+    Computes the rewards & done flags of recorded transitions, as reward function "minED" does
+    '''
+    w_E = kwargs["w_E"]
+    Din_max = kwargs["Din_max"]
+    w_D = kwargs["w_D"]
+
+    E_ratio = data['E_ratio']
+    reward = w_E * (1.0 - E_ratio) - w_D * data['Din'].astype(float) / Din_max
+    done = E_ratio == 1.0
+
+    return reward, done
+
+def fitted_q_iteration(data: np.ndarray, n_states: int, n_actions: int,
+                       gamma: float, reward_kwargs: Dict,
+                       n_iter=1000, tol=1e-8, init_qtable=None) -> Tuple:
+    '''
+    Computes a Q-table from recorded transitions by fitted Q-iteration, without simulating the env.
+    Each sweep sets Q(s, a) to the average over the transitions from (s, a) of reward + gamma^duration * max_a' Q(s', a'),
+    for all (s, a) at once (the duration of the step is 1 unless decisions are event-triggered, as in `TrainTest.simulate`). Pairs (s, a) without transitions keep their initial values.
+    Parameters:
+        data (numpy structured array): transitions, as returned by `load_transitions`
+        n_states (int), n_actions (int): size of the Q-table
+        gamma (float): discount rate
+        reward_kwargs (dict): parameters for reward caculations (reward function "minED")
+        n_iter (int): maximum number of sweeps
+        tol (float): stops when the largest change of the Q-table in a sweep is below `tol`
+        init_qtable (numpy array or None): initial Q-table, zeros if None
+    Returns:
+        qtable (numpy array): the computed Q-table
+        n_sweeps (int): number of sweeps done
+    '''
+    reward, done = rewards(data, **reward_kwargs)
+    not_done = 1.0 - done
+    discount = gamma ** data['duration'].astype(float)
+
+    sa = data['state'].astype(np.int64) * n_actions + data['action']
+    next_state = data['next_state']
+
+    counts = np.bincount(sa, minlength=n_states * n_actions)
+    visited = counts > 0
+
+    Q = np.zeros(n_states * n_actions) if init_qtable is None else np.array(init_qtable, dtype=float).ravel()
+
+    for sweep in range(1, n_iter + 1):
+        Qmax = Q.reshape(n_states, n_actions).max(axis=1)
+        target = reward + discount * not_done * Qmax[next_state]
+
+        Q_new = Q.copy()
+        Q_new[visited] = np.bincount(sa, weights=target, minlength=n_states * n_actions)[visited] / counts[visited]
+
+        change = np.max(np.abs(Q_new - Q))
+        Q = Q_new
+        if change < tol:
+            break
+
+    return Q.reshape(n_states, n_actions), sweep
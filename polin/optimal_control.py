@@ -0,0 +1,150 @@
+from polin.bacterial_env import BacterialEnv
+
+from typing import List, Dict, Tuple
+import numpy as np
+from scipy.integrate import solve_ivp
+from scipy.optimize import minimize
+
+import math
+
+# densities below this are rounded to 0.0 by the env (see `BacterialEnv.integrate`), i.e. the species is extinct
+extinct_density = 5e-6
+
+def extinct_E(t, y, *args) -> float:
+    return y[0] - extinct_density
+extinct_E.terminal = True
+extinct_E.direction = -1
+
+def extinct_Z(t, y, *args) -> float:
+    return y[1] - extinct_density
+extinct_Z.terminal = True
+extinct_Z.direction = -1
+
+def sensitivity_sys(t, y, env: BacterialEnv, Din: float, k: int, n_steps: int) -> np.ndarray:
+    '''
+    Returns derivatives of the ODE model of `env` augmented with its forward sensitivities
+    to the "flow in" drug concentrations of all steps of a schedule
+    Parameters:
+        y: [E, Z, D, followed by the sensitivity matrix dS/dDin (3 x n_steps) flattened row by row]
+        env (BacterialEnv): env whose parameters are used
+        Din (float): "flow in" drug concentration during the integrated period
+        k (int or None): step whose Din flows in during the integrated period, None if no drug flows in
+        n_steps (int): number of steps of the schedule
+    '''
+    E, Z, D = y[:3]
+    dS = y[3:].reshape(3, n_steps)
+
+    Dg = D**env.gamma
+    deltaE = env.dmaxE * Dg / (env.micE**env.gamma + Dg)
+    deltaZ = env.dmaxZ * Dg / (env.micZ**env.gamma + Dg)
+
+    # derivatives of the killing rates with respect to D
+    if D > 0.0:
+        ddeltaE = env.dmaxE * env.gamma * D**(env.gamma - 1.0) * env.micE**env.gamma / (env.micE**env.gamma + Dg)**2
+        ddeltaZ = env.dmaxZ * env.gamma * D**(env.gamma - 1.0) * env.micZ**env.gamma / (env.micZ**env.gamma + Dg)**2
+    else:
+        ddeltaE, ddeltaZ = 0.0, 0.0
+
+    J = np.array([[env.rE - 2.0 * env.rE/env.cE * E + env.alpha_EZ * Z - deltaE, env.alpha_EZ * E, -E * ddeltaE],
+                  [env.alpha_ZE * Z, env.rZ - 2.0 * env.rZ/env.cZ * Z + env.alpha_ZE * E - deltaZ, -Z * ddeltaZ],
+                  [0.0, 0.0, -env.kd]])
+
+    d_dS = J @ dS
+    if k is not None:
+        d_dS[2, k] += env.ka
+
+    return np.concatenate([env.ODEsys(t, y[:3], Din), d_dS.ravel()])
+
+def simulate_schedule(env: BacterialEnv, schedule: np.ndarray, drug_time: float,
+                      rtol=1e-8, atol=1e-12) -> Tuple:
+    '''
+    Simulates a piecewise-constant schedule of "flow in" drug concentrations (one per step, in for `drug_time` at the
+    start of each step) from the current state of `env`, & computes its return as the sum of the rewards of "minED"
+    with the gradient of the return with respect to the schedule, by forward sensitivities.
+    As in the env, a species whose density falls below `extinct_density` is extinct (its density & sensitivities are 0.0).
+    Parameters:
+        env (BacterialEnv): env whose parameters, current state & step time are used (it is not stepped)
+        schedule (numpy array): "flow in" drug concentration of every step
+        drug_time (float): time for "flow in" of drug in every step
+        rtol, atol (float): tolerances of the solver
+    Returns:
+        e_return (float): return of the schedule
+        grad (numpy array): gradient of the return with respect to the schedule
+        E (numpy array): density E at the end of every step
+    '''
+    schedule = np.asarray(schedule, dtype=float)
+    n_steps = len(schedule)
+
+    w_E = env.reward_kwargs["w_E"]
+    Din_max = env.reward_kwargs["Din_max"]
+    w_D = env.reward_kwargs["w_D"]
+    init_E = env.sSol[0, 0]
+
+    y = np.concatenate([env.sSol[-1, :], np.zeros(3 * n_steps)])
+    t = env.tSol[-1]
+
+    E = np.empty(n_steps)
+    dE = np.empty((n_steps, n_steps)) # dE[k, j]: sensitivity of E at the end of step k to Din of step j
+
+    for k in range(n_steps):
+        for Din, active, duration in [(schedule[k], k, drug_time), (0.0, None, env.step_time - drug_time)]:
+            if duration <= 0.0:
+                continue
+            t_end = t + duration
+            while t < t_end:
+                sol = solve_ivp(sensitivity_sys, [t, t_end], y, args=(env, Din, active, n_steps),
+                                events = [extinct_E, extinct_Z], method = "LSODA", rtol = rtol, atol = atol)
+                y = sol.y[:, -1].copy()
+                t = sol.t[-1]
+
+                # a species got extinct: continue without it
+                for i in range(2):
+                    if len(sol.t_events[i]) > 0:
+                        y[i] = 0.0
+                        y[3 + i * n_steps:3 + (i + 1) * n_steps] = 0.0
+
+        E[k] = y[0]
+        dE[k, :] = y[3:3 + n_steps]
+
+    e_return = np.sum(w_E * (1.0 - E / init_E) - w_D * schedule / Din_max)
+    grad = -w_E / init_E * dE.sum(axis=0) - w_D / Din_max
+
+    return e_return, grad, E
+
+def optimize_schedule(env: BacterialEnv, sim_time: float, drug_time: float,
+                      init_schedule=None, maxiter=200, rtol=1e-8, atol=1e-12) -> Tuple:
+    '''
+    Finds the schedule of "flow in" drug concentrations (one per step) that maximizes the return of "minED"
+    over a simulation from the current state of `env`, by a quasi-Newton method (L-BFGS-B) under bounds [0, Din_max]
+    Parameters:
+        env (BacterialEnv): env whose parameters, current state & step time are used (it is not stepped)
+        sim_time (float): simulation time, the number of steps of the schedule is the number of steps of `env` in it
+        drug_time (float): time for "flow in" of drug in every step
+        init_schedule (numpy array or None): starting schedule. If None, the best of the schedules giving Din_max 
+                                             during the first k steps & no drug afterwards (k = 1, ..., n_steps), 
+                                             as the extinction of E is beyond the reach of local gradients
+        maxiter (int): maximum number of iterations of the optimizer
+    Returns:
+        schedule (numpy array): the optimized schedule
+        e_return (float): its return
+        n_iter (int): number of iterations done
+    '''
+    if drug_time > env.step_time:
+        raise ValueError("Time duration for drug in cannot be longer than step time")
+
+    n_steps = int(math.ceil(round(sim_time / env.step_time, 9)))
+    Din_max = env.reward_kwargs["Din_max"]
+
+    if init_schedule is None:
+        candidates = [np.where(np.arange(n_steps) < k, Din_max, 0.0) for k in range(1, n_steps + 1)]
+        returns = [simulate_schedule(env, x, drug_time, rtol = rtol, atol = atol)[0] for x in candidates]
+        init_schedule = candidates[int(np.argmax(returns))]
+
+    def objective(x):
+        e_return, grad, _ = simulate_schedule(env, x, drug_time, rtol = rtol, atol = atol)
+        return -e_return, -grad
+
+    res = minimize(objective, np.asarray(init_schedule, dtype=float), jac=True, method="L-BFGS-B",
+                   bounds=[(0.0, Din_max)] * n_steps, options={"maxiter": maxiter})
+
+    return res.x, -res.fun, res.nit
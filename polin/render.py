@@ -0,0 +1,164 @@
+import matplotlib
+matplotlib.use('Agg') # rendering only writes files, no display is needed
+
+from polin.train_test import TrainTest
+import polin.sim_data as sim_data
+import polin.viz as viz
+
+from typing import List, Dict, Tuple
+import numpy as np
+
+import json
+import os
+from multiprocessing import Pool
+
+# Figure templates of the current process, keyed by figure kind.
+# Each figure is made once with `plt.subplots` and then cleared & re-drawn for every following experiment.
+_templates = {}
+
+def _init_worker() -> None:
+    matplotlib.use('Agg')
+
+def is_outdated(fig_file: str, input_files: List[str]) -> bool:
+    '''
+    Checks whether a figure has to be (re-)made, i.e. it does not exist or is older than any of its input files
+    '''
+    if not os.path.exists(fig_file):
+        return True
+
+    fig_mtime = os.path.getmtime(fig_file)
+
+    return any(os.path.getmtime(f) > fig_mtime for f in input_files)
+
+def save_template(kind: str, fig, fig_file: str) -> None:
+    '''
+    Saves a figure to file & keeps it as template for the next figure of the same kind
+    '''
+    fig.savefig(fig_file, bbox_inches='tight')
+    _templates[kind] = fig
+
+def render_experiment(exp_dir: str, savefig_format='png',
+                      qtable_episode='last', force=False) -> Dict:
+    '''
+    Re-makes the figures of an experiment from its stored results:
+    training performance & Q-learning policy (QLearning controller only), and testing simulation
+    Parameters:
+        exp_dir (str): experiment directory, containing the param file `params.<exp_ID>.json`
+        savefig_format (str): format of the figure files
+        qtable_episode (str or int): episode of the Q-table to visualize the policy of, 'last' by default
+        force (bool): whether to re-make figures that are up to date
+    Returns:
+        counts (dict): number of figures that are rendered, skipped (up to date) & missing (no stored results)
+    '''
+    exp_ID = os.path.basename(os.path.normpath(exp_dir))
+    exp_dir = os.path.normpath(exp_dir) + '/'
+
+    param_file = exp_dir + "params." + exp_ID + ".json"
+    with open(param_file) as f:
+        param_dict = json.load(f)
+
+    counts = {'rendered': 0, 'skipped': 0, 'missing': 0}
+
+    def needs_rendering(fig_file, input_files):
+        if not all(os.path.exists(f) for f in input_files):
+            counts['missing'] += 1
+            return False
+        if not force and not is_outdated(fig_file, input_files):
+            counts['skipped'] += 1
+            return False
+        counts['rendered'] += 1
+        return True
+
+    controller_dict = param_dict['controller']
+
+    if controller_dict['type_name'] == 'QLearning':
+
+        # Training performance
+        perf_filename = exp_dir + 'training_performance.tsv'
+        fig_file = exp_dir + "training_performance." + savefig_format
+        episode_time_max = controller_dict['training']['episode_time_max']
+
+        if needs_rendering(fig_file, [perf_filename]):
+            fig = viz.visualize_train(train_perf_file = perf_filename, episode_time_max = episode_time_max,
+                                      fig = _templates.get('train'))
+            save_template('train', fig, fig_file)
+
+        # Policy of the Q-learning agent
+        n_episodes = controller_dict['training']['n_episodes']
+        ep = n_episodes - 1 if qtable_episode == 'last' else int(qtable_episode)
+        qtable_file = exp_dir + 'learned_qtables/QLearningAgent_values.ep' + str(ep) + '.npy'
+        fig_file = exp_dir + "Qpolicy." + exp_ID + "." + savefig_format
+
+        if needs_rendering(fig_file, [qtable_file, param_file]):
+            tt = TrainTest(param_dict['env'], param_dict['simulation'], test_done_break = False)
+            tt.set_QLearning_agent(controller_dict['agent'])
+            tt.agent.set_values(np.load(qtable_file))
+
+            # only the initial state of the env is needed, no simulation
+            state_method = 'disc_E' if tt.agent.n_states_dimensions == 1 else 'disc_EZ'
+            tt.env.reset_state_method(state_method = state_method, n_states = tt.agent.n_states)
+            tt.env.reset_2_equilibria(eq_type = tt.reset_type)
+
+            kind = 'Qpolicy_' + str(tt.agent.n_states_dimensions) + 'D'
+            fig = tt.agent.visualize_policy(initE = tt.env.init_E, OD2state = tt.env.OD2state,
+                                            fig = _templates.get(kind))
+            save_template(kind, fig, fig_file)
+
+    # Testing simulation
+    output_filename = exp_dir + "testing." + exp_ID
+    fig_file = output_filename + "." + savefig_format
+
+    data_file = sim_data.find_env_data_file(output_filename)
+    if data_file is None:
+        counts['missing'] += 1
+    elif needs_rendering(fig_file, [data_file, param_file]):
+        sim = sim_data.load_env_data(output_filename, param_dict['env'])
+        fig = viz.visualize_simulation(env = sim, st='full', tscale=60.0, title='none',
+                                       fig = _templates.get('testing'))
+        save_template('testing', fig, fig_file)
+
+    return counts
+
+def _render_experiment_task(args: Tuple) -> Tuple:
+    exp_dir, savefig_format, qtable_episode, force = args
+    try:
+        counts = render_experiment(exp_dir, savefig_format, qtable_episode, force)
+        return exp_dir, counts, None
+    except Exception as err:
+        return exp_dir, None, repr(err)
+
+def render_collection(collection_dir: str, savefig_format='png',
+                      qtable_episode='last', force=False, n_workers=None) -> Dict:
+    '''
+    Re-makes the figures of all experiments in a collection, in a pool of processes
+    Parameters:
+        collection_dir (str): collection directory, containing the `metadata.tsv` file
+        savefig_format (str): format of the figure files
+        qtable_episode (str or int): episode of the Q-tables to visualize the policies of, 'last' by default
+        force (bool): whether to re-make figures that are up to date
+        n_workers (int or None): number of processes, the number of CPUs if None
+    Returns:
+        counts (dict): total number of figures that are rendered, skipped, missing, & of experiments that failed
+    '''
+    collection_dir = os.path.normpath(collection_dir) + '/'
+
+    with open(collection_dir + "metadata.tsv") as m:
+        exp_IDs = [line.split('\t')[0] for line in m.read().splitlines()[1:] if line.strip() != '']
+
+    tasks = [(collection_dir + exp_ID + '/', savefig_format, qtable_episode, force) for exp_ID in exp_IDs]
+
+    total = {'rendered': 0, 'skipped': 0, 'missing': 0, 'failed': 0}
+
+    with Pool(processes=n_workers, initializer=_init_worker) as pool:
+        # experiments are sent in chunks, so a worker re-uses its figure templates over consecutive experiments
+        chunksize = max(1, len(tasks) // (4 * (n_workers or os.cpu_count() or 1)))
+        for exp_dir, counts, err in pool.imap_unordered(_render_experiment_task, tasks, chunksize=chunksize):
+            if err is not None:
+                total['failed'] += 1
+                print(f"Failed rendering figures of {exp_dir}: {err}")
+                continue
+
+            for k in counts:
+                total[k] += counts[k]
+
+    return total
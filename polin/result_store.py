@@ -0,0 +1,289 @@
+import polin.sim_data as sim_data
+
+from typing import List, Dict, Tuple
+import numpy as np
+import pandas as pd
+
+import io
+import json
+import os
+import re
+import sqlite3
+
+# per-experiment measurements, also the columns that can be sliced on
+metric_columns = ["e_return", "t5p_first", "tTiny_first", "total_drug_in"]
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS experiments (
+    exp_ID TEXT PRIMARY KEY,
+    alpha_EZ REAL,
+    alpha_ZE REAL,
+    controller TEXT,
+    e_return REAL,
+    t5p_first REAL,
+    tTiny_first REAL,
+    total_drug_in REAL,
+    t5p TEXT,
+    tTiny TEXT,
+    params TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_alphas ON experiments (alpha_EZ, alpha_ZE);
+CREATE INDEX IF NOT EXISTS idx_alpha_ZE ON experiments (alpha_ZE);
+CREATE TABLE IF NOT EXISTS trajectories (
+    exp_ID TEXT PRIMARY KEY,
+    data BLOB
+);
+CREATE TABLE IF NOT EXISTS qtables (
+    exp_ID TEXT PRIMARY KEY,
+    episode INTEGER,
+    data BLOB
+);
+CREATE TABLE IF NOT EXISTS training (
+    exp_ID TEXT,
+    episode INTEGER,
+    explore_rate REAL,
+    e_return REAL,
+    t5p_first REAL,
+    tTiny_first REAL,
+    total_drug_in REAL,
+    PRIMARY KEY (exp_ID, episode)
+);
+'''
+
+def array_to_blob(arr: np.ndarray) -> bytes:
+    buf = io.BytesIO()
+    np.save(buf, arr)
+    return buf.getvalue()
+
+def blob_to_array(blob: bytes) -> np.ndarray:
+    return np.load(io.BytesIO(blob))
+
+def downsample(tSol: np.ndarray, sSol: np.ndarray, n_points: int) -> np.ndarray:
+    '''
+    Downsamples a trajectory to (at most) `n_points` evenly strided rows of [t, E, Z, D], always keeping the last row
+    '''
+    n = len(tSol)
+    idx = np.unique(np.append(np.linspace(0, n - 1, min(n, n_points)).astype(int), n - 1))
+
+    return np.column_stack([tSol[idx], sSol[idx, :]])
+
+def parse_array(text: str) -> List[float]:
+    '''
+    Parses an array written by `print` of numpy, e.g. "[614.38 1228.52]", as in the testing performance files
+    '''
+    if '...' in text:
+        raise ValueError("The array is summarized by numpy (over 1000 elements), its values are not in the text")
+    return [float(x) for x in re.sub(r'[\[\]]', ' ', text).split()]
+
+class ResultStore():
+    '''
+    Consolidated store of the results of all experiments in a collection, in a single SQLite file.
+    Holds per-experiment measurements keyed by exp_ID & interaction coefficients (alpha_EZ, alpha_ZE),
+    downsampled testing trajectories, final Q-tables (or LinearQ weights) & training performances.
+    Several workers can append to the same store concurrently, also from several nodes with the file on a shared file system:
+    it uses the rollback journal (not WAL, which needs memory shared by all the processes, so a single host).
+    Initialized with:
+        db_file (str): path to the store file, created if it does not exist
+        timeout (float): time (in s) to wait for the lock held by another worker
+    '''
+    def __init__(self, db_file: str, timeout=600.0):
+
+        self.db_file = db_file
+
+        self.conn = sqlite3.connect(db_file, timeout=timeout)
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.conn.executescript(_schema)
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def add_experiment(self, exp_ID: str, alpha_EZ: float, alpha_ZE: float, controller: str,
+                       e_return: float, t5p: List[float], tTiny: List[float], total_drug_in: float,
+                       params=None) -> None:
+        '''
+        Adds (or replaces) the testing measurements of an experiment
+        '''
+        t5p = [float(x) for x in t5p]
+        tTiny = [float(x) for x in tTiny]
+
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO experiments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                              (exp_ID, float(alpha_EZ), float(alpha_ZE), controller,
+                               float(e_return),
+                               t5p[0] if len(t5p) > 0 else None,
+                               tTiny[0] if len(tTiny) > 0 else None,
+                               float(total_drug_in),
+                               json.dumps(t5p), json.dumps(tTiny),
+                               json.dumps(params) if params is not None else None))
+
+    def add_trajectory(self, exp_ID: str, tSol: np.ndarray, sSol: np.ndarray, n_points=2000) -> None:
+        '''
+        Adds (or replaces) the testing trajectory of an experiment, downsampled to `n_points` rows of [t, E, Z, D]
+        '''
+        data = downsample(tSol, sSol, n_points)
+
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO trajectories VALUES (?, ?)",
+                              (exp_ID, array_to_blob(data)))
+
+    def add_qtable(self, exp_ID: str, episode: int, values: np.ndarray) -> None:
+        '''
+        Adds (or replaces) the (final) Q-table of an experiment
+        '''
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO qtables VALUES (?, ?, ?)",
+                              (exp_ID, int(episode), array_to_blob(values)))
+
+    def add_training(self, exp_ID: str, train_perf_file: str) -> None:
+        '''
+        Adds (or replaces) the training performance of an experiment, read from its `training_performance.tsv` file
+        '''
+        df = pd.read_csv(train_perf_file, sep='\t', na_values=["N/A"])
+        df = df.astype(object).where(df.notna(), None) # missing event times are stored as NULL
+
+        rows = [(exp_ID,) + tuple(r) for r in df[['episode', 'explore_rate', 'e_return',
+                                                  't5p_first', 'tTiny_first', 'total_drug_in']].itertuples(index=False)]
+
+        with self.conn:
+            self.conn.execute("DELETE FROM training WHERE exp_ID = ?", (exp_ID,))
+            self.conn.executemany("INSERT INTO training VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def ingest_experiment(self, exp_dir: str, qtable_episode='last', n_points=2000) -> bool:
+        '''
+        Adds all the stored results of an experiment, read from its directory
+        Parameters:
+            exp_dir (str): experiment directory, containing the param file `params.<exp_ID>.json`
+            qtable_episode (str or int): episode of the Q-table to store, 'last' by default
+            n_points (int): number of rows of the downsampled trajectory
+        Returns:
+            ingested (bool): False if the experiment has no testing performance file (yet)
+        '''
+        exp_ID = os.path.basename(os.path.normpath(exp_dir))
+        exp_dir = os.path.normpath(exp_dir) + '/'
+
+        with open(exp_dir + "params." + exp_ID + ".json") as f:
+            param_dict = json.load(f)
+
+        test_pfname = exp_dir + "testing_perf." + exp_ID + ".tsv"
+        if not os.path.exists(test_pfname):
+            return False
+
+        # arrays of event times can be written over several lines
+        with open(test_pfname) as f:
+            fields = " ".join(f.read().splitlines()[1:]).split('\t')
+
+        ode_params = param_dict['env']['ode_params']
+        controller_dict = param_dict['controller']
+
+        # the event times are read from the header of the binary simulation data file if there is one (as lists),
+        # older testing performance files may have summarized long arrays
+        output_filename = exp_dir + "testing." + exp_ID
+        if os.path.exists(sim_data.header_file(output_filename)):
+            header = sim_data.load_header(output_filename)
+            t5p, tTiny = header['t5p'], header['tTiny']
+        else:
+            t5p, tTiny = parse_array(fields[2]), parse_array(fields[3])
+
+        self.add_experiment(exp_ID, ode_params['alpha_EZ'], ode_params['alpha_ZE'], controller_dict['type_name'],
+                            e_return = float(fields[1]), t5p = t5p, tTiny = tTiny,
+                            total_drug_in = float(fields[4]), params = param_dict)
+
+        if sim_data.find_env_data_file(output_filename) is not None:
+            sim = sim_data.load_env_data(output_filename, param_dict['env'])
+            self.add_trajectory(exp_ID, sim.tSol, sim.sSol, n_points = n_points)
+
+        if controller_dict['type_name'] in ['QLearning', 'LinearQ']:
+            n_episodes = controller_dict['training']['n_episodes']
+            ep = n_episodes - 1 if qtable_episode == 'last' else int(qtable_episode)
+
+            qtable_file = sim_data.values_filename(exp_dir, controller_dict['type_name'], ep)
+            if os.path.exists(qtable_file):
+                self.add_qtable(exp_ID, ep, np.load(qtable_file))
+
+            perf_filename = exp_dir + 'training_performance.tsv'
+            if os.path.exists(perf_filename):
+                self.add_training(exp_ID, perf_filename)
+
+        return True
+
+    def ingest_collection(self, collection_dir: str, qtable_episode='last', n_points=2000) -> int:
+        '''
+        Adds the stored results of all experiments listed in the `metadata.tsv` file of a collection
+        Returns:
+            count (int): number of experiments added
+        '''
+        collection_dir = os.path.normpath(collection_dir) + '/'
+        metadata = pd.read_csv(collection_dir + "metadata.tsv", sep='\t')
+
+        count = 0
+        for exp_ID in metadata['exp_ID']:
+            if self.ingest_experiment(collection_dir + exp_ID + '/', qtable_episode, n_points):
+                count += 1
+
+        return count
+
+    def metrics(self, columns=None, alpha_EZ=None, alpha_ZE=None, controller=None) -> pd.DataFrame:
+        '''
+        Returns the measurements of the experiments, optionally sliced on interaction coefficients and/or controller,
+        e.g. `store.metrics(['t5p_first'], alpha_ZE = 0.0)`
+        Parameters:
+            columns (list of str or None): measurements to return, all of `metric_columns` if None
+            alpha_EZ, alpha_ZE (float or None): interaction coefficients to select, any if None
+            controller (str or None): controller type name to select, any if None
+        Returns:
+            df: data frame with columns exp_ID, alpha_EZ, alpha_ZE, followed by the measurements
+        '''
+        columns = metric_columns if columns is None else list(columns)
+        for c in columns:
+            if c not in metric_columns + ["t5p", "tTiny", "controller"]:
+                raise ValueError(f"Column should be in this list: {metric_columns + ['t5p', 'tTiny', 'controller']}")
+
+        query = "SELECT exp_ID, alpha_EZ, alpha_ZE, " + ", ".join(columns) + " FROM experiments WHERE 1"
+        args = []
+
+        # interaction coefficients are floats, so they are compared up to a tolerance
+        if alpha_EZ is not None:
+            query += " AND alpha_EZ BETWEEN ? AND ?"
+            args += [alpha_EZ - 1e-12, alpha_EZ + 1e-12]
+        if alpha_ZE is not None:
+            query += " AND alpha_ZE BETWEEN ? AND ?"
+            args += [alpha_ZE - 1e-12, alpha_ZE + 1e-12]
+        if controller is not None:
+            query += " AND controller = ?"
+            args += [controller]
+
+        df = pd.read_sql_query(query + " ORDER BY alpha_EZ, alpha_ZE", self.conn, params=args)
+
+        for c in ["t5p", "tTiny"]:
+            if c in df.columns:
+                df[c] = df[c].map(json.loads)
+
+        return df
+
+    def params(self, exp_ID: str) -> Dict:
+        row = self.conn.execute("SELECT params FROM experiments WHERE exp_ID = ?", (exp_ID,)).fetchone()
+        return json.loads(row[0]) if row is not None and row[0] is not None else None
+
+    def trajectory(self, exp_ID: str) -> np.ndarray:
+        '''
+        Returns the downsampled testing trajectory of an experiment, rows of [t, E, Z, D]. None if not stored.
+        '''
+        row = self.conn.execute("SELECT data FROM trajectories WHERE exp_ID = ?", (exp_ID,)).fetchone()
+        return blob_to_array(row[0]) if row is not None else None
+
+    def qtable(self, exp_ID: str) -> np.ndarray:
+        '''
+        Returns the stored Q-table of an experiment. None if not stored.
+        '''
+        row = self.conn.execute("SELECT data FROM qtables WHERE exp_ID = ?", (exp_ID,)).fetchone()
+        return blob_to_array(row[0]) if row is not None else None
+
+    def training(self, exp_ID=None) -> pd.DataFrame:
+        '''
+        Returns the training performances, of one experiment or of all experiments if `exp_ID` is None
+        '''
+        if exp_ID is None:
+            return pd.read_sql_query("SELECT * FROM training ORDER BY exp_ID, episode", self.conn)
+
+        return pd.read_sql_query("SELECT * FROM training WHERE exp_ID = ? ORDER BY episode", self.conn, params=[exp_ID])
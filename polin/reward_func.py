@@ -16,4 +16,18 @@ def minED(action, sSol, tSol, **kwargs):
                                           # presribe drug from the beginning of simulation &
                                           # also implying treatment failure if E goes back to initial density
 
-    return reward, done
\ No newline at end of file
+    return reward, done
+
+def minED_batch(Din, E, init_E, **kwargs):
+    '''
+    Vectorized `minED` over a batch of environments, given the chosen Din, current E & initial E of each environment
+    '''
+    w_E = kwargs["w_E"]
+    Din_max = kwargs["Din_max"]
+    w_D = kwargs["w_D"]
+
+    reward = w_E * (1.0 - E/init_E) - w_D * Din / Din_max
+
+    done = E == init_E
+
+    return reward, done
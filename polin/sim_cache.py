@@ -0,0 +1,203 @@
+from polin.sim_data import StoredSimulation
+from polin.result_store import array_to_blob, blob_to_array, downsample
+
+from typing import List, Dict, Tuple
+import numpy as np
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+# modules whose code determines the results of simulations, part of every cache key
+simulation_modules = ["bacterial_env.py", "batch_env.py", "controller.py", "optimal_control.py",
+                      "reward_func.py", "train_test.py"]
+
+_code_version = None
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS simulations (
+    key TEXT PRIMARY KEY,
+    metrics TEXT,
+    trajectory BLOB,
+    size INTEGER,
+    created REAL,
+    last_used REAL
+);
+CREATE INDEX IF NOT EXISTS idx_last_used ON simulations (last_used);
+'''
+
+def default_cache_dir() -> str:
+    '''
+    Returns the directory of the simulation cache: `POLIN_CACHE_DIR` if set, or else `~/.cache/polin`
+    '''
+    return os.environ.get('POLIN_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'polin'))
+
+def code_version() -> str:
+    '''
+    Returns the hash of the code of the simulation modules, so that cached results of older code are not used
+    '''
+    global _code_version
+
+    if _code_version is None:
+        h = hashlib.sha256()
+        module_dir = os.path.dirname(os.path.abspath(__file__))
+        for m in simulation_modules:
+            with open(os.path.join(module_dir, m), 'rb') as f:
+                h.update(f.read())
+        _code_version = h.hexdigest()
+
+    return _code_version
+
+def canonical(obj):
+    '''
+    Returns a canonical form of parameters for hashing: numbers as floats (100 & 100.0 are the same), tuples as lists
+    '''
+    if isinstance(obj, dict):
+        return {str(k): canonical(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple, np.ndarray)):
+        return [canonical(v) for v in obj]
+    if isinstance(obj, (bool, np.bool_)) or obj is None or isinstance(obj, str):
+        return bool(obj) if isinstance(obj, np.bool_) else obj
+    return float(obj)
+
+def cache_key(*specs) -> str:
+    '''
+    Returns the key of a simulation: the hash of its specifications (e.g. env, simulation & controller parameters,
+    solver options), in canonical form, with the code version
+    '''
+    text = json.dumps([code_version()] + [canonical(s) for s in specs], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+class CachedSimulation(StoredSimulation):
+    '''
+    Simulation read back from the cache, with the (downsampled) trajectory & the measurements of the env
+    that are needed to plot, export & store the results of an experiment
+    '''
+    def __init__(self, tSol: np.ndarray, sSol: np.ndarray, metrics: Dict, env_param_dict: Dict):
+
+        super().__init__(tSol, sSol, np.array(metrics['actions'], dtype=float).reshape(-1, 2), env_param_dict)
+
+        self.t5p = np.array(metrics['t5p'])
+        self.tTiny = np.array(metrics['tTiny'])
+        self.total_drug_in = metrics['total_drug_in']
+        self.mono = metrics.get('mono', False)
+
+class SimulationCache():
+    '''
+    On-disk cache of simulation results shared across runs & collections, in a single SQLite file,
+    keyed by the hash of the specifications of the simulation (see `cache_key`).
+    Holds the measurements & (optionally) the downsampled trajectory of every simulation.
+    Once the cache is larger than `max_bytes`, the least recently used simulations are evicted.
+    It can be shared by jobs on several nodes, e.g. in a home directory on a shared file system.
+    Initialized with:
+        cache_dir (str or None): directory of the cache, `default_cache_dir()` if None
+        max_bytes (int): size bound of the cached data
+        timeout (float): time (in s) to wait for the lock held by another process
+    '''
+    def __init__(self, cache_dir=None, max_bytes=2**30, timeout=600.0):
+
+        self.cache_dir = default_cache_dir() if cache_dir is None else cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.max_bytes = max_bytes
+
+        self.conn = sqlite3.connect(os.path.join(self.cache_dir, 'simulations.sqlite'), timeout=timeout)
+        self.conn.execute("PRAGMA journal_mode=DELETE") # not WAL, which is unsupported on shared file systems (NFS, Lustre)
+        self.conn.executescript(_schema)
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def get(self, key: str) -> Tuple:
+        '''
+        Returns the cached measurements (dict) & trajectory (numpy array of rows [t, E, Z, D], or None) of a simulation,
+        or None if it is not cached
+        '''
+        return self.get_many([key])[0]
+    
+    def get_many(self, keys: List[str], chunk_size=500) -> List:
+        '''
+        Returns the cached measurements & trajectories of many simulations (see `get`), in the order of `keys`
+        '''
+        found = {}
+        for i in range(0, len(keys), chunk_size):
+            chunk = keys[i:i + chunk_size]
+            rows = self.conn.execute("SELECT key, metrics, trajectory FROM simulations WHERE key IN (" + 
+                                     ",".join("?" * len(chunk)) + ")", chunk).fetchall()
+            for key, text, blob in rows:
+                found[key] = (json.loads(text), blob_to_array(blob) if blob is not None else None)
+
+        if found:
+            with self.conn:
+                self.conn.executemany("UPDATE simulations SET last_used = ? WHERE key = ?", 
+                                      [(time.time(), k) for k in found])
+
+        return [found.get(k) for k in keys]
+
+    def put(self, key: str, metrics: Dict, trajectory=None) -> None:
+        '''
+        Caches the measurements (JSON serializable) & trajectory (if given) of a simulation, then evicts if needed
+        '''
+        self.put_many([(key, metrics, trajectory)])
+    
+    def put_many(self, entries: List[Tuple]) -> None:
+        '''
+        Caches many simulations at once, given as (key, measurements, trajectory or None), then evicts if needed
+        '''
+        now = time.time()
+        rows = []
+        for key, metrics, trajectory in entries:
+            text = json.dumps(metrics)
+            blob = array_to_blob(trajectory) if trajectory is not None else None
+            rows.append((key, text, blob, len(text) + (len(blob) if blob is not None else 0), now, now))
+
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO simulations VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+        self.evict()
+
+    def evict(self) -> None:
+        '''
+        Removes the least recently used simulations until the cached data fits in `max_bytes`
+        '''
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM simulations").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        evicted = []
+        for key, size in self.conn.execute("SELECT key, size FROM simulations ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+
+        with self.conn:
+            self.conn.executemany("DELETE FROM simulations WHERE key = ?", evicted)
+
+    def get_simulation(self, key: str, env_param_dict: Dict) -> Tuple:
+        '''
+        Returns a cached simulation of an env (see `put_simulation`) & its measurements, or None if it is not cached
+        '''
+        cached = self.get(key)
+        if cached is None or cached[1] is None:
+            return None
+
+        metrics, data = cached
+        return CachedSimulation(data[:, 0], data[:, 1:], metrics, env_param_dict), metrics
+
+    def put_simulation(self, key: str, env, e_return: float, n_points=2000, **extra) -> None:
+        '''
+        Caches the simulation of an env: its return, events, drug, actions & downsampled trajectory
+        Parameters:
+            env (BacterialEnv): the simulated env
+            e_return (float): return of the simulation
+            n_points (int): number of points of the downsampled trajectory
+            extra: other JSON serializable results to cache with it
+        '''
+        metrics = dict(extra, e_return = e_return, t5p = env.t5p.tolist(), tTiny = env.tTiny.tolist(),
+                       total_drug_in = env.total_drug_in, actions = env.actions.tolist(), mono = env.mono)
+
+        self.put(key, metrics, downsample(env.tSol, env.sSol, n_points))
@@ -0,0 +1,166 @@
+from typing import List, Dict, Tuple
+import numpy as np
+
+import json
+import os
+
+# columns of the binary simulation data file, S = [E, Z, D] is kept contiguous so it can be read as a view
+binary_columns = ["t", "E", "Z", "D"]
+
+class StoredSimulation():
+    '''
+    Simulation data read back from the files written by `TrainTest.export_env_data`.
+    It exposes the same attributes as `BacterialEnv` that are needed by `viz.visualize_simulation`,
+    so figures can be re-made without re-simulating.
+    Initialized with:
+        tSol (numpy array): time points
+        sSol (numpy array): solution of S = [E, Z, D] at the time points
+        actions (numpy array): matrix of actions with corresponding timepoints
+        env_param_dict (dictionary): parameters for the ODE model & initial conditions
+    '''
+    def __init__(self, tSol: np.ndarray, sSol: np.ndarray, actions: np.ndarray,
+                 env_param_dict: Dict):
+
+        self.tSol = tSol
+        self.sSol = sSol
+        self.actions = actions
+
+        self.micE = env_param_dict['ode_params']['micE']
+        self.micZ = env_param_dict['ode_params']['micZ']
+
+        self.mono = False # TrainTest always resets the env to equilibria before simulating, which makes it a co-culture env
+
+def actions_filename(output_filename: str) -> str:
+    '''
+    Returns the name of the file storing the actions of an exported simulation
+    '''
+    return output_filename + ".actions.tsv"
+
+def export_actions(output_filename: str, actions: np.ndarray) -> None:
+    '''
+    Writes the actions (time point & chosen Din) of a simulation to file
+    '''
+    np.savetxt(actions_filename(output_filename), actions,
+               delimiter="\t", fmt='%.5f',
+               header="t\tDin", comments='')
+
+def load_actions(output_filename: str) -> np.ndarray:
+    '''
+    Reads the actions of an exported simulation. Returns an empty matrix of actions if they were not exported.
+    '''
+    actions_file = actions_filename(output_filename)
+
+    if not os.path.exists(actions_file):
+        return np.empty((0, 2), float)
+
+    return np.loadtxt(actions_file, delimiter="\t", skiprows=1, ndmin=2)
+
+def values_filename(exp_dir: str, type_name: str, episode=None) -> str:
+    '''
+    Returns the file of the values (Q-table or weights) learned in a training episode by the agent of a "QLearning"
+    or "LinearQ" controller (`type_name`), or the prefix of these files if `episode` is None
+    '''
+    prefix = exp_dir + 'learned_qtables/' + type_name + 'Agent_values.ep'
+    return prefix if episode is None else prefix + str(episode) + '.npy'
+
+def env_data_file(output_filename: str, export_format='tsv') -> str:
+    '''
+    Returns the name of the exported simulation data file
+    Parameters:
+        output_filename (str): the name (without extension) given to `export_env_data`
+        export_format (str): "npy" for the binary file, "tsv" for the text file
+    '''
+    if export_format == 'npy':
+        return output_filename + ".npy"
+    elif export_format == 'tsv':
+        return output_filename + ".tsv"
+    else:
+        raise ValueError("Export format can only be either \"npy\" or \"tsv\".")
+
+def header_file(output_filename: str) -> str:
+    '''
+    Returns the name of the JSON header file accompanying the binary simulation data file
+    '''
+    return output_filename + ".json"
+
+def find_env_data_file(output_filename: str) -> str:
+    '''
+    Returns the name of the exported simulation data file that exists, binary file first. None if there is none.
+    '''
+    for export_format in ['npy', 'tsv']:
+        data_file = env_data_file(output_filename, export_format)
+        if os.path.exists(data_file):
+            return data_file
+    
+    return None
+
+def export_binary(output_filename: str, tSol: np.ndarray, sSol: np.ndarray, 
+                  header: Dict, dtype='float64', chunk_size=2**16) -> None:
+    '''
+    Writes simulation data to a binary `.npy` file with columns t, E, Z, D, and a small JSON header file.
+    Rows are streamed into the file chunk by chunk, so the output is never built in memory.
+    Parameters:
+        output_filename (str): name of the output files (without extension)
+        tSol (numpy array): time points
+        sSol (numpy array): solution of S = [E, Z, D] at the time points
+        header (dict): extra information to store in the header, e.g. actions & event times
+        dtype (str): "float64" or "float32"
+        chunk_size (int): number of rows written at a time
+    '''
+    n = len(tSol)
+
+    out = np.lib.format.open_memmap(env_data_file(output_filename, 'npy'), mode='w+', 
+                                    dtype=dtype, shape=(n, len(binary_columns)))
+    
+    for i in range(0, n, chunk_size):
+        j = min(i + chunk_size, n)
+        out[i:j, 0] = tSol[i:j]
+        out[i:j, 1:] = sSol[i:j, :]
+    
+    out.flush()
+    del out
+
+    header = dict(header, columns=binary_columns, dtype=str(np.dtype(dtype)), n_rows=n)
+    with open(header_file(output_filename), 'w') as f:
+        json.dump(header, f, indent=4)
+
+def load_header(output_filename: str) -> Dict:
+    '''
+    Reads the JSON header of a binary simulation data file
+    '''
+    with open(header_file(output_filename)) as f:
+        return json.load(f)
+
+def load_env_data(output_filename: str, env_param_dict: Dict, mmap=True) -> StoredSimulation:
+    '''
+    Reads simulation data exported by `TrainTest.export_env_data`, from the binary file if it exists, or else the TSV file
+    Parameters:
+        output_filename (str): the same name (without extension) given to `export_env_data`
+        env_param_dict (dictionary): env parameters of the experiment
+        mmap (bool): whether to memory-map the binary file instead of reading it into memory
+    Returns:
+        sim (StoredSimulation): the stored simulation
+    '''
+    data_file = find_env_data_file(output_filename)
+
+    if data_file is None:
+        raise FileNotFoundError(f"No exported simulation data for {output_filename}")
+
+    if data_file.endswith(".npy"):
+        data = np.load(data_file, mmap_mode='r' if mmap else None)
+
+        tSol = data[:, 0]
+        sSol = data[:, 1:] # columns t, E, Z, D -> E, Z, D, a view on the (memory-mapped) data
+
+        header = load_header(output_filename)
+        actions = np.array(header['actions'], dtype=float).reshape(-1, 2)
+    
+    else:
+        data = np.loadtxt(data_file, delimiter="\t", skiprows=1, ndmin=2)
+
+        tSol = data[:, 0]
+        sSol = data[:, [1, 2, 4]] # columns t, E, Z, M, D -> E, Z, D
+
+        actions = load_actions(output_filename)
+
+    return StoredSimulation(tSol, sSol, actions, env_param_dict)
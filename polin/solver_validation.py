@@ -0,0 +1,220 @@
+from polin.bacterial_env import BacterialEnv
+from polin.batch_env import discretize_state
+from polin.evaluation import pareto_front
+
+from typing import List, Dict, Tuple
+import numpy as np
+import pandas as pd
+
+import itertools
+import time
+from multiprocessing import Pool
+
+# settings of the ODE solver of `BacterialEnv` (see `apply_setting`)
+setting_keys = ["method", "max_step", "rtol", "atol"]
+
+# the production settings of `BacterialEnv`
+default_setting = {"method": "LSODA", "max_step": 0.01, "rtol": 1e-3, "atol": 1e-6}
+
+# high-accuracy solution the settings are compared to
+reference_setting = {"method": "DOP853", "max_step": 1.0, "rtol": 1e-10, "atol": 1e-13}
+
+# largest errors (over all configurations) of a setting that passes the gate
+default_tolerances = {"err_t5p": 1.0,           # in min
+                      "err_tTiny": 1.0,         # in min
+                      "err_S": 1e-5,            # final densities & drug concentration
+                      "err_return": 1e-3,
+                      "err_reward": 1e-3,       # largest error of a reward of a step
+                      "state_mismatch": 0.0}    # fraction of the steps ending in another discrete state
+
+error_metrics = list(default_tolerances)
+
+def setting_name(setting: Dict) -> str:
+    return f"{setting['method']}_ms{setting['max_step']:g}_rt{setting['rtol']:g}_at{setting['atol']:g}"
+
+def candidate_settings(methods=("LSODA",), max_steps=(0.01, 0.1, 1.0, 10.0, np.inf),
+                       rtols=(1e-3, 1e-6, 1e-9), atol_ratio=1e-3) -> List[Dict]:
+    '''
+    Returns the matrix of solver settings: every method x max_step x rtol, with atol = `atol_ratio` * rtol
+    (the production setting, rtol 1e-3 & atol 1e-6, is in the default matrix)
+    '''
+    return [{"method": m, "max_step": ms, "rtol": rt, "atol": rt * atol_ratio}
+            for m, ms, rt in itertools.product(methods, max_steps, rtols)]
+
+def apply_setting(env: BacterialEnv, setting: Dict) -> None:
+    '''
+    Sets the solver of the env: method, max_step & the tolerances of the full model
+    (the tolerances of the reduced model when species E is extinct are kept)
+    '''
+    env.method = setting['method']
+    env.max_step = setting['max_step']
+    env.rtol = setting['rtol']
+    env.atol = setting['atol']
+
+def simulate_setting(env_param_dict: Dict, sim_param_dict: Dict, setting: Dict, Din: float, drug_time: float,
+                     schedule=None, n_states=22) -> Dict:
+    '''
+    Simulates an env without history under a solver setting, with either a rational policy (Din if E > 0, else 0)
+    or a fixed drug schedule, so that the settings are compared under the same actions
+    Parameters:
+        env_param_dict, sim_param_dict (dictionaries): as in the experiment param file
+        setting (dictionary): solver setting (see `setting_keys`)
+        Din, drug_time (float): action of the rational policy
+        schedule (list of float or None): Din of every step, instead of the rational policy
+        n_states (int): number of states of the "disc_E" observable state (with its bin boundaries),
+                        whose sequence is compared across the settings
+    Returns:
+        results (dictionary): events, final state, return, reward & discrete state of every step,
+                              Din of every step, wall time (in s) & number of evaluations of the right-hand side
+    '''
+    env = BacterialEnv(env_param_dict, step_time = sim_param_dict['env_step_time'],
+                       reward_func = sim_param_dict['reward_func'], reward_kwargs = sim_param_dict['reward_kwargs'])
+    apply_setting(env, setting)
+    env.keep_history = False
+    env.reset_2_equilibria(eq_type = sim_param_dict['reset_type'])
+
+    n_steps = int(np.ceil(round(sim_param_dict['simulation_time'] / env.step_time, 9)))
+    if schedule is None:
+        schedule = [None] * n_steps
+
+    rewards, states, actions = [], [], []
+    start = time.perf_counter()
+    for Din_k in schedule:
+        if Din_k is None:
+            Din_k = Din if env.sSol[-1, 0] > 0.0 else 0.0
+        _, reward, _ = env.step((Din_k, drug_time))
+        rewards.append(reward)
+        states.append(env.sSol[-1])
+        actions.append(Din_k)
+    seconds = time.perf_counter() - start
+
+    states = np.array(states)
+    return {'t5p_first': env.t5p[0] if len(env.t5p) > 0 else np.nan,
+            'tTiny_first': env.tTiny[0] if len(env.tTiny) > 0 else np.nan,
+            'S': env.sSol[-1].copy(),
+            'e_return': float(np.sum(rewards)),
+            'rewards': np.array(rewards),
+            'states': discretize_state(states[:, 0], states[:, 1], 'disc_E', n_states),
+            'schedule': actions,
+            'seconds': seconds,
+            'nfev': env.nfev}
+
+def event_error(t: float, t_ref: float) -> float:
+    '''
+    Returns the error of the time of an event: 0 if it happens in neither simulation, infinite if in one only
+    '''
+    if np.isnan(t) and np.isnan(t_ref):
+        return 0.0
+    if np.isnan(t) or np.isnan(t_ref):
+        return np.inf
+    return abs(t - t_ref)
+
+def setting_errors(results: Dict, reference: Dict) -> Dict:
+    '''
+    Returns the errors of a simulation against the reference simulation (see `error_metrics`)
+    '''
+    return {'err_t5p': event_error(results['t5p_first'], reference['t5p_first']),
+            'err_tTiny': event_error(results['tTiny_first'], reference['tTiny_first']),
+            'err_S': float(np.max(np.abs(results['S'] - reference['S']))),
+            'err_return': abs(results['e_return'] - reference['e_return']),
+            'err_reward': float(np.max(np.abs(results['rewards'] - reference['rewards']))),
+            'state_mismatch': float(np.mean(results['states'] != reference['states']))}
+
+def _validate_config(args: Tuple) -> List[Dict]:
+    '''
+    Simulates a configuration under the reference setting (with its rational policy),
+    then under every setting with the Din schedule of the reference
+    '''
+    name, env_param_dict, sim_param_dict, Din, drug_time, settings, reference_setting, n_states = args
+
+    reference = simulate_setting(env_param_dict, sim_param_dict, reference_setting, Din, drug_time, n_states = n_states)
+
+    rows = []
+    for setting in settings:
+        results = simulate_setting(env_param_dict, sim_param_dict, setting, Din, drug_time,
+                                   schedule = reference['schedule'], n_states = n_states)
+        rows.append(dict(config = name, setting = setting_name(setting), **setting,
+                         **setting_errors(results, reference),
+                         t5p_first = results['t5p_first'], tTiny_first = results['tTiny_first'],
+                         e_return = results['e_return'], seconds = results['seconds'], nfev = results['nfev'],
+                         ref_seconds = reference['seconds'], ref_nfev = reference['nfev']))
+    return rows
+
+def validate_settings(configs: List[Tuple], settings: List[Dict], reference=reference_setting,
+                      n_states=22, n_workers=1) -> pd.DataFrame:
+    '''
+    Compares solver settings to a high-accuracy reference over configurations
+    Parameters:
+        configs (list of tuples): (name, env_param_dict, sim_param_dict, Din, drug_time) of every configuration,
+                                  simulated under the rational policy of (Din, drug_time)
+        settings (list of dictionaries): solver settings (see `candidate_settings`)
+        reference (dictionary): solver setting of the reference simulations
+        n_states (int): number of states of the compared discrete state sequences (see `simulate_setting`)
+        n_workers (int): number of processes, the configurations are simulated in parallel
+    Returns:
+        df (pandas DataFrame): one row per configuration x setting, with the errors (see `error_metrics`),
+                               events, return, wall time (in s) & number of evaluations of the right-hand side
+    '''
+    tasks = [tuple(config) + (settings, reference, n_states) for config in configs]
+
+    if n_workers > 1:
+        with Pool(processes=n_workers) as pool:
+            rows = pool.map(_validate_config, tasks)
+    else:
+        rows = [_validate_config(task) for task in tasks]
+
+    return pd.DataFrame([r for config_rows in rows for r in config_rows])
+
+def settings_table(df: pd.DataFrame, tolerances=default_tolerances, baseline=default_setting) -> pd.DataFrame:
+    '''
+    Summarizes the validation per setting: largest errors over the configurations, total wall time & evaluations,
+    speedup over the baseline setting (if validated), whether the setting passes the gate (every error within its tolerance)
+    & whether it is on the Pareto front of wall time vs. error of the return
+    '''
+    table = df.groupby(['setting'] + setting_keys, sort=False).agg(
+        **{m: (m, 'max') for m in error_metrics}, seconds = ('seconds', 'sum'), nfev = ('nfev', 'sum')).reset_index()
+
+    baseline_rows = table[table['setting'] == setting_name(baseline)]
+    table['speedup'] = baseline_rows['seconds'].iloc[0] / table['seconds'] if len(baseline_rows) > 0 else np.nan
+
+    table['passed'] = np.all([table[m] <= tolerances[m] for m in error_metrics], axis=0)
+    table['pareto'] = table.index.isin(pareto_front(table, x='seconds', y='err_return').index)
+
+    return table
+
+def failed_checks(table: pd.DataFrame, setting: Dict, tolerances=default_tolerances) -> List[str]:
+    '''
+    Returns the errors of a setting that exceed their tolerance, as "metric: error > tolerance" (empty if it passes)
+    '''
+    row = table[table['setting'] == setting_name(setting)].iloc[0]
+    return [f"{m}: {row[m]:.3g} > {tolerances[m]:g}" for m in error_metrics if not row[m] <= tolerances[m]]
+
+def plot_settings(table: pd.DataFrame, tolerances=default_tolerances):
+    '''
+    Plots the error of the return vs. the wall time of every setting, on log scales,
+    marking the settings that pass the gate & the Pareto front
+    '''
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(8, 6))
+
+    # errors of 0 (e.g. exactly the reference) at the bottom of the log scale
+    err = table['err_return'].clip(lower=1e-16)
+    for passed, marker, label in [(True, 'o', 'passes the gate'), (False, 'x', 'fails the gate')]:
+        sel = table['passed'] == passed
+        ax.scatter(table.loc[sel, 'seconds'], err[sel], marker=marker, label=label)
+
+    front = table[table['pareto']].sort_values('seconds')
+    ax.plot(front['seconds'], err[front.index], 'k--', linewidth=0.8, label='Pareto front')
+
+    for i, row in table.iterrows():
+        ax.annotate(row['setting'], (row['seconds'], err[i]), fontsize=6)
+
+    ax.axhline(tolerances['err_return'], color='grey', linewidth=0.8)
+    ax.set_xscale('log')
+    ax.set_yscale('log')
+    ax.set_xlabel('wall time (s)')
+    ax.set_ylabel('largest error of the return')
+    ax.legend()
+
+    return fig
@@ -0,0 +1,283 @@
+from polin.bacterial_env import BacterialEnv
+from polin.batch_env import BatchBacterialEnv
+
+from typing import List, Dict, Tuple
+import numpy as np
+import pandas as pd
+from scipy.interpolate import RegularGridInterpolator
+
+import json
+import os
+from multiprocessing import Pool
+
+# densities below this are rounded to 0.0 by the env (see `BacterialEnv.integrate`), lowest non-zero node of the grid
+extinct_density = 5e-6
+
+# outputs tabulated for every grid point & action: the state [E, Z, D] at the end of the step,
+# & the times (from the start of the step) of the first events of E in the step, NaN if none
+surrogate_outputs = ["E", "Z", "D", "t5p", "tTiny"]
+
+# number of nodes of the E, Z & D axes of the grid
+default_n_grid = (32, 32, 24)
+
+def surrogate_axes(env_param_dict: Dict, sim_param_dict: Dict, Din_options: Tuple,
+                   n_grid=default_n_grid, margin=1.05) -> List[np.ndarray]:
+    '''
+    Returns the grid axes over the reachable box of states [E, Z, D]: densities from 0.0 up to the highest of the
+    equilibria (with a margin), with geometric spacing above `extinct_density` as the dynamics are multiplicative;
+    drug concentration from 0.0 up to its highest steady state under the Din options, with linear spacing
+    Parameters:
+        n_grid (tuple): number of nodes of the E, Z & D axes
+        margin (float): factor of the upper bounds
+    '''
+    env = BatchBacterialEnv([env_param_dict], step_time = sim_param_dict['env_step_time'],
+                            reward_kwargs = sim_param_dict['reward_kwargs'])
+    eqE, eqZ = env.coexist_equilibrium() if sim_param_dict['reset_type'] == "coexist" else (env.cE, env.cZ)
+
+    E_max = margin * max(eqE[0], env.cE[0])
+    Z_max = margin * max(eqZ[0], env.cZ[0])
+    D_max = margin * max(env.init_D[0], env.ka[0] * max(Din_options) / env.kd[0])
+
+    E_axis = np.append(0.0, np.geomspace(extinct_density, E_max, n_grid[0] - 1))
+    Z_axis = np.append(0.0, np.geomspace(extinct_density, Z_max, n_grid[1] - 1))
+    D_axis = np.linspace(0.0, D_max, n_grid[2])
+
+    return [E_axis, Z_axis, D_axis]
+
+def one_step(env_param_dict: Dict, sim_param_dict: Dict, S: np.ndarray, Din: float, drug_time: float,
+             max_step=0.01) -> np.ndarray:
+    '''
+    Simulates one step of the env exactly from a batch of states, under the same action
+    Parameters:
+        S (numpy array): states [E, Z, D], of shape (n, 3)
+        Din (float), drug_time (float): the action
+    Returns:
+        out (numpy array): outputs in `surrogate_outputs` of every state, of shape (n, 5)
+    '''
+    env = BatchBacterialEnv([env_param_dict] * len(S), step_time = sim_param_dict['env_step_time'],
+                            reward_kwargs = sim_param_dict['reward_kwargs'], max_step = max_step)
+    env.reset_2_equilibria(eq_type = sim_param_dict['reset_type']) # sets the initial E of the 5% event
+    env.set_state(S, 0.0)
+    env.step(np.full(len(S), Din), drug_time)
+
+    return np.column_stack([env.S, env.t5p_first, env.tTiny_first])
+
+def _one_step_task(args: Tuple) -> np.ndarray:
+    return one_step(*args)
+
+def build_surrogate(filename: str, env_param_dict: Dict, sim_param_dict: Dict,
+                    Din_options: Tuple, drug_time: float, n_grid=default_n_grid,
+                    batch_size=256, n_workers=1, max_step=0.01) -> None:
+    '''
+    Tabulates the one-step map of the env, (E, Z, D) -> (E', Z', D', events) over `env_step_time`, for every Din option,
+    on a grid over the reachable box of states (see `surrogate_axes`), & writes it to file.
+    The grid points are simulated in batches of `batch_size` environments, & the batches are shared among `n_workers` processes.
+    Parameters:
+        filename (str): name of the surrogate files (without extension), `<filename>.npy` (table) & `<filename>.json` (header)
+        env_param_dict (dict), sim_param_dict (dict): env & simulation parameters, as in the experiment param file
+        Din_options (tuple): "flow in" drug concentrations of the actions
+        drug_time (float): time for "flow in" of drug of the actions
+        n_grid (tuple): number of nodes of the E, Z & D axes
+    '''
+    axes = surrogate_axes(env_param_dict, sim_param_dict, Din_options, n_grid = n_grid)
+    grid = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+
+    tasks = []
+    for Din in Din_options:
+        for i in range(0, len(grid), batch_size):
+            tasks.append((env_param_dict, sim_param_dict, grid[i:i + batch_size], Din, drug_time, max_step))
+
+    if n_workers == 1:
+        results = [_one_step_task(t) for t in tasks]
+    else:
+        with Pool(processes=n_workers) as pool:
+            results = pool.map(_one_step_task, tasks)
+
+    table = np.concatenate(results).reshape(len(Din_options), *[len(a) for a in axes], len(surrogate_outputs))
+
+    with open(filename + ".npy", 'wb') as f:
+        np.save(f, table)
+
+    header = {'axes': [a.tolist() for a in axes], 'outputs': surrogate_outputs,
+              'Din_options': list(Din_options), 'drug_time': drug_time,
+              'env': env_param_dict, 'simulation': sim_param_dict, 'max_step': max_step}
+    with open(filename + ".json", 'w') as f:
+        json.dump(header, f, indent=4)
+
+class SurrogateModel():
+    '''
+    Tabulated one-step map of the env, written by `build_surrogate`, evaluated by multilinear interpolation
+    of the next state, & nearest-node interpolation of the event times (an event either happens in the step or not)
+    Initialized with:
+        filename (str): name of the surrogate files (without extension)
+    '''
+    def __init__(self, filename: str):
+
+        with open(filename + ".json") as f:
+            self.header = json.load(f)
+
+        self.table = np.load(filename + ".npy", mmap_mode='r')
+        self.axes = [np.array(a) for a in self.header['axes']]
+        self.lower = np.array([a[0] for a in self.axes])
+        self.upper = np.array([a[-1] for a in self.axes])
+
+        self.Din_options = tuple(self.header['Din_options'])
+        self.drug_time = self.header['drug_time']
+        self.step_time = self.header['simulation']['env_step_time']
+
+        self.state_interp = [RegularGridInterpolator(self.axes, np.asarray(t[..., :3]))
+                             for t in self.table]
+        self.event_interp = [RegularGridInterpolator(self.axes, np.asarray(t[..., 3:]), method='nearest')
+                             for t in self.table]
+
+    def action_index(self, Din: float, drug_time: float) -> int:
+        '''
+        Returns the index of the tabulated action (Din, drug_time)
+        '''
+        if drug_time != self.drug_time or Din not in self.Din_options:
+            raise ValueError(f"Action ({Din}, {drug_time}) is not tabulated in the surrogate: "
+                             f"Din options {self.Din_options}, drug time {self.drug_time}")
+        return self.Din_options.index(Din)
+
+    def predict(self, S: np.ndarray, action_index: int) -> Tuple:
+        '''
+        Returns the state at the end of the step & the times of the events in the step (from its start),
+        for a batch of states under the same action. States outside the grid are clipped to it.
+        Parameters:
+            S (numpy array): states [E, Z, D], of shape (n, 3)
+        Returns:
+            S_next (numpy array): states at the end of the step, of shape (n, 3)
+            events (numpy array): times of the first 5% & tiny events of E, NaN if none, of shape (n, 2)
+            outside (numpy array): whether each state is outside the grid
+        '''
+        S_clipped = np.clip(S, self.lower, self.upper)
+        outside = np.any(S_clipped != S, axis=1)
+
+        S_next = np.maximum(self.state_interp[action_index](S_clipped), 0.0)
+
+        # an extinct species stays extinct, & densities below tiny are set to 0, as in `BacterialEnv`
+        S_next[:, :2] = np.where((S[:, :2] == 0.0) | (np.round(S_next[:, :2], 5) == 0), 0.0, S_next[:, :2])
+
+        return S_next, self.event_interp[action_index](S_clipped), outside
+
+    def matches(self, env_param_dict: Dict, step_time: float) -> bool:
+        '''
+        Checks whether the surrogate was built for these env parameters & step time
+        '''
+        return (self.header['env']['ode_params'] == env_param_dict['ode_params'] and
+                self.header['env']['initial_conditions'] == env_param_dict['initial_conditions'] and
+                self.step_time == step_time)
+
+def surrogate_errors(surrogate: SurrogateModel, n_samples=1000, seed=None, max_step=0.01) -> pd.DataFrame:
+    '''
+    Measures the errors of the surrogate against the ODE model, on random states of the box of its grid
+    (densities uniform on the log scale above `extinct_density`, drug concentrations uniform) under every action
+    Returns:
+        df: data frame with columns Din, E, Z, D (sampled state), followed by the absolute errors err_E, err_Z, err_D
+            & whether the events in the step disagree (miss_t5p, miss_tTiny)
+    '''
+    rng = np.random.default_rng(seed)
+    header = surrogate.header
+
+    log_low = np.log(extinct_density)
+    S = np.column_stack([np.exp(rng.uniform(log_low, np.log(surrogate.upper[0]), n_samples)),
+                         np.exp(rng.uniform(log_low, np.log(surrogate.upper[1]), n_samples)),
+                         rng.uniform(0.0, surrogate.upper[2], n_samples)])
+
+    dfs = []
+    for i, Din in enumerate(surrogate.Din_options):
+        S_pred, events_pred, _ = surrogate.predict(S, i)
+        out = one_step(header['env'], header['simulation'], S, Din, surrogate.drug_time, max_step = max_step)
+
+        df = pd.DataFrame({'Din': Din, 'E': S[:, 0], 'Z': S[:, 1], 'D': S[:, 2]})
+        for j, v in enumerate(["E", "Z", "D"]):
+            df['err_' + v] = np.abs(S_pred[:, j] - out[:, j])
+        for j, ev in enumerate(["t5p", "tTiny"]):
+            df['miss_' + ev] = np.isnan(events_pred[:, j]) != np.isnan(out[:, 3 + j])
+        dfs.append(df)
+
+    return pd.concat(dfs, ignore_index=True)
+
+class SurrogateBacterialEnv(BacterialEnv):
+    '''
+    Microbial growth environment as `BacterialEnv`, whose steps are answered by a tabulated surrogate of the ODE model
+    (see `SurrogateModel`), for fast approximate training. The trajectory has one point per step.
+    A random fraction of the steps can be simulated exactly instead, to measure the errors of the surrogate along the way.
+    Initialized with (besides the parameters of `BacterialEnv`):
+        surrogate_file (str): name of the surrogate files (without extension), built for the same env parameters & step time
+        exact_fraction (float): fraction of the steps simulated exactly, for which the errors of the surrogate are recorded
+        seed: seed of the random choice of the exact steps
+    '''
+    def __init__(self, surrogate_file: str, param_dict: Dict, step_time: 60.0*6.0,
+                 reward_func: "minED", reward_kwargs: {},
+                 state_method="cont_E", n_states=None, exact_fraction=0.0, seed=None):
+
+        super().__init__(param_dict, step_time = step_time, reward_func = reward_func, reward_kwargs = reward_kwargs,
+                         state_method = state_method, n_states = n_states)
+
+        self.surrogate = SurrogateModel(surrogate_file)
+        if not self.surrogate.matches(param_dict, step_time):
+            raise ValueError(f"Surrogate {surrogate_file} was built for other env parameters or step time")
+
+        self.exact_fraction = exact_fraction
+        self.rng = np.random.default_rng(seed)
+
+        self.check_errors = [] # absolute errors of [E, Z, D] of the surrogate at the end of the exact steps
+        self.n_outside = 0 # number of steps from states outside the grid of the surrogate
+
+    def step(self, action: Tuple) -> Tuple:
+        '''
+        Steps the env under the action taken by a controller, as `BacterialEnv.step`,
+        by the surrogate (or exactly, for a random fraction `exact_fraction` of the steps)
+        '''
+        Din, drug_time = action
+        index = self.surrogate.action_index(Din, drug_time)
+
+        S_next, events, outside = self.surrogate.predict(self.sSol[[-1], :], index)
+        self.n_outside += int(outside[0])
+
+        if self.exact_fraction > 0.0 and self.rng.random() < self.exact_fraction:
+            step_result = super().step(action)
+            self.check_errors.append(np.abs(S_next[0] - self.sSol[-1, :]))
+            return step_result
+
+        t_start = self.tSol[-1]
+        if self.keep_history:
+            self.actions = np.append(self.actions, np.array([[t_start, Din]]), axis=0)
+            self.sSol = np.append(self.sSol, S_next, axis=0)
+            self.tSol = np.append(self.tSol, t_start + self.step_time)
+        else:
+            self.sSol = np.vstack([self.sSol[0, :], S_next[0]])
+            self.tSol = np.array([self.tSol[0], t_start + self.step_time])
+        self.total_drug_in += Din * drug_time * self.ka
+
+        t5p, tTiny = events[0]
+        if not np.isnan(t5p):
+            self.t5p = np.append(self.t5p, t_start + t5p)
+        if not np.isnan(tTiny):
+            self.tTiny = np.append(self.tTiny, t_start + tTiny)
+
+        self.state = self.get_state()
+
+        reward, done = self.get_reward(action, self.sSol, self.tSol, **self.reward_kwargs)
+
+        if self.keep_history:
+            self._own_records()
+            self.step_ends.append(len(self.tSol) - 1)
+            self.step_history.append((action, reward, done))
+
+        return self.state, reward, done
+
+    def error_summary(self) -> Dict:
+        '''
+        Summarizes the errors of the surrogate measured at the exact steps
+        Returns:
+            summary (dict): number of exact steps, mean & max absolute errors of E, Z, D, number of steps outside the grid
+        '''
+        errors = np.array(self.check_errors).reshape(-1, 3)
+        summary = {'n_checked': len(errors), 'n_outside': self.n_outside}
+        for j, v in enumerate(["E", "Z", "D"]):
+            summary['mean_err_' + v] = float(errors[:, j].mean()) if len(errors) > 0 else np.nan
+            summary['max_err_' + v] = float(errors[:, j].max()) if len(errors) > 0 else np.nan
+
+        return summary
@@ -1,5 +1,12 @@
 from polin.bacterial_env import BacterialEnv
-from polin.controller import RationalAgent, QLearningAgent
+from polin.controller import RationalAgent, QLearningAgent, LinearQAgent, ScheduleAgent, MPCAgent
+from polin.optimal_control import optimize_schedule
+import polin.sim_data as sim_data
+from polin.offline import TransitionRecorder
+from polin.surrogate import SurrogateBacterialEnv
+from polin.batch_env import discretize_state
+from polin.evaluation import resolution_name, resolution_dir
+from polin.async_train import train_async
 
 from typing import List, Dict, Tuple
 import numpy as np
@@ -7,22 +14,46 @@ import json
 
 import os
 
+# controllers whose action is a function of the observable state only, so that a periodic steady state repeats
+# (not the open-loop schedules, whose action depends on the step, nor MPC, whose horizon shrinks towards the end
+# of the simulation & whose decisions depend on sampled sequences & on its time budget)
+stationary_policies = ["Rational", "QLearning", "LinearQ"]
+
 class TrainTest():
-    def __init__(self, env_param_dict: Dict, sim_param_dict: Dict, test_done_break: False):
+    def __init__(self, env_param_dict: Dict, sim_param_dict: Dict, test_done_break: False, exact=False):
 
         # Set simulation parameters from `sim_param_dict``
         self.set_params(sim_param_dict)
+        self.sim_param_dict = sim_param_dict
         self.test_done_break = test_done_break
+        self.env_param_dict = env_param_dict
+
+        # whether to integrate the full model until the end of the simulation, 
+        # even when it has reached a periodic steady state or a species is extinct
+        self.exact = exact
 
         # Bacterial environment
         self.env = BacterialEnv(env_param_dict, step_time = self.env_step_time,
                                 reward_func = self.reward_func, reward_kwargs = self.reward_kwargs)
+        self.env.reduce_extinct = not exact
+        if self.decision_events is not None:
+            self.env.max_interval = self.decision_events['max_interval']
+            self.env.D_threshold = self.decision_events.get('D_threshold')
 
         # Controller agent
         self.agent = None
         
         # Cummulative return the controller receive
         self.e_return = 0.0
+
+        # Recorder of the transitions experienced by a Q-learning agent, not recording if None
+        self.recorder = None
+
+        # Surrogate of the env to train on, training on the ODE model if None
+        self.surrogate_env = None
+
+        # Q-learning agents of other state discretizations, trained off-policy on the transitions of the agent (by name)
+        self.resolution_agents = {}
     
     def set_params(self, param_dict: Dict) -> None:
         '''
@@ -37,6 +68,9 @@ class TrainTest():
         self.reward_func = param_dict['reward_func'] # name of the reward function
         self.reward_kwargs = param_dict['reward_kwargs'] # kwargs for the reward function
 
+        # event-triggered decisions: {"max_interval": float, "D_threshold": float or None}, every `env_step_time` if None
+        self.decision_events = param_dict.get('decision_events')
+
     def test_rational(self, Din = 100.0, drug_time = 60.0*3) -> None:
         
         self.agent = RationalAgent(Din = Din, drug_time = drug_time)
@@ -44,7 +78,48 @@ class TrainTest():
 
         self.simulate(sim_time=self.simulation_time, done_break = self.test_done_break)
     
-    def set_QLearning_agent(self, param_dict: Dict) -> None:
+    def test_optimal_control(self, drug_time = 60.0*3, maxiter=200) -> np.ndarray:
+        '''
+        Optimizes a schedule of "flow in" drug concentrations (one per step) on the ODE model by gradients,
+        then simulates it
+        Returns:
+            schedule (numpy array): the optimized schedule
+        '''
+        self.env.reset_2_equilibria(eq_type=self.reset_type)
+        schedule, _, _ = optimize_schedule(self.env, self.simulation_time, drug_time, maxiter = maxiter)
+
+        self.agent = ScheduleAgent(schedule, drug_time = drug_time)
+        self.env.reset_state_method(state_method = 'cont_E', n_states = None)
+
+        self.simulate(sim_time=self.simulation_time, done_break = self.test_done_break)
+
+        return schedule
+    
+    def test_MPC(self, param_dict: Dict, seed=None) -> None:
+        '''
+        Simulates the receding-horizon controller (see `MPCAgent`), which scores its rollouts by reward function "minED"
+        Parameters:
+            param_dict (dictionary): parameters of the controller, as in the experiment param file
+            seed (None, int or SeedSequence): seed of the sampling of sequences, if sampled
+        '''
+        if self.reward_func != "minED":
+            raise ValueError("MPC controller only supports reward function \"minED\"")
+
+        self.agent = MPCAgent(self.env_param_dict, self.env_step_time, self.reward_kwargs,
+                              Din_options = tuple(param_dict['Din_options']), drug_time = param_dict['drug_time'],
+                              horizon = param_dict.get('horizon', 3), n_sequences = param_dict.get('n_sequences'),
+                              time_budget = param_dict.get('time_budget'), gamma = param_dict.get('gamma', 1.0),
+                              max_step = param_dict.get('max_step', self.env.max_step), seed = seed)
+        self.env.reset_state_method(state_method = 'cont_E', n_states = None)
+
+        self.simulate(sim_time=self.simulation_time, done_break = self.test_done_break)
+
+    def set_QLearning_agent(self, param_dict: Dict, seed=None) -> None:
+        
+        self.agent = self.new_QLearning_agent(param_dict, seed = seed)
+        self.agent_param_dict = param_dict
+    
+    def new_QLearning_agent(self, param_dict: Dict, seed=None) -> QLearningAgent:
         n_states = param_dict['n_states']
         n_actions = param_dict['n_actions']
         n_states_dimensions = param_dict['n_states_dimensions']
@@ -55,21 +130,97 @@ class TrainTest():
         gamma = param_dict['gamma']
         alpha = param_dict['alpha']
         
-        self.agent = QLearningAgent(n_states, n_actions, n_states_dimensions,
-                                    Din_options, drug_time, 
-                                    gamma, alpha)
+        return QLearningAgent(n_states, n_actions, n_states_dimensions,
+                              Din_options, drug_time, 
+                              gamma, alpha, seed = seed)
     
-    def is_agent_QLearning(self) -> None:
+    def set_LinearQ_agent(self, param_dict: Dict, seed=None) -> None:
+        n_actions = param_dict['n_actions']
+        Din_options = tuple(param_dict['Din_options'])
+        drug_time = param_dict['drug_time']
+
+        n_centers = tuple(param_dict.get('n_centers', (6, 6, 6)))
+        growth_bounds = tuple(param_dict.get('growth_bounds', (0.0, 0.5)))
+        D_bounds = tuple(param_dict.get('D_bounds', (0.0, 200.0)))
+        
+        gamma = param_dict['gamma']
+        alpha = param_dict['alpha']
+
+        self.agent = LinearQAgent(n_actions, Din_options, 
+                                  n_centers, growth_bounds, D_bounds,
+                                  drug_time, gamma, alpha, seed = seed)
+    
+    def set_resolutions(self, param_dict: Dict, resolutions: List[Dict]) -> None:
+        '''
+        Sets Q-learning agents of other state discretizations, which are trained together with the agent:
+        they learn off-policy from the transitions of the agent, so no simulation is added for them
+        Parameters:
+            param_dict (dictionary): parameters of the agent, as in the experiment param file
+            resolutions (list of dictionaries): "n_states" & "n_states_dimensions" of every other discretization
+        '''
+        self.resolution_agents = {}
+        for res in resolutions:
+            agent_param_dict = dict(param_dict, **res)
+            self.resolution_agents[resolution_name(agent_param_dict)] = self.new_QLearning_agent(agent_param_dict)
+    
+    def resolution_states(self) -> Dict:
+        '''
+        Returns the current state of the env as observed by every agent of `resolution_agents`
+        '''
+        E, Z = self.env.sSol[-1, :1], self.env.sSol[-1, 1:2]
+
+        return {name: int(discretize_state(E, Z, agent.state_method, agent.n_states, self.env.growth_bounds)[0]) 
+                for name, agent in self.resolution_agents.items()}
+    
+    def set_transition_recorder(self, filename: str, append=False) -> None:
+        '''
+        Starts recording the transitions of every following simulation to a dataset file, for offline training
+        Parameters:
+            filename (str): name of the dataset files (without extension)
+            append (bool): whether to append to an existing dataset
+        '''
+        self.is_agent_QLearning()
+        if self.agent.type_name != 'QLearning':
+            raise RuntimeError('Transitions can only be recorded for the QLearning agent (discrete states).')
         
+        self.recorder = TransitionRecorder(filename, self.agent.n_states, self.agent.n_actions, 
+                                           self.agent.Din_options, append = append)
+    
+    def set_surrogate(self, surrogate_file: str, exact_fraction=0.0, seed=None) -> None:
+        '''
+        Trains on a tabulated surrogate of the env (see `polin.surrogate`) instead of the ODE model, testing stays exact
+        Parameters:
+            surrogate_file (str): name of the surrogate files (without extension)
+            exact_fraction (float): fraction of the training steps simulated exactly, to measure the errors of the surrogate
+            seed: seed of the random choice of the exact steps
+        '''
+        if self.decision_events is not None:
+            raise ValueError("The surrogate of the env only tabulates steps of `env_step_time`, not event-triggered decisions")
+
+        self.surrogate_env = SurrogateBacterialEnv(surrogate_file, self.env_param_dict, step_time = self.env_step_time,
+                                                   reward_func = self.reward_func, reward_kwargs = self.reward_kwargs,
+                                                   exact_fraction = exact_fraction, seed = seed)
+        self.surrogate_env.reduce_extinct = self.env.reduce_extinct
+    
+    def is_agent_QLearning(self) -> None:
+        '''
+        Checks that the agent is a learning agent: tabular (QLearning) or with linear function approximation (LinearQ)
+        '''
         if self.agent is None:
             raise RuntimeError('Agent is not set. Please run method: set_QLearning_agent.')
-        elif self.agent.type_name != 'QLearning':
+        elif self.agent.type_name not in ['QLearning', 'LinearQ']:
             raise RuntimeError('Agent is not QLearning. Please run method: set_QLearning_agent.')
         
         return True
     
     def train_Qlearing(self, n_episodes: int, decay: float, 
-                       episode_time_max: float, exp_dir: str) -> None:
+                       episode_time_max: float, exp_dir: str, progress=None, max_explore_rate=1.0) -> None:
+        '''
+        Trains the Q-learning agent, saving its values after every episode
+        Parameters (besides the training params):
+            progress (callable or None): called with the number of episodes completed after every episode, if given
+            max_explore_rate (float): highest explore rate of the schedule, lower for agents warm-started from learned values
+        '''
 
         self.is_agent_QLearning()
 
@@ -82,19 +233,28 @@ class TrainTest():
         if not os.path.exists(qtable_dir):
             os.mkdir(qtable_dir)
 
-        qtable_filename = qtable_dir + 'QLearningAgent_values.ep'
+        qtable_filename = sim_data.values_filename(exp_dir, self.agent.type_name)
+
+        resolution_filenames = {}
+        for name in self.resolution_agents:
+            os.makedirs(resolution_dir(exp_dir, name) + 'learned_qtables/', exist_ok=True)
+            resolution_filenames[name] = resolution_dir(exp_dir, name) + 'learned_qtables/QLearningAgent_values.ep'
 
         with open(perf_filename, 'w') as pf:
             pf.write(f'episode\texplore_rate\te_return\tt5p_first\ttTiny_first\ttotal_drug_in')
 
-        state_method = 'disc_E' if self.agent.n_states_dimensions == 1 else 'disc_EZ'
-        self.env.reset_state_method(state_method = state_method, n_states = self.agent.n_states)
+        # the ODE model is set back for testing after training
+        test_env = self.env
+        if self.surrogate_env is not None:
+            self.env = self.surrogate_env
+
+        self.env.reset_state_method(state_method = self.agent.state_method, n_states = self.agent.n_states)
 
         print(f"Training for {n_episodes} episodes ...\n")
 
         for episode in range(n_episodes):
 
-            explore_rate = self.agent.get_rate(episode, decay)
+            explore_rate = self.agent.get_rate(episode, decay, max_r = max_explore_rate)
 
             self.simulate(sim_time = episode_time_max, done_break = True, 
                           explore_rate = explore_rate, training = True)
@@ -102,6 +262,10 @@ class TrainTest():
             with open(qtable_filename + str(episode) + '.npy', 'wb') as f:
                 np.save(f, self.agent.values)
             
+            for name, agent in self.resolution_agents.items():
+                with open(resolution_filenames[name] + str(episode) + '.npy', 'wb') as f:
+                    np.save(f, agent.values)
+            
             t5p_first = self.env.t5p[0] if len(self.env.t5p) > 0 else "N/A"
             tTiny_first = self.env.tTiny[0] if len(self.env.tTiny) > 0 else "N/A"
             with open(perf_filename, 'a') as pf:
@@ -109,6 +273,43 @@ class TrainTest():
             
             if episode % 10 == 0:
                 print(f'episode: {episode} \t| explore_rate: {round(explore_rate, 3)} \t| return: {round(self.e_return, 3)}')
+            
+            if progress is not None:
+                progress(episode + 1)
+        
+        self.env = test_env
+    
+    def train_Qlearing_async(self, n_episodes: int, decay: float, episode_time_max: float, exp_dir: str,
+                             n_workers: int, max_explore_rates=None, seed=None, progress=None) -> Dict:
+        '''
+        Trains the Q-learning agent with `n_workers` processes updating its Q-table in shared memory (see `polin.async_train`),
+        from its current values, saving the values after every episode
+        Parameters (besides the training params):
+            n_workers (int): number of worker processes, each simulating its own env
+            max_explore_rates (list of float or None): highest explore rate of the schedule of every worker, 1.0 if None
+            seed: seed of the exploration of the workers
+            progress (callable or None): called with the number of episodes completed, if given
+        Returns:
+            stats (dict): number of transitions, training time & transitions per second
+        '''
+        self.is_agent_QLearning()
+
+        if self.agent.type_name != 'QLearning':
+            raise RuntimeError('Asynchronous training is only applicable to QLearning agents')
+        if self.surrogate_env is not None or self.recorder is not None or len(self.resolution_agents) > 0:
+            raise RuntimeError('Asynchronous training does not support surrogates, transition recording nor other resolutions')
+        
+        print(f"Training for {n_episodes} episodes with {n_workers} workers ...\n")
+
+        values, stats = train_async(self.agent.values, self.env_param_dict, self.sim_param_dict, self.agent_param_dict,
+                                    n_episodes, decay, episode_time_max, exp_dir, n_workers,
+                                    max_explore_rates = max_explore_rates, exact = self.exact, seed = seed,
+                                    progress = progress)
+        self.agent.set_values(values)
+
+        print(f"{stats['n_transitions']} transitions in {round(stats['seconds'], 1)} s ({round(stats['transitions_per_s'], 2)} transitions/s)")
+
+        return stats
     
     def test_QLearning(self, learned_qtable_file=None, explore_rate=0.0) -> None:
         
@@ -121,8 +322,7 @@ class TrainTest():
 
         print(f'\nTesting on agent with Q-table:\n{self.agent.values}\n')
         
-        state_method = 'disc_E' if self.agent.n_states_dimensions == 1 else 'disc_EZ'
-        self.env.reset_state_method(state_method = state_method, n_states = self.agent.n_states)
+        self.env.reset_state_method(state_method = self.agent.state_method, n_states = self.agent.n_states)
 
         self.simulate(sim_time = self.simulation_time, done_break = self.test_done_break, 
                       explore_rate = explore_rate, training = False)
@@ -139,49 +339,116 @@ class TrainTest():
     def simulate(self, sim_time: float, done_break: bool, 
                  explore_rate=0.0, training=False) -> None:
 
+        # the trajectory is only recorded when testing (for export & fast-forwarding), training keeps the current state
+        self.env.keep_history = not training
+
         # reset the env
         self.env.reset_2_equilibria(eq_type=self.reset_type)
         state = self.env.state
+
+        train_resolutions = training and len(self.resolution_agents) > 0
+        if train_resolutions:
+            resolution_states = self.resolution_states()
+
+        if self.agent.type_name == "Schedule":
+            self.agent.reset()
         
-        # reset the cumulative return
+        # reset the cumulative return & the number of steps
         self.e_return = 0.0
+        self.n_steps = 0
 
         while self.env.tSol[-1] < sim_time:
             
-            if self.agent.type_name == "QLearning":
+            if self.agent.type_name in ["QLearning", "LinearQ"]:
                 action_index, action = self.agent.get_action(state, explore_rate)
             
-            if self.agent.type_name == "Rational":
+            if self.agent.type_name in ["Rational", "Schedule"]:
                 action = self.agent.get_action(state)
             
+            if self.agent.type_name == "MPC":
+                action = self.agent.get_action(self.env, sim_time)
+            
+            if self.decision_events is not None: # steps are not extended past the end of the simulation
+                self.env.max_interval = max(self.env.step_time, min(self.decision_events['max_interval'], sim_time - self.env.tSol[-1]))
+
             next_state, reward, done = self.env.step(action)
+            self.n_steps += 1
+
+            # semi-MDP: with event-triggered decisions, the next state is discounted per elapsed `step_time`
+            discount = None
+            if training and self.decision_events is not None:
+                discount = self.agent.gamma ** (self.env.step_duration / self.env.step_time)
 
             if training:
                 transition = (state, action_index, reward, next_state, done)
-                self.agent.update_values(transition)
+                self.agent.update_values(transition, discount)
+
+            if train_resolutions:
+                next_resolution_states = self.resolution_states()
+                for name, agent in self.resolution_agents.items():
+                    agent.update_values((resolution_states[name], action_index, reward, next_resolution_states[name], done), discount)
+                resolution_states = next_resolution_states
+            
+            if self.recorder is not None:
+                self.recorder.record(state, action_index, next_state, 
+                                     self.env.sSol[-1, 0] / self.env.sSol[0, 0], action[0],
+                                     duration = self.env.step_duration / self.env.step_time)
 
             state = next_state
             self.e_return += reward
 
             if done & done_break:
                 break
+            
+            # under a deterministic stationary policy, a periodic steady state repeats until the end of the simulation
+            if (not (training or self.exact) and explore_rate == 0.0 and self.recorder is None
+                    and self.agent.type_name in stationary_policies):
+                period = self.env.find_period()
+                if period is not None:
+                    step_time = self.env.step_time
+                    if self.decision_events is not None: # mean duration of the steps of the cycle
+                        step_time = (self.env.tSol[-1] - self.env.tSol[self.env.step_ends[-1 - period]]) / period
+                    n_steps = int(np.ceil(round((sim_time - self.env.tSol[-1]) / step_time, 9)))
+                    for reward, done in self.env.fast_forward(period, n_steps):
+                        self.e_return += reward
+                    break
+        
+        if self.recorder is not None:
+            self.recorder.flush()
+            self.recorder.episode += 1
     
-    def export_env_data(self, output_filename):
-        output_file = output_filename + ".tsv"
+    def export_env_data(self, output_filename, export_format='npy', dtype='float64'):
+        '''
+        Writes the simulation data of the env to file
+        Parameters:
+            output_filename (str): name of the output file (without extension)
+            export_format (str): "npy" for a binary file (memory-mappable, with a JSON header), 
+                                 "tsv" for a text file with 5 decimals
+            dtype (str): "float64" or "float32", only applicable to the binary file
+        '''
+        if export_format == 'npy':
+            header = {'actions': self.env.actions.tolist(),
+                      't5p': self.env.t5p.tolist(),
+                      'tTiny': self.env.tTiny.tolist(),
+                      'total_drug_in': self.env.total_drug_in}
+            
+            sim_data.export_binary(output_filename, self.env.tSol, self.env.sSol, 
+                                   header = header, dtype = dtype)
+            return
+        
+        output_file = sim_data.env_data_file(output_filename, export_format)
         header = "t\tE\tZ\tM\tD"
 
         n = len(self.env.tSol)
-        output = np.reshape(self.env.tSol, [n, 1])
-
-        EnZ = self.env.sSol[:, :2]
-        output = np.append(output, EnZ, axis=1)
-
-        M = np.reshape(self.env.sSol[:, 0] + self.env.sSol[:, 1], [n, 1])
-        output = np.append(output, M, axis=1)
-
-        D = np.reshape(self.env.sSol[:, -1], [n, 1])
-        output = np.append(output, D, axis=1)
+        output = np.empty((n, 5))
+        output[:, 0] = self.env.tSol
+        output[:, 1:3] = self.env.sSol[:, :2]
+        output[:, 3] = self.env.sSol[:, 0] + self.env.sSol[:, 1]
+        output[:, 4] = self.env.sSol[:, -1]
 
         np.savetxt(output_file, output, 
                    delimiter="\t", fmt='%.5f',
-                   header=header, comments='')
\ No newline at end of file
+                   header=header, comments='')
+        
+        # actions are needed to re-make the simulation figure from file
+        sim_data.export_actions(output_filename, self.env.actions)
\ No newline at end of file
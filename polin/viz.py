@@ -1,3 +1,4 @@
+from typing import List, Dict, Tuple
 import numpy as np
 import pandas as pd
 
@@ -23,7 +24,25 @@ def set_plot_style():
     legnd = {'fontsize': 20, 'handlelength': 1.5}
     plt.rc('legend', **legnd)
 
-def visualize_train(train_perf_file: str, episode_time_max: float) -> plt.figure:
+def reuse_figure(fig: plt.figure, n_axes: int) -> List:
+    '''
+    Clears a figure made earlier by one of the plotting functions, so it can be used as a template for a new plot
+    Parameters:
+        fig: matplotlib figure object to reuse
+        n_axes (int): number of axes created with the figure, any axes added afterwards (e.g. by `twinx`) are removed
+    Returns:
+        ax: list of the cleared axes
+    '''
+    for a in fig.axes[n_axes:]:
+        a.remove()
+    
+    ax = fig.axes
+    for a in ax:
+        a.clear()
+    
+    return ax
+
+def visualize_train(train_perf_file: str, episode_time_max: float, fig=None) -> plt.figure:
         set_plot_style()
         mathtext = {'mathtext.default': 'it' } 
         plt.rcParams.update(mathtext)
@@ -31,9 +50,12 @@ def visualize_train(train_perf_file: str, episode_time_max: float) -> plt.figure
 
         df = pd.read_csv(train_perf_file, sep='\t')
         
-        fig, ax = plt.subplots(1, 5, figsize=(7.5*4, 5.5),
-                               gridspec_kw={'width_ratios': [0.12, 0.0, 0.12, 0.12, 0.12], 
-                                            'wspace': 0.4})
+        if fig is None:
+            fig, ax = plt.subplots(1, 5, figsize=(7.5*4, 5.5),
+                                   gridspec_kw={'width_ratios': [0.12, 0.0, 0.12, 0.12, 0.12], 
+                                                'wspace': 0.4})
+        else:
+            ax = reuse_figure(fig, n_axes=5)
         ax[1].axis('off')
 
         line_w = 0.0
@@ -95,14 +117,17 @@ def visualize_train(train_perf_file: str, episode_time_max: float) -> plt.figure
         return fig
 
 def visualize_simulation(env, st='full', 
-                         tscale=60.0, title='auto') -> plt.figure:
+                         tscale=60.0, title='auto', fig=None) -> plt.figure:
         set_plot_style()
         mathtext = {'mathtext.default': 'it' } 
         plt.rcParams.update(mathtext)
 
-        fig, ax = plt.subplots(3,1, figsize=(7, 12), 
-                                sharex=True,
-                                gridspec_kw={'height_ratios': [0.15, 0.15, 0.7]})
+        if fig is None:
+            fig, ax = plt.subplots(3,1, figsize=(7, 12), 
+                                    sharex=True,
+                                    gridspec_kw={'height_ratios': [0.15, 0.15, 0.7]})
+        else:
+            ax = reuse_figure(fig, n_axes=3)
 
         # time points
         t = env.tSol / tscale if st == 'full' else env.tSol[env.tSol <= st] / tscale
@@ -0,0 +1,71 @@
+from parallel_experiments import ExperimentsCollection
+from polin.evaluation import rational_grid, pareto_front
+from polin.sim_cache import SimulationCache
+
+import pandas as pd
+
+import os
+import argparse
+from copy import deepcopy
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Evaluating a grid of rational policies (Din x drug_time) over the interaction coefficients of a collection, in batched simulations")
+
+    parser.add_argument("-f", "--collection_param_file", type=str, required=True) # the controller settings of the file are not used
+
+    parser.add_argument("-Din", "--Din_options", type=float, nargs='+',
+                        default=[20.0, 40.0, 60.0, 80.0, 100.0, 120.0], required=False)
+    parser.add_argument("-dt", "--drug_time_options", type=float, nargs='+',
+                        default=[60.0, 120.0, 180.0, 240.0, 300.0, 360.0], required=False)
+
+    parser.add_argument("-tdb", "--test_done_break", action='store_true') # default is False
+
+    parser.add_argument("-bs", "--batch_size", type=int,
+                        default=256, required=False) # number of envs simulated together
+    parser.add_argument("-n", "--n_workers", type=int,
+                        default=1, required=False)
+
+    parser.add_argument("--no_cache", action='store_true') # default is False, if given the simulation cache is not used
+
+    args = parser.parse_args()
+
+    collection = ExperimentsCollection(args.collection_param_file)
+
+    # same collection directory as set by `parallel_experiments.py`
+    if not os.path.exists(collection.collection_dir):
+        os.mkdir(collection.collection_dir)
+
+    # one env parameter set per pair of interaction coefficients, in the order of `parallel_experiments.py`
+    alphas = []
+    env_param_dicts = []
+    for a1 in collection.alpha_EZ_arr:
+        for a2 in collection.alpha_ZE_arr:
+            env_param_dict = deepcopy(collection.param_dict['env'])
+            env_param_dict['ode_params']['alpha_EZ'] = a1
+            env_param_dict['ode_params']['alpha_ZE'] = a2
+            env_param_dicts.append(env_param_dict)
+            alphas.append((a1, a2))
+
+    n_settings = len(args.Din_options) * len(args.drug_time_options)
+    print(f"Evaluating {n_settings} rational policies x {len(env_param_dicts)} pairs of interaction coefficients ...\n")
+
+    df = rational_grid(env_param_dicts, args.Din_options, args.drug_time_options,
+                       collection.param_dict['simulation'], done_break = args.test_done_break,
+                       batch_size = args.batch_size, n_workers = args.n_workers,
+                       cache = None if args.no_cache else SimulationCache())
+
+    alphas = pd.DataFrame(alphas, columns=['alpha_EZ', 'alpha_ZE'])
+    df = pd.concat([alphas.loc[df['env_index']].reset_index(drop=True), df.drop(columns=['env_index'])], axis=1)
+
+    output_file = collection.collection_dir + "rational_sweep.tsv"
+    df.to_csv(output_file, sep='\t', index=False, na_rep='N/A')
+
+    # time to clearance vs. total drug, per pair of interaction coefficients
+    front = pd.concat([pareto_front(g) for _, g in df.groupby(['alpha_EZ', 'alpha_ZE'], sort=False)])
+
+    front_file = collection.collection_dir + "rational_pareto.tsv"
+    front.to_csv(front_file, sep='\t', index=False, na_rep='N/A')
+
+    print(f"Results written to {output_file}, Pareto fronts (tTiny_first vs. total_drug_in) to {front_file}")
+    print("Done")
@@ -0,0 +1,39 @@
+from polin.render import render_collection
+
+import json
+import os
+import argparse
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Re-making the figures of a collection of experiments from their stored results, without re-simulating")
+
+    parser.add_argument("-f", "--collection_param_file", type=str, required=True)
+
+    parser.add_argument("-tqe", "--test_qtable_episode",
+                        default='last', required=False)
+    parser.add_argument("-tsf", "--test_savefig_format", type=str,
+                        default='png', required=False)
+
+    parser.add_argument("-n", "--n_workers", type=int,
+                        default=None, required=False) # default is the number of CPUs
+    parser.add_argument("--force", action='store_true') # default is False, i.e. up-to-date figures are skipped
+
+    args = parser.parse_args()
+
+    with open(args.collection_param_file) as f:
+        collection_ID = json.load(f)['collection_ID']
+
+    # same collection directory as set by `parallel_experiments.py`
+    collection_dir = os.getcwd() + '/' + collection_ID + '/'
+
+    print(f"Rendering figures of collection {collection_ID} ...\n")
+
+    counts = render_collection(collection_dir,
+                               savefig_format = args.test_savefig_format,
+                               qtable_episode = args.test_qtable_episode,
+                               force = args.force,
+                               n_workers = args.n_workers)
+
+    print(f"Rendered: {counts['rendered']} \t| Up to date: {counts['skipped']} \t| No stored results: {counts['missing']} \t| Failed experiments: {counts['failed']}")
+    print("Done")
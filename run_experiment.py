@@ -1,5 +1,11 @@
 from polin.train_test import TrainTest
 import polin.viz as viz
+from polin.result_store import ResultStore
+from polin.job_status import JobStatusStore
+from polin.controller import seed_sequence, seed_dict
+from polin.sim_cache import SimulationCache, CachedSimulation, cache_key
+import polin.sim_data as sim_data
+from polin.evaluation import sweep_experiment, best_checkpoint, resolution_name, resolution_dir, resolution_report
 
 from typing import List, Dict, Tuple
 import numpy as np
@@ -8,14 +14,57 @@ import json
 import os
 import argparse
 
+def simulation_key(param_dict: Dict, test_done_break=False, exact=False) -> str:
+    '''
+    Returns the key of the testing simulation of an experiment in the simulation cache (see `polin.sim_cache`),
+    None if it is not cached: only the deterministic simulations of Rational & OptimalControl controllers are
+    '''
+    controller_dict = param_dict['controller']
+    if controller_dict['type_name'] == 'Rational':
+        controller_spec = {'type_name': 'Rational', 'Din': controller_dict['Din'], 'drug_time': controller_dict['drug_time']}
+    elif controller_dict['type_name'] == 'OptimalControl':
+        controller_spec = {'type_name': 'OptimalControl', 'drug_time': controller_dict['drug_time'], 
+                           'maxiter': controller_dict.get('maxiter', 200)}
+    else:
+        return None
+    
+    return cache_key(param_dict['env'], param_dict['simulation'], controller_spec, 
+                     {'test_done_break': test_done_break, 'exact': exact})
+
+def exported_simulation(output_filename: str, cached: CachedSimulation, metrics: Dict, env_param_dict: Dict,
+                        export_format='npy', export_dtype='float64'):
+    '''
+    Returns the full trajectory of a cached simulation (the cache only holds a downsampled one), read from the export
+    of a previous run of the experiment, as a `CachedSimulation`. None if there is no export in this format & dtype,
+    or if it is not of this simulation (other actions or end state)
+    '''
+    data_file = sim_data.env_data_file(output_filename, export_format)
+    if not os.path.exists(data_file):
+        return None
+    if export_format == 'npy' and sim_data.load_header(output_filename)['dtype'] != export_dtype:
+        return None
+
+    # read into memory, as the export is written again
+    sim = sim_data.load_env_data(output_filename, env_param_dict, mmap = False)
+
+    # exported actions & states are rounded to 5 decimals in text files
+    same = (sim.actions.shape == cached.actions.shape and np.allclose(sim.actions, cached.actions, rtol=1e-5, atol=1e-5)
+            and np.allclose(sim.tSol[-1], cached.tSol[-1], rtol=1e-5, atol=1e-5)
+            and np.allclose(sim.sSol[-1], cached.sSol[-1], rtol=1e-5, atol=1e-5))
+    if not same:
+        return None
+
+    return CachedSimulation(np.array(sim.tSol, dtype=float), np.array(sim.sSol, dtype=float), metrics, env_param_dict)
+
 class Experiment():
     def __init__(self, exp_param_file: str) -> None:
         
-        self.defined_controllers = ["Rational", "QLearning"]
+        self.defined_controllers = ["Rational", "QLearning", "LinearQ", "OptimalControl", "MPC"]
 
         with open(exp_param_file) as f:
             param_dict = json.load(f)
         
+        self.param_dict = param_dict
         self.set_params(param_dict)
 
     def set_params(self, param_dict: Dict) -> None:
@@ -35,18 +84,43 @@ class Experiment():
         if self.controller_type not in self.defined_controllers:
             raise ValueError(f'Controller type name should be in this list: {self.defined_controllers}')
 
-        if self.controller_type == 'QLearning':
+        if self.controller_type in ['QLearning', 'LinearQ']:
             
             self.QLearningAgent_param_dict = controller_dict['agent']
 
+            # seed of the random generator of the agent, fresh entropy if not given (it is recorded in `rng_seed.json`)
+            self.seed = seed_sequence(controller_dict.get('seed'))
+
             self.n_episodes = controller_dict['training']['n_episodes']
             self.decay = controller_dict['training']['decay']
             self.episode_time_max = controller_dict['training']['episode_time_max']
+
+            # asynchronous training by several workers on a shared Q-table (QLearning only), with their own exploration
+            self.n_workers = controller_dict['training'].get('n_workers', 1)
+            self.max_explore_rates = controller_dict['training'].get('max_explore_rates')
+
+            # initial values from learned ones (averaged), with a shortened exploration schedule (see `parallel_experiments.py`)
+            self.warm_start = controller_dict.get('warm_start')
+
+            # other state discretizations trained off-policy on the same simulations (QLearning only)
+            self.resolutions = controller_dict.get('resolutions')
+            if self.resolutions is not None and self.controller_type != 'QLearning':
+                raise ValueError("Training several resolutions is only applicable to QLearning controllers")
         
         elif self.controller_type == 'Rational':
             self.Din = controller_dict['Din']
             self.drug_time = controller_dict['drug_time']
         
+        elif self.controller_type == 'OptimalControl':
+            self.drug_time = controller_dict['drug_time']
+            self.maxiter = controller_dict.get('maxiter', 200)
+        
+        elif self.controller_type == 'MPC':
+            self.MPC_param_dict = controller_dict
+
+            # seed of the sampling of sequences (if sampled), recorded in `rng_seed.json` as for Q-learning
+            self.seed = seed_sequence(controller_dict.get('seed'))
+        
         self.pwd = os.getcwd() + '/'
         self.exp_dir = self.pwd + self.exp_ID + '/'
         if not os.path.exists(self.exp_dir):
@@ -54,27 +128,129 @@ class Experiment():
     
     def run(self, test_only=False, test_done_break=False, 
             test_qtable_episode='last', test_explore_rate=0.0, 
-            test_savefig_format = 'png') -> None:
+            test_savefig_format = 'png', 
+            export_format = 'npy', export_dtype = 'float64',
+            result_store = None, record_transitions = False, exact = False, job_status = None,
+            surrogate = None, surrogate_exact_fraction = 0.0, use_cache = True) -> None:
         '''
         Runs the experiment
+        Parameters (the ones not passed on to the command line options, see below):
+            result_store (str or None): path to the collection result store to append the results to, if given
+            record_transitions (bool): whether to record the transitions of training & testing to `transitions.bin`,
+                                       for offline training (QLearning controller only)
+            exact (bool): whether to always integrate the full model, instead of using reduced models once a species is extinct
+                          & extrapolating the testing simulation once it reaches a periodic steady state
+            job_status (JobStatusStore or None): collection job status to update with the state & training progress, if given
+            surrogate (str or None): name of the surrogate files of the env to train on (see `build_surrogate.py`), if given
+            surrogate_exact_fraction (float): fraction of the training steps simulated exactly to measure the errors of the surrogate,
+                                              which are written to `surrogate_check.json`
+            use_cache (bool): whether to look up the simulation of a Rational or OptimalControl controller in the simulation cache
+                              (see `polin.sim_cache`) first, & cache it otherwise. The cache holds a downsampled trajectory,
+                              so a cached simulation is only used if the experiment has the full one exported by a previous run
         '''
         if test_qtable_episode != 'last' and test_qtable_episode > (self.n_episodes - 1):
                 raise ValueError("test_qtable_episode should not >= number of episodes")
         
-        tt = TrainTest(self.env_param_dict, self.sim_param_dict, test_done_break = test_done_break)
+        if job_status is not None:
+            n_train = self.n_episodes if self.controller_type in ['QLearning', 'LinearQ'] and not test_only else 0
+            job_status.start(self.exp_ID, n_train)
+            job_status.start_heartbeat(self.exp_ID)
+        
+        tt = TrainTest(self.env_param_dict, self.sim_param_dict, test_done_break = test_done_break, exact = exact)
+
+        # deterministic simulations are shared through the simulation cache
+        cache, cached = None, None
+        key = simulation_key(self.param_dict, test_done_break, exact) if use_cache else None
+        if key is not None:
+            cache = SimulationCache()
+            cached = cache.get_simulation(key, self.env_param_dict)
+
+            # the cached trajectory is downsampled, the full one is taken from the export of a previous run
+            if cached is not None:
+                full = exported_simulation(self.exp_dir + "testing." + self.exp_ID, cached[0], cached[1], self.env_param_dict,
+                                           export_format, export_dtype)
+                if full is None:
+                    print("Simulation found in the cache, but not its full trajectory: simulating\n")
+                    cached = None
+                else:
+                    cached = (full, cached[1])
+        
+        if cached is not None:
+
+            print("Simulation found in the cache, with the trajectory of the previous export\n")
+            tt.env, metrics = cached
+            tt.e_return = metrics['e_return']
+            schedule = metrics.get('schedule')
         
-        if self.controller_type == 'Rational':
+        elif self.controller_type == 'Rational':
             
             tt.test_rational(Din=self.Din, drug_time=self.drug_time)
         
+        elif self.controller_type == 'OptimalControl':
+
+            schedule = tt.test_optimal_control(drug_time=self.drug_time, maxiter=self.maxiter)
+        
+        elif self.controller_type == 'MPC':
+
+            tt.test_MPC(self.MPC_param_dict, seed = self.seed)
+
+            with open(self.exp_dir + 'rng_seed.json', 'w') as f:
+                json.dump(seed_dict(self.seed), f, indent=4)
+
+            # the horizon actually simulated within the time budget, per decision
+            with open(self.exp_dir + "mpc_decisions." + self.exp_ID + ".tsv", 'w') as f:
+                f.write('t\tDin\thorizon\tseconds')
+                for t, Din, horizon, seconds in tt.agent.decisions:
+                    f.write(f'\n{t}\t{Din}\t{horizon}\t{seconds}')
+        
         else:
 
-            tt.set_QLearning_agent(self.QLearningAgent_param_dict)
+            if self.controller_type == 'LinearQ':
+                tt.set_LinearQ_agent(self.QLearningAgent_param_dict, seed = self.seed)
+            else:
+                tt.set_QLearning_agent(self.QLearningAgent_param_dict, seed = self.seed)
+            
+            # the run can be reproduced by setting this as "seed" of the controller in the param file
+            with open(self.exp_dir + 'rng_seed.json', 'w') as f:
+                json.dump(seed_dict(self.seed), f, indent=4)
 
             perf_filename = self.exp_dir + 'training_performance.tsv'
 
+            if record_transitions:
+                tt.set_transition_recorder(self.exp_dir + 'transitions', append = test_only)
+
+            if surrogate is not None:
+                tt.set_surrogate(surrogate, exact_fraction = surrogate_exact_fraction, seed = self.seed.spawn(1)[0])
+
             if not test_only:
-                tt.train_Qlearing(self.n_episodes, self.decay, self.episode_time_max, self.exp_dir)
+                max_explore_rate = 1.0
+                if self.warm_start is not None:
+                    tt.agent.set_values(np.mean([np.load(f) for f in self.warm_start['qtable_files']], axis=0))
+                    max_explore_rate = self.warm_start.get('max_explore_rate', 1.0)
+
+                if self.resolutions is not None:
+                    self.set_resolutions(tt)
+
+                progress = (lambda ep: job_status.progress(self.exp_ID, ep)) if job_status is not None else None
+                if self.n_workers > 1:
+                    max_explore_rates = self.max_explore_rates or [max_explore_rate] * self.n_workers
+                    stats = tt.train_Qlearing_async(self.n_episodes, self.decay, self.episode_time_max, self.exp_dir,
+                                                    n_workers = self.n_workers, max_explore_rates = max_explore_rates,
+                                                    seed = self.seed.spawn(1)[0], progress = progress)
+                    with open(self.exp_dir + 'training_stats.json', 'w') as f:
+                        json.dump(stats, f, indent=4)
+                else:
+                    tt.train_Qlearing(self.n_episodes, self.decay, self.episode_time_max, self.exp_dir, 
+                                      progress = progress, max_explore_rate = max_explore_rate)
+
+                if self.resolutions is not None:
+                    df = resolution_report(self.exp_dir, self.param_dict, stride = self.resolutions.get('eval_stride', 10),
+                                           done_break = test_done_break)
+                    print(df[['resolution', 'e_return', 'best_episode', 'best_e_return', 'episodes_to_convergence']].to_string(index=False))
+
+                if surrogate is not None:
+                    with open(self.exp_dir + 'surrogate_check.json', 'w') as f:
+                        json.dump(tt.surrogate_env.error_summary(), f, indent=4)
             
             elif not os.path.exists(perf_filename):
                 raise RuntimeError('Training performance file does not exist. Please run training.')
@@ -85,16 +261,33 @@ class Experiment():
             
             ep = self.n_episodes - 1 if test_qtable_episode == 'last' else test_qtable_episode
 
-            learned_qtable_file = self.exp_dir + 'learned_qtables/QLearningAgent_values.ep' + str(ep) + '.npy'
+            learned_qtable_file = sim_data.values_filename(self.exp_dir, tt.agent.type_name, ep)
             tt.test_QLearning(learned_qtable_file = learned_qtable_file, 
                               explore_rate = test_explore_rate)
             
             # Plot policy of the Q-learning agent
-            fig_Qpolicy = tt.agent.visualize_policy(initE = tt.env.init_E, OD2state = tt.env.OD2state)
+            if self.controller_type == 'LinearQ':
+                fig_Qpolicy = tt.agent.visualize_policy(initE = tt.env.init_E, initZ = tt.env.init_Z)
+            else:
+                fig_Qpolicy = tt.agent.visualize_policy(initE = tt.env.init_E, OD2state = tt.env.OD2state)
             
             fig_Qpolicy_name = self.exp_dir + "Qpolicy." + self.exp_ID + "." + test_savefig_format
             fig_Qpolicy.savefig(fig_Qpolicy_name, bbox_inches='tight')
         
+        if self.controller_type == 'OptimalControl':
+
+            # the schedule can be replayed with `ScheduleAgent`
+            with open(self.exp_dir + "optimal_schedule." + self.exp_ID + ".tsv", 'w') as f:
+                f.write('step\tt\tDin')
+                for i, Din in enumerate(schedule):
+                    f.write(f'\n{i}\t{i * self.sim_param_dict["env_step_time"]}\t{Din}')
+        
+        if cache is not None:
+            if cached is None:
+                extra = {'schedule': list(schedule)} if self.controller_type == 'OptimalControl' else {}
+                cache.put_simulation(key, tt.env, tt.e_return, **extra)
+            cache.close()
+        
         # Plot testing results
         fig_test = viz.visualize_simulation(env = tt.env, st='full', tscale=60.0, title='none')      
         
@@ -105,10 +298,66 @@ class Experiment():
         test_pfname = self.exp_dir + "testing_perf." + self.exp_ID + ".tsv"
         with open(test_pfname, 'w') as pf:
             pf.write(f'exp_ID\te_return\tt5p\ttTiny\ttotal_drug_in')
-            pf.write(f'\n{self.exp_ID}\t{tt.e_return}\t{tt.env.t5p}\t{tt.env.tTiny}\t{tt.env.total_drug_in}')
+            # all the event times, on one line (numpy summarizes arrays over 1000 elements by default)
+            t5p, tTiny = [np.array2string(x, threshold=np.inf, max_line_width=np.inf) for x in [tt.env.t5p, tt.env.tTiny]]
+            pf.write(f'\n{self.exp_ID}\t{tt.e_return}\t{t5p}\t{tTiny}\t{tt.env.total_drug_in}')
         
         # Write simulation data to file
-        tt.export_env_data(output_filename = self.exp_dir + "testing." + self.exp_ID)
+        tt.export_env_data(output_filename = self.exp_dir + "testing." + self.exp_ID, 
+                           export_format = export_format, dtype = export_dtype)
+
+        # Append results to the collection result store
+        if result_store is not None:
+            store = ResultStore(result_store)
+            store.add_experiment(self.exp_ID, 
+                                 self.env_param_dict['ode_params']['alpha_EZ'], self.env_param_dict['ode_params']['alpha_ZE'],
+                                 self.controller_type, tt.e_return, tt.env.t5p, tt.env.tTiny, tt.env.total_drug_in,
+                                 params = self.param_dict)
+            store.add_trajectory(self.exp_ID, tt.env.tSol, tt.env.sSol)
+
+            if self.controller_type in ['QLearning', 'LinearQ']:
+                store.add_qtable(self.exp_ID, ep, tt.agent.values)
+                store.add_training(self.exp_ID, perf_filename)
+            
+            store.close()
+        
+        if job_status is not None:
+            job_status.finish(self.exp_ID)
+
+    
+    def set_resolutions(self, tt: TrainTest) -> None:
+        '''
+        Sets the other state discretizations to train alongside the agent, 
+        each with its param file (to evaluate its checkpoints as an experiment, e.g. by `sweep_checkpoints.py`)
+        '''
+        tt.set_resolutions(self.QLearningAgent_param_dict, self.resolutions['agents'])
+
+        for res in self.resolutions['agents']:
+            agent_param_dict = dict(self.QLearningAgent_param_dict, **res)
+            name = resolution_name(agent_param_dict)
+
+            param_dict = json.loads(json.dumps(self.param_dict))
+            param_dict['exp_ID'] = self.exp_ID + '.' + name
+            param_dict['controller']['agent'] = agent_param_dict
+            del param_dict['controller']['resolutions']
+
+            os.makedirs(resolution_dir(self.exp_dir, name), exist_ok=True)
+            with open(resolution_dir(self.exp_dir, name) + 'params.' + name + '.json', 'w') as f:
+                json.dump(param_dict, f, indent=4)
+    
+    def sweep_checkpoints(self, stride=1, test_done_break=False, batch_size=64) -> None:
+        '''
+        Evaluates the greedy policies of the saved Q-table checkpoints in batch, 
+        & writes the measurements to file `checkpoint_sweep.tsv` in the experiment directory
+        '''
+        if self.controller_type != 'QLearning':
+            raise ValueError("Checkpoint sweep is only applicable to QLearning controllers")
+        
+        df = sweep_experiment(self.exp_dir, stride = stride, done_break = test_done_break, batch_size = batch_size)
+        
+        best = best_checkpoint(df)
+        print(f"{len(df)} checkpoints evaluated ({df['policy_ID'].nunique()} distinct greedy policies)")
+        print(f"Best checkpoint: episode {int(best['episode'])} \t| return: {best['e_return']}")
 
 
 if __name__ == '__main__':
@@ -126,17 +375,66 @@ if __name__ == '__main__':
                         default=0.0, required=False)
     parser.add_argument("-tsf", "--test_savefig_format", type=str, 
                         default='png', required=False)
+    
+    parser.add_argument("-xf", "--export_format", type=str, choices=['npy', 'tsv'],
+                        default='npy', required=False)
+    parser.add_argument("-xd", "--export_dtype", type=str, choices=['float64', 'float32'],
+                        default='float64', required=False) # only applicable to "npy" format
+    
+    parser.add_argument("-rs", "--result_store", type=str, 
+                        default=None, required=False) # path to the collection result store
+    
+    parser.add_argument("-rt", "--record_transitions", action='store_true') # default is False
+    parser.add_argument("-js", "--job_status", type=str, 
+                        default=None, required=False) # path to the collection job status store
+    
+    parser.add_argument("-sg", "--surrogate", type=str, 
+                        default=None, required=False) # surrogate files (without extension) of the env to train on
+    parser.add_argument("-sgx", "--surrogate_exact_fraction", type=float, 
+                        default=0.0, required=False)
+    
+    parser.add_argument("--no_cache", action='store_true') # default is False, if given the simulation cache is not used
+    
+    parser.add_argument("--exact", action='store_true') # default is False, if given periodic steady states are not fast-forwarded & extinct species are not reduced
+    
+    parser.add_argument("-sc", "--sweep_checkpoints", action='store_true') # default is False, if given only the checkpoints are evaluated
+    parser.add_argument("-scs", "--sweep_stride", type=int, 
+                        default=1, required=False)
 
     args = parser.parse_args()
 
     print("Parsing experiment parameters ...\n")
     exp = Experiment(exp_param_file = args.exp_param_file)
     
+    if args.sweep_checkpoints:
+        print("Parsing successful. Evaluating Q-table checkpoints ...\n")
+        exp.sweep_checkpoints(stride = args.sweep_stride, 
+                              test_done_break = args.test_done_break)
+        print("Done")
+        exit()
+    
+    job_status = JobStatusStore(args.job_status) if args.job_status is not None else None
+
     print("Parsing successful. Running experiment ...\n")
-    exp.run(test_only = args.test_only, 
-            test_done_break = args.test_done_break,
-            test_qtable_episode = args.test_qtable_episode,
-            test_explore_rate = args.test_explore_rate,
-            test_savefig_format = args.test_savefig_format)
+    try:
+        exp.run(test_only = args.test_only, 
+                test_done_break = args.test_done_break,
+                test_qtable_episode = args.test_qtable_episode,
+                test_explore_rate = args.test_explore_rate,
+                test_savefig_format = args.test_savefig_format,
+                export_format = args.export_format,
+                export_dtype = args.export_dtype,
+                result_store = args.result_store,
+                record_transitions = args.record_transitions,
+                exact = args.exact,
+                job_status = job_status,
+                surrogate = args.surrogate,
+                surrogate_exact_fraction = args.surrogate_exact_fraction,
+                use_cache = not args.no_cache)
+    
+    except BaseException as e:
+        if job_status is not None:
+            job_status.fail(exp.exp_ID, repr(e))
+        raise
     
     print("Done")
\ No newline at end of file
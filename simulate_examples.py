@@ -1,9 +1,11 @@
 from polin.bacterial_env import BacterialEnv
 from polin.controller import RationalAgent
+from polin.sim_cache import SimulationCache, cache_key
 import polin.viz as viz
 
 import numpy as np
 import json
+import argparse
 
 import matplotlib.pyplot as plt
 
@@ -14,6 +16,50 @@ reward_kwargs = { "w_E": 1.0,
                   "w_D": 0.2
                   }
 
+def simulate(env_param_dict, step_time, sim_time, controller=None, reset=False, cache=None):
+    '''
+    Simulates an example without drug (if `controller` is None) or under a rational controller,
+    or reads it from the simulation cache if it is given & has it
+    '''
+    if cache is not None:
+        controller_spec = None if controller is None else {'type_name': controller.type_name,
+                                                          'Din': controller.Din, 'drug_time': controller.drug_time}
+        key = cache_key(env_param_dict, reward_kwargs, controller_spec,
+                        {'step_time': step_time, 'sim_time': sim_time, 'reset': reset})
+        cached = cache.get_simulation(key, env_param_dict)
+        if cached is not None:
+            return cached[0]
+
+    env = BacterialEnv(param_dict=env_param_dict, step_time=step_time,
+                       reward_func="minED", reward_kwargs=reward_kwargs,
+                       state_method="cont_E", n_states=None)
+
+    if reset:
+        env.reset_2_equilibria(eq_type="coexist")
+
+    state = env.state
+    e_return = 0.0
+
+    while env.tSol[-1] < sim_time:
+        if controller is not None:
+            action = controller.get_action(state)
+        else:
+            action = (0.0, step_time)
+        next_state, reward, done = env.step(action)
+        state = next_state
+        e_return += reward
+
+    if cache is not None:
+        cache.put_simulation(key, env, e_return)
+
+    return env
+
+parser = argparse.ArgumentParser(description="Simulating the examples")
+parser.add_argument("--no_cache", action='store_true') # default is False, if given the simulation cache is not used
+args = parser.parse_args()
+
+cache = None if args.no_cache else SimulationCache()
+
 # Demonstrating qualitative analysis results:
 # simulating with different inter-species interaction strengths &/ initial conditions
 exp_names = ["0_0", "neg_neg", "pos_pos", "bi_Edom", "bi_Zdom"]
@@ -24,11 +70,8 @@ for e in exp_names:
 
     with open(pfile) as f:
         env_param_dict = json.load(f)
-    
-    env = BacterialEnv(param_dict=env_param_dict, step_time=sim_time, 
-                       reward_func="minED", reward_kwargs=reward_kwargs,
-                       state_method="cont_E", n_states=None)
-    env.step(action = (0.0, sim_time))
+
+    env = simulate(env_param_dict, step_time=sim_time, sim_time=sim_time, cache=cache)
 
     fig = viz.visualize_simulation(env = env, st='full', tscale=60.0, title='auto')
     fig.savefig(example_dir + e + ".png", bbox_inches='tight')
@@ -48,25 +91,12 @@ for e in exp_names:
 
     with open(pfile) as f:
         env_param_dict = json.load(f)
-    
-    env = BacterialEnv(param_dict=env_param_dict, step_time=timestep, 
-                       reward_func="minED", reward_kwargs=reward_kwargs,
-                       state_method="cont_E", n_states=None)
-    
-    if e != "drug_mono":
-        env.reset_2_equilibria(eq_type="coexist")
-    
-    state = env.state
 
-    while env.tSol[-1] < sim_time:
-        if (e != "nodrug"):
-            action = controller.get_action(state)
-            next_state, reward, done = env.step(action)
-        else:
-            next_state, reward, done = env.step(action = (0.0, timestep))
-        state = next_state
+    env = simulate(env_param_dict, step_time=timestep, sim_time=sim_time,
+                   controller = controller if e != "nodrug" else None,
+                   reset = e != "drug_mono", cache=cache)
 
     print(f'{e}:     {env.t5p}')
-    
+
     fig = viz.visualize_simulation(env = env, st='full', tscale=60.0, title='auto')
-    fig.savefig(example_dir + e + ".png", bbox_inches='tight')
\ No newline at end of file
+    fig.savefig(example_dir + e + ".png", bbox_inches='tight')
@@ -0,0 +1,55 @@
+from polin.evaluation import sweep_experiment, best_checkpoint
+
+import pandas as pd
+
+import json
+import os
+import argparse
+from multiprocessing import Pool
+
+def sweep_task(args):
+    exp_dir, stride, done_break, batch_size = args
+    df = sweep_experiment(exp_dir, stride = stride, done_break = done_break, batch_size = batch_size)
+    return best_checkpoint(df)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Evaluating the saved Q-table checkpoints of all experiments in a collection & choosing the best checkpoint of each")
+
+    parser.add_argument("-f", "--collection_param_file", type=str, required=True)
+
+    parser.add_argument("-tdb", "--test_done_break", action='store_true') # default is False
+    parser.add_argument("-scs", "--sweep_stride", type=int,
+                        default=1, required=False)
+
+    parser.add_argument("-bs", "--batch_size", type=int,
+                        default=64, required=False) # number of checkpoints simulated together
+    parser.add_argument("-n", "--n_workers", type=int,
+                        default=1, required=False) # number of experiments swept in parallel
+
+    args = parser.parse_args()
+
+    with open(args.collection_param_file) as f:
+        collection_ID = json.load(f)['collection_ID']
+
+    # same collection directory as set by `parallel_experiments.py`
+    collection_dir = os.getcwd() + '/' + collection_ID + '/'
+    metadata = pd.read_csv(collection_dir + "metadata.tsv", sep='\t')
+
+    print(f"Evaluating Q-table checkpoints of collection {collection_ID} ...\n")
+
+    tasks = [(collection_dir + exp_ID + '/', args.sweep_stride, args.test_done_break, args.batch_size)
+             for exp_ID in metadata['exp_ID']]
+
+    with Pool(processes=args.n_workers) as pool:
+        best = pool.map(sweep_task, tasks)
+
+    df = pd.concat([metadata, pd.DataFrame(best).reset_index(drop=True)], axis=1)
+    df = df.rename(columns={'episode': 'best_episode'}).drop(columns=['policy_ID'])
+    df['best_episode'] = df['best_episode'].astype(int)
+
+    output_file = collection_dir + "best_checkpoints.tsv"
+    df.to_csv(output_file, sep='\t', index=False, na_rep='N/A')
+
+    print(f"Best checkpoints written to {output_file}")
+    print("Done")
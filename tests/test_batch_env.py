@@ -0,0 +1,47 @@
+from polin.train_test import TrainTest
+from polin.evaluation import rational_rollout, rational_grid
+
+import numpy as np
+import pytest
+
+from copy import deepcopy
+
+from test_fast_forward import load_sample
+
+alpha_pairs = [(0.02, 0.01), (-0.04, 0.0), (0.0, -0.05)]
+
+def env_param_dicts(param_dict):
+    dicts = []
+    for alpha_EZ, alpha_ZE in alpha_pairs:
+        env_param_dict = deepcopy(param_dict['env'])
+        env_param_dict['ode_params']['alpha_EZ'] = alpha_EZ
+        env_param_dict['ode_params']['alpha_ZE'] = alpha_ZE
+        dicts.append(env_param_dict)
+    return dicts
+
+def scalar_metrics(env_param_dict, sim_param_dict, Din, drug_time):
+    tt = TrainTest(env_param_dict, sim_param_dict, test_done_break = False)
+    tt.test_rational(Din = Din, drug_time = drug_time)
+    return {'e_return': tt.e_return,
+            't5p_first': tt.env.t5p[0] if len(tt.env.t5p) > 0 else np.nan,
+            'tTiny_first': tt.env.tTiny[0] if len(tt.env.tTiny) > 0 else np.nan}
+
+def assert_metrics_agree(batch, scalar):
+    # the solvers differ only in round-off: about 1e-10 in the return & 1e-7 min in the event times
+    assert batch['e_return'] == pytest.approx(scalar['e_return'], abs = 1e-8)
+    for m in ['t5p_first', 'tTiny_first']:
+        assert batch[m] == pytest.approx(scalar[m], abs = 1e-5, nan_ok = True)
+
+def test_batch_env_matches_scalar_env():
+    param_dict = load_sample("Rational")
+    Din, drug_time = param_dict['controller']['Din'], param_dict['controller']['drug_time']
+    dicts = env_param_dicts(param_dict)
+
+    n = len(dicts)
+    rollout = rational_rollout(dicts, np.full(n, Din), np.full(n, drug_time), param_dict['simulation'])
+    grid = rational_grid(dicts, [Din], [drug_time], param_dict['simulation']).sort_values('env_index')
+
+    for i, env_param_dict in enumerate(dicts):
+        scalar = scalar_metrics(env_param_dict, param_dict['simulation'], Din, drug_time)
+        assert_metrics_agree({m: rollout[m][i] for m in scalar}, scalar)
+        assert_metrics_agree({m: grid[m].iloc[i] for m in scalar}, scalar)
@@ -0,0 +1,56 @@
+from polin.train_test import TrainTest
+from polin.controller import ScheduleAgent
+
+import numpy as np
+import pytest
+
+import json
+import os
+
+sample_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sample_jsons")
+
+def load_sample(name):
+    with open(os.path.join(sample_dir, "exp_params.sample." + name + ".json")) as f:
+        return json.load(f)
+
+def simulate_schedule(param_dict, schedule, exact):
+    tt = TrainTest(param_dict['env'], param_dict['simulation'], test_done_break = False, exact = exact)
+    tt.agent = ScheduleAgent(schedule, drug_time = 180.0)
+    tt.env.reset_state_method(state_method = 'cont_E', n_states = None)
+    tt.simulate(sim_time = tt.simulation_time, done_break = False)
+    return tt
+
+def test_schedule_changing_after_fixed_point():
+    # no drug at the coexistence equilibrium is a fixed point, the schedule then starts dosing
+    param_dict = load_sample("OptimalControl")
+    schedule = [0.0] * 3 + [120.0] * 13
+
+    tt = simulate_schedule(param_dict, schedule, exact = False)
+    tt_exact = simulate_schedule(param_dict, schedule, exact = True)
+
+    assert tt.agent.i_step == len(schedule)
+    assert tt.env.total_drug_in == pytest.approx(tt_exact.env.total_drug_in)
+    assert tt.e_return == pytest.approx(tt_exact.e_return, rel = 1e-3)
+    assert tt.e_return > 0.0
+
+def test_rational_fast_forward_matches_exact():
+    param_dict = load_sample("Rational")
+
+    returns = []
+    for exact in [False, True]:
+        tt = TrainTest(param_dict['env'], param_dict['simulation'], test_done_break = False, exact = exact)
+        tt.test_rational(Din = 120.0, drug_time = 180.0)
+        returns.append(tt.e_return)
+
+    assert returns[0] == pytest.approx(returns[1], rel = 1e-3)
+
+def test_MPC_decides_every_step():
+    # without drug the state settles at a fixed point, MPC still takes (& records) every decision
+    param_dict = load_sample("MPC")
+    param_dict['simulation']['simulation_time'] = 6 * param_dict['simulation']['env_step_time']
+
+    tt = TrainTest(param_dict['env'], param_dict['simulation'], test_done_break = False)
+    tt.test_MPC({"Din_options": [0.0], "drug_time": 180.0, "horizon": 1})
+
+    assert tt.n_steps == 6
+    assert len(tt.agent.decisions) == 6
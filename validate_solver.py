@@ -0,0 +1,111 @@
+from parallel_experiments import ExperimentsCollection
+from polin.solver_validation import (candidate_settings, validate_settings, settings_table, failed_checks, plot_settings,
+                                     setting_name, setting_keys, default_setting, reference_setting, default_tolerances)
+
+import json
+import os
+import sys
+import argparse
+from copy import deepcopy
+
+def config_of(name, param_dict, Din, drug_time):
+    '''
+    Returns a configuration to validate: the env & simulation of a param file,
+    under its rational policy (or the given one, if the controller is not Rational)
+    '''
+    controller_dict = param_dict.get('controller', {})
+    if controller_dict.get('type_name') == 'Rational':
+        Din, drug_time = controller_dict['Din'], controller_dict['drug_time']
+    return (name, param_dict['env'], param_dict['simulation'], Din, drug_time)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Validating the accuracy vs. cost of ODE solver settings against a high-accuracy reference, "
+                                                 "with a pass/fail gate for changing the production settings")
+
+    parser.add_argument("-f", "--exp_param_files", type=str, nargs='+',
+                        default=[], required=False)
+    parser.add_argument("-c", "--collection_param_file", type=str,
+                        default=None, required=False) # adds the pairs of interaction coefficients of the collection
+
+    parser.add_argument("-m", "--methods", type=str, nargs='+',
+                        default=["LSODA"], required=False)
+    parser.add_argument("-ms", "--max_steps", type=float, nargs='+',
+                        default=[0.01, 0.1, 1.0, 10.0, float('inf')], required=False)
+    parser.add_argument("-rt", "--rtols", type=float, nargs='+',
+                        default=[1e-3, 1e-6, 1e-9], required=False) # atol is 1e-3 * rtol
+    parser.add_argument("-g", "--gate", type=str, nargs=4, metavar=("METHOD", "MAX_STEP", "RTOL", "ATOL"),
+                        default=None, required=False) # only validates this setting (& the production one), exits with 1 if it fails
+    parser.add_argument("-t", "--tolerances_file", type=str,
+                        default=None, required=False) # JSON overriding some of the default tolerances of the gate
+
+    parser.add_argument("-Din", "--Din", type=float,
+                        default=100.0, required=False) # rational policy of the param files whose controller is not Rational
+    parser.add_argument("-dt", "--drug_time", type=float,
+                        default=180.0, required=False)
+    parser.add_argument("-ns", "--n_states", type=int,
+                        default=22, required=False) # of the compared "disc_E" state sequences
+
+    parser.add_argument("-n", "--n_workers", type=int,
+                        default=1, required=False)
+    parser.add_argument("-o", "--output_dir", type=str,
+                        default="solver_validation", required=False)
+
+    args = parser.parse_args()
+
+    configs = []
+    for param_file in args.exp_param_files:
+        with open(param_file) as f:
+            param_dict = json.load(f)
+        configs.append(config_of(param_dict.get('exp_ID', param_file), param_dict, args.Din, args.drug_time))
+
+    if args.collection_param_file is not None:
+        collection = ExperimentsCollection(args.collection_param_file)
+        for a1 in collection.alpha_EZ_arr:
+            for a2 in collection.alpha_ZE_arr:
+                param_dict = deepcopy(collection.param_dict)
+                param_dict['env']['ode_params']['alpha_EZ'] = a1
+                param_dict['env']['ode_params']['alpha_ZE'] = a2
+                configs.append(config_of(f"alpha_EZ_{a1}_alpha_ZE_{a2}", param_dict, args.Din, args.drug_time))
+
+    if len(configs) == 0:
+        raise ValueError("No configuration to validate: give param files (-f) &/or a collection param file (-c)")
+
+    tolerances = dict(default_tolerances)
+    if args.tolerances_file is not None:
+        with open(args.tolerances_file) as f:
+            tolerances.update(json.load(f))
+
+    if args.gate is not None:
+        method, max_step, rtol, atol = args.gate
+        gate = {"method": method, "max_step": float(max_step), "rtol": float(rtol), "atol": float(atol)}
+        settings = [default_setting] + ([gate] if gate != default_setting else [])
+    else:
+        settings = candidate_settings(args.methods, args.max_steps, args.rtols)
+
+    print(f"Validating {len(settings)} solver settings x {len(configs)} configurations "
+          f"against {setting_name(reference_setting)} ...\n")
+
+    df = validate_settings(configs, settings, n_states = args.n_states, n_workers = args.n_workers)
+    table = settings_table(df, tolerances)
+
+    output_dir = os.path.join(os.getcwd(), args.output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    df.to_csv(os.path.join(output_dir, "solver_validation.tsv"), sep='\t', index=False, na_rep='N/A')
+    table.to_csv(os.path.join(output_dir, "solver_settings.tsv"), sep='\t', index=False, na_rep='N/A')
+
+    fig = plot_settings(table, tolerances)
+    fig.savefig(os.path.join(output_dir, "solver_pareto.png"), bbox_inches='tight')
+
+    print(table.drop(columns=setting_keys).to_string(index=False))
+    print(f"\nResults written to {output_dir}")
+
+    if args.gate is not None:
+        failed = failed_checks(table, gate, tolerances)
+        if failed:
+            print(f"\nFAIL: {setting_name(gate)}\n  " + "\n  ".join(failed))
+            sys.exit(1)
+        print(f"\nPASS: {setting_name(gate)}")
+
+    print("Done")